@@ -1,48 +1,223 @@
+import argparse
+import codecs
+import io
 import os
-import sys
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def collect_project_structure(root_dir):
-    output = []
-    
+# Files larger than this are cut off after this many bytes
+DEFAULT_MAX_FILE_SIZE = 1024 * 1024
+# Bytes looked at to tell text from binary
+SNIFF_SIZE = 8192
+# Files read ahead of the writer per worker thread; bounds memory use
+READ_AHEAD = 4
+ALWAYS_SKIPPED = {'.git'}
+
+
+def _translate(pattern):
+    """Regex source for one gitignore glob ("*" and "?" stop at "/", "**" does not)."""
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            members = pattern[i + 1:end]
+            if members.startswith("!"):
+                members = "^" + members[1:]
+            regex += "[" + members.replace("\\", "\\\\") + "]"
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
+
+
+class IgnoreRules:
+    """The .gitignore patterns in effect for one directory, including its parents'.
+
+    Supports comments, negation with "!", directory-only patterns ending in
+    "/", patterns anchored by a "/" and "**". Paths are relative to the root
+    and use "/".
+    """
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+
+    def child(self, directory, relative_dir):
+        """The rules for `directory`: these plus its own .gitignore, if any."""
+        try:
+            with open(os.path.join(directory, ".gitignore"), encoding="utf-8", errors="replace") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return self
+        prefix = re.escape(relative_dir + "/") if relative_dir else ""
+        rules = list(self.rules)
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            elif line.startswith("\\"):
+                line = line[1:]
+            directory_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            if "/" in line:
+                regex = prefix + _translate(line.lstrip("/"))
+            else:
+                regex = prefix + "(?:.*/)?" + _translate(line)
+            rules.append((re.compile(regex + "$"), negated, directory_only))
+        return IgnoreRules(rules)
+
+    def ignored(self, relative_path, is_dir):
+        # The last matching pattern wins
+        result = False
+        for regex, negated, directory_only in self.rules:
+            if directory_only and not is_dir:
+                continue
+            if regex.match(relative_path):
+                result = not negated
+        return result
+
+
+def walk_project(root_dir, use_gitignore=True, skip=()):
+    """Yield ("dir", relative path) and ("file", relative path, path) in sorted order.
+
+    Ignored directories are pruned before they are entered. `skip` holds
+    absolute paths to leave out, such as the output file.
+    """
+    skip = {os.path.abspath(path) for path in skip}
+    rules = {root_dir: IgnoreRules().child(root_dir, "") if use_gitignore else IgnoreRules()}
     for dirpath, dirnames, filenames in os.walk(root_dir):
-        # Skip .git directories
-        if '.git' in dirpath:
-            continue
-        
-        # Add directory structure
-        relative_path = os.path.relpath(dirpath, root_dir)
-        if relative_path != '.':
-            output.append(f"\n# Directory: {relative_path}")
-        
-        # Add file contents
-        for filename in filenames:
-            # Skip .git files
-            if filename.endswith('.git'):
+        relative_dir = os.path.relpath(dirpath, root_dir).replace(os.sep, "/")
+        relative_dir = "" if relative_dir == "." else relative_dir
+        dir_rules = rules.pop(dirpath)
+        if relative_dir:
+            yield ("dir", relative_dir)
+
+        def relative(name):
+            return f"{relative_dir}/{name}" if relative_dir else name
+
+        kept = []
+        for name in sorted(dirnames):
+            path = os.path.join(dirpath, name)
+            if name in ALWAYS_SKIPPED or dir_rules.ignored(relative(name), True):
+                continue
+            kept.append(name)
+            rules[path] = dir_rules.child(path, relative(name)) if use_gitignore else dir_rules
+        dirnames[:] = kept
+
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if name in ALWAYS_SKIPPED or name.endswith(".git") or os.path.abspath(path) in skip:
                 continue
-            
-            file_path = os.path.join(dirpath, filename)
-            relative_file_path = os.path.relpath(file_path, root_dir)
-            
-            try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    output.append(f"\n# File: {relative_file_path}\n```\n{content}\n```\n")
-            except Exception as e:
-                output.append(f"\n# File: {relative_file_path}\n```\nError reading file: {str(e)}\n```\n")
-    
-    return "\n".join(output)
+            if dir_rules.ignored(relative(name), False):
+                continue
+            yield ("file", relative(name), path)
+
+
+def looks_binary(head, complete):
+    """True if `head`, the start of a file (or all of it if `complete`), has a NUL byte or is not UTF-8."""
+    if b"\0" in head:
+        return True
+    try:
+        # Unless this is the whole file, a character may be cut at the end of the sniffed bytes
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=complete)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def read_file(path, max_file_size=DEFAULT_MAX_FILE_SIZE):
+    """The text to show for one file: its content, or a note if it is binary, too large or unreadable."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read(max_file_size + 1)
+            size = os.fstat(f.fileno()).st_size
+    except OSError as e:
+        return f"Error reading file: {str(e)}"
+    if looks_binary(data[:SNIFF_SIZE], len(data) <= SNIFF_SIZE):
+        return f"Binary file skipped ({size} bytes)"
+    content = data[:max_file_size].decode("utf-8", errors="replace")
+    if size > max_file_size:
+        content += f"\n... truncated ({size} bytes, showing the first {max_file_size})"
+    return content
+
+
+def write_project_structure(root_dir, out, max_file_size=DEFAULT_MAX_FILE_SIZE, workers=8, use_gitignore=True, skip=()):
+    """Write the directories and file contents below `root_dir` to the text stream `out`.
+
+    Files are read by `workers` threads, at most a few per thread ahead of
+    the writer, and written in walk order, so the output is deterministic
+    and memory stays bounded however large the tree is.
+    """
+    # Entries in walk order: (directory, None) or (file, future of its content)
+    pending = deque()
+    first = True
+
+    def drain(limit):
+        nonlocal first
+        while len(pending) > limit:
+            relative_path, content = pending.popleft()
+            if not first:
+                out.write("\n")
+            first = False
+            if content is None:
+                out.write(f"\n# Directory: {relative_path}")
+            else:
+                out.write(f"\n# File: {relative_path}\n```\n{content.result()}\n```\n")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for entry in walk_project(root_dir, use_gitignore, skip):
+            if entry[0] == "dir":
+                pending.append((entry[1], None))
+            else:
+                pending.append((entry[1], executor.submit(read_file, entry[2], max_file_size)))
+            drain(workers * READ_AHEAD)
+        drain(0)
+
+
+def collect_project_structure(root_dir, **options):
+    output = io.StringIO()
+    write_project_structure(root_dir, output, **options)
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the project's directories and file contents to one text file.")
+    parser.add_argument("output_file")
+    parser.add_argument("--root", default=os.getcwd(), help="Directory to collect (default: the current directory)")
+    parser.add_argument("--max-file-size", type=int, default=DEFAULT_MAX_FILE_SIZE,
+                        help=f"Bytes shown per file before it is cut off (default: {DEFAULT_MAX_FILE_SIZE})")
+    parser.add_argument("--workers", type=int, default=8, help="Threads reading files (default: 8)")
+    parser.add_argument("--no-gitignore", action="store_true", help="Include files that .gitignore excludes")
+    args = parser.parse_args()
+
+    with open(args.output_file, 'w', encoding='utf-8') as f:
+        write_project_structure(args.root, f, args.max_file_size, args.workers, not args.no_gitignore,
+                                skip=[args.output_file])
+
+    print(f"Project structure and contents have been written to {args.output_file}")
+
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python project_structure_collector.py <output_file>")
-        sys.exit(1)
-    
-    root_dir = os.getcwd()
-    output_file = sys.argv[1]
-    
-    project_structure = collect_project_structure(root_dir)
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(project_structure)
-    
-    print(f"Project structure and contents have been written to {output_file}")
\ No newline at end of file
+    main()
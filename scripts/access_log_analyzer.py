@@ -0,0 +1,249 @@
+import argparse
+import glob
+import json
+import logging
+import math
+import os
+import re
+import time
+from collections import Counter
+from datetime import datetime
+from metrics_exporter import MetricsExporter
+
+DEFAULT_LOG_DIR = "/var/log/apache2"
+DEFAULT_STATE_FILE = "/var/lib/do-manager/access_log_offsets.json"
+ACCESS_LOG_SUFFIX = "_access.log"
+# Apache's own catch-all log, not a project
+IGNORED_LOGS = {"other_vhosts"}
+
+# The "combined" format with the optional trailing %D (microseconds) that
+# the vhosts written by deploy_web_app.py add
+QUOTED = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+LINE = re.compile(rb'^\S+ \S+ \S+ \[([^\]]+)\] ' + QUOTED + rb' (\d{3}) (\d+|-) ' + QUOTED + rb' ' + QUOTED +
+                  rb'(?: (\d+))?\s*$')
+LOG_TIME_FORMAT = "%d/%b/%Y:%H:%M:%S %z"
+# Relative accuracy of the latency percentiles
+SKETCH_ACCURACY = 0.01
+REPORT_PERCENTILES = (50, 95, 99)
+
+
+class QuantileSketch:
+    """Latency histogram with logarithmic buckets (as in DDSketch); quantiles are within SKETCH_ACCURACY."""
+
+    def __init__(self, accuracy=SKETCH_ACCURACY):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = Counter()
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zeros += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self.log_gamma)] += 1
+
+    def quantile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # Midpoint of the bucket in relative terms
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class ProjectStats:
+    """Request count, status mix, bytes and latency of one project's access log lines."""
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = Counter()
+        self.bytes = 0
+        self.latency = QuantileSketch()
+        self.first_time = None
+        self.last_time = None
+
+    def add(self, log_time, status, size, microseconds):
+        self.requests += 1
+        self.statuses[f"{status[0]}xx"] += 1
+        self.bytes += size
+        if microseconds is not None:
+            self.latency.add(microseconds)
+        # Kept as text; only the first and last are ever parsed
+        if self.first_time is None:
+            self.first_time = log_time
+        self.last_time = log_time
+
+    def rate(self, elapsed=None):
+        """Requests per second over `elapsed` seconds, or over the span of the lines seen."""
+        if elapsed is None and self.first_time:
+            elapsed = (datetime.strptime(self.last_time, LOG_TIME_FORMAT) -
+                       datetime.strptime(self.first_time, LOG_TIME_FORMAT)).total_seconds()
+        return self.requests / elapsed if elapsed else float(self.requests)
+
+    def latency_ms(self, percentile):
+        value = self.latency.quantile(percentile / 100)
+        return None if value is None else value / 1000
+
+
+def load_offsets(state_file):
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_offsets(state_file, offsets):
+    os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+    tmp_path = state_file + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(offsets, f, indent=2)
+    os.replace(tmp_path, state_file)
+
+
+def _read_from(path, offset, checkpoint):
+    """Yield the complete lines of `path` after `offset`, advancing checkpoint["offset"]."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                return
+            checkpoint["offset"] += len(line)
+            yield line
+
+
+def tail_lines(path, checkpoint):
+    """Yield the lines appended to `path` since `checkpoint` ({"inode", "offset"}), updated in place.
+
+    After a rotation the rest of the old file is read from `path`.1 first.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return
+    inode, offset = checkpoint.get("inode"), checkpoint.get("offset", 0)
+    if inode is not None and inode != stat.st_ino:
+        rotated = f"{path}.1"
+        try:
+            if os.stat(rotated).st_ino == inode:
+                yield from _read_from(rotated, offset, checkpoint)
+            else:
+                logging.warning(f"{path} was rotated and its previous file is gone; "
+                                f"lines written after the last pass were skipped")
+        except FileNotFoundError:
+            logging.warning(f"{path} was rotated and {rotated} is missing; lines written after the last pass were skipped")
+        offset = 0
+    elif stat.st_size < offset:
+        logging.info(f"{path} was truncated; reading it from the start")
+        offset = 0
+
+    checkpoint["inode"], checkpoint["offset"] = stat.st_ino, offset
+    yield from _read_from(path, offset, checkpoint)
+
+
+def parse_lines(lines):
+    """Yield (time text, status, bytes, microseconds or None) for every line in the expected format."""
+    for line in lines:
+        match = LINE.match(line)
+        if not match:
+            continue
+        log_time, status, size, microseconds = match.groups()
+        yield (log_time.decode("ascii", "replace"), status.decode(), int(size) if size != b"-" else 0,
+               int(microseconds) if microseconds else None)
+
+
+def project_logs(log_dir):
+    """{project: access log path} for every project log in `log_dir`."""
+    logs = {}
+    for path in glob.glob(os.path.join(log_dir, f"*{ACCESS_LOG_SUFFIX}")):
+        project = os.path.basename(path)[:-len(ACCESS_LOG_SUFFIX)]
+        if project not in IGNORED_LOGS:
+            logs[project] = path
+    return logs
+
+
+def analyze(log_dir, offsets):
+    """Read every project's new access log lines once into {project: ProjectStats}, advancing `offsets`."""
+    results = {}
+    for project, path in sorted(project_logs(log_dir).items()):
+        stats = ProjectStats()
+        for record in parse_lines(tail_lines(path, offsets.setdefault(path, {}))):
+            stats.add(*record)
+        results[project] = stats
+    return results
+
+
+def format_report(results, elapsed=None):
+    header = f"{'project':<24} {'requests':>9} {'req/s':>8} {'2xx':>7} {'3xx':>7} {'4xx':>7} {'5xx':>7} {'MB':>9} " + \
+             " ".join(f"{f'p{percentile} ms':>9}" for percentile in REPORT_PERCENTILES)
+    lines = [header]
+    for project, stats in sorted(results.items()):
+        latencies = [stats.latency_ms(percentile) for percentile in REPORT_PERCENTILES]
+        lines.append(f"{project:<24} {stats.requests:>9} {stats.rate(elapsed):>8.2f} " +
+                     " ".join(f"{stats.statuses[status]:>7}" for status in ("2xx", "3xx", "4xx", "5xx")) +
+                     f" {stats.bytes / 2**20:>9.1f} " +
+                     " ".join(f"{latency:>9.1f}" if latency is not None else f"{'-':>9}" for latency in latencies))
+    return "\n".join(lines)
+
+
+def export_access_metrics(exporter, results, elapsed):
+    exporter.update("project_requests_per_second", "gauge", "Requests per second over the last interval",
+                    [({"project": project}, stats.rate(elapsed)) for project, stats in sorted(results.items())])
+    exporter.update("project_responses", "gauge", "Responses by status class over the last interval",
+                    [({"project": project, "status": status}, stats.statuses[status])
+                     for project, stats in sorted(results.items()) for status in ("2xx", "3xx", "4xx", "5xx")])
+    exporter.update("project_response_bytes", "gauge", "Response bytes over the last interval",
+                    [({"project": project}, stats.bytes) for project, stats in sorted(results.items())])
+    exporter.update("project_latency_seconds", "gauge", "Request latency percentiles over the last interval",
+                    [({"project": project, "quantile": f"{percentile / 100:g}"}, stats.latency_ms(percentile) / 1000)
+                     for project, stats in sorted(results.items()) for percentile in REPORT_PERCENTILES
+                     if stats.latency.count])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-project request rate, status mix, bytes and latency "
+                                                 "from the Apache access logs, reading only what is new.")
+    parser.add_argument("--log-dir", default=DEFAULT_LOG_DIR, help="Directory with the <project>_access.log files")
+    parser.add_argument("--state-file", default=DEFAULT_STATE_FILE, help="Where read offsets are kept between runs")
+    parser.add_argument("--follow", action="store_true", help="Keep reading new lines and report every interval")
+    parser.add_argument("--interval", type=float, default=60, help="Seconds between reports with --follow")
+    parser.add_argument("--metrics-port", type=int, help="With --follow, serve OpenMetrics on this port at /metrics")
+    parser.add_argument("--metrics-address", default="127.0.0.1", help="Address the metrics endpoint listens on")
+    args = parser.parse_args()
+
+    offsets = load_offsets(args.state_file)
+    if not args.follow:
+        results = analyze(args.log_dir, offsets)
+        save_offsets(args.state_file, offsets)
+        print(format_report(results))
+        return
+
+    exporter = None
+    if args.metrics_port:
+        exporter = MetricsExporter(args.metrics_port, args.metrics_address)
+        exporter.start()
+    # The first pass catches up on everything since the last run, so its rate
+    # comes from the log timestamps rather than the time the pass took
+    last_pass = None
+    while True:
+        results = analyze(args.log_dir, offsets)
+        save_offsets(args.state_file, offsets)
+        elapsed = time.monotonic() - last_pass if last_pass else None
+        last_pass = time.monotonic()
+        print(time.strftime("%Y-%m-%d %H:%M:%S"))
+        print(format_report(results, elapsed), flush=True)
+        if exporter:
+            export_access_metrics(exporter, results, elapsed)
+        time.sleep(max(args.interval - (time.monotonic() - last_pass), 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import itertools
+import json
+import logging
+import os
+import secrets
+import socket
+import subprocess
+import tempfile
+import threading
+from droplet_agent import AGENT_PORT, TOKEN_FILE, start_agent
+from ssh_transport import get_transport
+
+
+class AgentError(Exception):
+    """An error the droplet agent returned for a call."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class AgentClient:
+    """JSON-RPC client for one droplet agent over a single stream.
+
+    The stream is an SSH channel (or, in loopback mode, a socket) that stays
+    open, so each call is one request line and one response line on an
+    existing connection. `batch` sends several calls in one line.
+    """
+
+    def __init__(self, stream, token):
+        self.stream = stream
+        self.reader = stream.makefile("rb")
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self._exchange({"jsonrpc": "2.0", "id": 0, "method": "auth", "params": {"token": token}})
+
+    def _exchange(self, message):
+        with self.lock:
+            self.stream.sendall(json.dumps(message).encode("utf-8") + b"\n")
+            line = self.reader.readline()
+        if not line:
+            raise ConnectionError("The droplet agent closed the connection")
+        response = json.loads(line)
+        for item in response if isinstance(response, list) else [response]:
+            if "error" in item and item.get("id") == 0:
+                raise AgentError(item["error"]["code"], item["error"]["message"])
+        return response
+
+    @staticmethod
+    def _result(response):
+        if "error" in response:
+            raise AgentError(response["error"]["code"], response["error"]["message"])
+        return response["result"]
+
+    def call(self, method, **params):
+        self.calls += 1
+        return self._result(self._exchange({"jsonrpc": "2.0", "id": next(self.ids), "method": method,
+                                            "params": params}))
+
+    def batch(self, calls):
+        """Run [(method, params), ...] in one round trip; returns their results in order."""
+        if not calls:
+            return []
+        self.calls += len(calls)
+        requests = [{"jsonrpc": "2.0", "id": next(self.ids), "method": method, "params": params}
+                    for method, params in calls]
+        responses = {response["id"]: response for response in self._exchange(requests)}
+        return [self._result(responses[request["id"]]) for request in requests]
+
+    def close(self):
+        self.reader.close()
+        self.stream.close()
+
+
+_agents = {}
+_agents_lock = threading.Lock()
+_loopback = None
+
+
+def _loopback_server():
+    # One in-process agent shared by every host, rooted in DO_MANAGER_AGENT_ROOT
+    # (a new temporary directory by default)
+    global _loopback
+    if _loopback is None:
+        base_dir = os.getenv("DO_MANAGER_AGENT_ROOT") or tempfile.mkdtemp(prefix="do-manager-agent-")
+        _loopback = start_agent(secrets.token_hex(32), base_dir, port=0)
+    return _loopback
+
+
+def _connect(host):
+    mode = os.getenv("DO_MANAGER_AGENT", "ssh")
+    if mode == "off":
+        return None
+    if mode == "loopback":
+        server = _loopback_server()
+        return AgentClient(socket.create_connection(server.server_address), server.token)
+    transport = get_transport(host)
+    token = transport.read_file(TOKEN_FILE).decode("utf-8").strip()
+    return AgentClient(transport.open_tunnel(AGENT_PORT), token)
+
+
+def get_agent(host):
+    """Return the shared agent client for `host`, or None if the droplet has no agent.
+
+    Callers fall back to the shell scripts when this returns None. Set
+    DO_MANAGER_AGENT=loopback to use an in-process agent instead (for tests),
+    or DO_MANAGER_AGENT=off to never use one.
+    """
+    with _agents_lock:
+        if host not in _agents:
+            try:
+                _agents[host] = _connect(host)
+            except (subprocess.CalledProcessError, OSError, ValueError, AgentError) as e:
+                logging.info(f"No droplet agent on {host} ({e}); using the shell scripts")
+                _agents[host] = None
+        return _agents[host]
+
+
+def forget_agent(host):
+    """Drop the client for `host` after a connection error, so the next call reconnects."""
+    with _agents_lock:
+        agent = _agents.pop(host, None)
+    if agent is not None:
+        try:
+            agent.close()
+        except OSError:
+            pass
+
+
+def agent_call(host, method, **params):
+    """Call `method` on the droplet's agent; returns (True, result), or (False, None) without an agent."""
+    agent = get_agent(host)
+    if agent is None:
+        return False, None
+    try:
+        return True, agent.call(method, **params)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Droplet agent on {host} failed ({e}); using the shell scripts")
+        forget_agent(host)
+        return False, None
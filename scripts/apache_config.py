@@ -0,0 +1,127 @@
+import hashlib
+import shlex
+import subprocess
+from ssh_transport import get_transport
+
+SITES_AVAILABLE = "/etc/apache2/sites-available"
+# Apache's "combined" format plus %D, the time taken to serve the request in
+# microseconds, which access_log_analyzer.py reads for per-project latency
+ACCESS_LOG_FORMAT = r'"%h %l %u %t \"%r\" %>s %O \"%{Referer}i\" \"%{User-Agent}i\" %D"'
+
+# Prints "<site> <sha256 or -> <enabled 0/1>" for every site passed as an argument.
+STATUS_SCRIPT = r"""
+for site in "$@"; do
+    conf="/etc/apache2/sites-available/$site.conf"
+    if [ -f "$conf" ]; then digest=$(sha256sum "$conf" | cut -c1-64); else digest=-; fi
+    if [ -e "/etc/apache2/sites-enabled/$site.conf" ]; then enabled=1; else enabled=0; fi
+    echo "$site $digest $enabled"
+done
+"""
+
+# Moves the staged files into place, enables new sites, validates the whole
+# configuration once and reloads gracefully once. If configtest fails every
+# file is restored and newly enabled sites are disabled again.
+APPLY_SCRIPT = r"""
+cd /etc/apache2/sites-available
+for site in $CHANGED; do
+    if [ -f "$site.conf" ]; then cp -p "$site.conf" "$site.conf.previous"; fi
+    mv "$site.conf.staged" "$site.conf"
+done
+[ -z "$TO_ENABLE" ] || a2ensite -q $(for site in $TO_ENABLE; do printf '%s.conf ' "$site"; done) >/dev/null
+if ! apachectl configtest; then
+    echo "Apache configuration test failed; restoring the previous configuration." >&2
+    [ -z "$TO_ENABLE" ] || a2dissite -q $(for site in $TO_ENABLE; do printf '%s.conf ' "$site"; done) >/dev/null
+    for site in $CHANGED; do
+        if [ -f "$site.conf.previous" ]; then mv "$site.conf.previous" "$site.conf"; else rm -f "$site.conf"; fi
+    done
+    exit 1
+fi
+for site in $CHANGED; do rm -f "$site.conf.previous"; done
+apachectl graceful
+"""
+
+
+class ApacheConfigBatch:
+    """Vhosts rendered locally for one droplet, applied with a single reload.
+
+    Only files whose content differs from what is on the droplet are written,
+    and Apache is validated and reloaded once per `apply()` — not at all when
+    nothing changed.
+    """
+
+    def __init__(self, droplet_ip):
+        self.droplet_ip = droplet_ip
+        self.sites = {}
+        self.callbacks = {}
+
+    def add_site(self, site_name, config, on_applied=None):
+        """Stage a vhost; `on_applied()` is called by commit() once it is live and should return True on success."""
+        self.sites[site_name] = config
+        if on_applied is not None:
+            self.callbacks[site_name] = on_applied
+
+    def remote_status(self):
+        if not self.sites:
+            return {}
+        names = " ".join(shlex.quote(name) for name in self.sites)
+        result = get_transport(self.droplet_ip).run(f"bash -s -- {names}", input=STATUS_SCRIPT,
+                                                    capture_output=True, check=True)
+        status = {}
+        for line in result.stdout.splitlines():
+            site_name, digest, enabled = line.split()
+            status[site_name] = (None if digest == "-" else digest, enabled == "1")
+        return status
+
+    def apply(self):
+        """Push changed vhosts and reload once; returns the names of the sites that changed."""
+        transport = get_transport(self.droplet_ip)
+        status = self.remote_status()
+
+        changed, to_enable = [], []
+        for site_name, config in self.sites.items():
+            remote_digest, enabled = status.get(site_name, (None, False))
+            if hashlib.sha256(config.encode('utf-8')).hexdigest() != remote_digest:
+                changed.append(site_name)
+            if not enabled:
+                to_enable.append(site_name)
+
+        if not changed and not to_enable:
+            self.sites.clear()
+            return []
+
+        for site_name in changed:
+            transport.write_file(f"{SITES_AVAILABLE}/{site_name}.conf.staged", self.sites[site_name])
+        script = (f"CHANGED={shlex.quote(' '.join(changed))}\n"
+                  f"TO_ENABLE={shlex.quote(' '.join(to_enable))}\n") + APPLY_SCRIPT
+        transport.run("bash -s", input=script, check=True)
+        self.sites.clear()
+        return changed
+
+    def commit(self):
+        """Apply the batch and run each site's on_applied callback; returns {site name: True/False}.
+
+        If the combined configtest fails, the sites are applied again one at
+        a time, so only the broken vhosts fail and the rest still go live.
+        """
+        sites, callbacks = dict(self.sites), dict(self.callbacks)
+        self.callbacks.clear()
+        failed = set()
+        try:
+            self.apply()
+        except subprocess.CalledProcessError as e:
+            self.sites.clear()
+            print(f"Apache rejected the batch of {len(sites)} vhost(s) ({e}); applying them one at a time...")
+            for site_name, config in sites.items():
+                single = ApacheConfigBatch(self.droplet_ip)
+                single.add_site(site_name, config)
+                try:
+                    single.apply()
+                except subprocess.CalledProcessError as e:
+                    print(f"Error: Apache rejected the configuration of '{site_name}': {e}")
+                    failed.add(site_name)
+        results = {}
+        for site_name in sites:
+            results[site_name] = site_name not in failed
+            if results[site_name] and site_name in callbacks:
+                results[site_name] = bool(callbacks[site_name]())
+        return results
@@ -0,0 +1,82 @@
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+from golden_image import BAKE_CLEANUP_STEPS, load_golden_image, save_golden_image, snapshot_droplet
+from initial_setup import (SetupError, cleanup_resources, create_droplet, setup_do_credentials,
+                           setup_droplet, setup_droplet_agent, setup_project_management)
+from provisioning import run_provisioning
+
+BUILDER_TAG = "golden-image-builder"
+
+def bake_golden_image(token, snapshot_name, region, size, base_image, keep_builder=False):
+    """Provision a throwaway droplet once and snapshot it.
+
+    Returns the golden image record that was saved to config/golden_image.json.
+    """
+    try:
+        droplet = create_droplet(token, f"{snapshot_name}-builder", region, size, base_image, tags=[BUILDER_TAG])
+    except SetupError as e:
+        if not keep_builder:
+            for builder in e.droplets:
+                cleanup_resources(builder)
+        raise
+    try:
+        setup_droplet(droplet)
+        setup_project_management(droplet)
+        setup_do_credentials(droplet)
+        setup_droplet_agent(droplet)
+        try:
+            run_provisioning(droplet.ip_address, "bake_cleanup", BAKE_CLEANUP_STEPS)
+        except subprocess.CalledProcessError as e:
+            raise SetupError(f"Failed to clean up the builder droplet: {e}")
+
+        snapshot_id = snapshot_droplet(droplet, snapshot_name)
+        record = {
+            "snapshot_id": snapshot_id,
+            "name": snapshot_name,
+            "regions": [region],
+            "size": size,
+            "base_image": base_image,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        save_golden_image(record)
+        logging.info(f"Golden image '{snapshot_name}' recorded with snapshot ID {snapshot_id}.")
+        return record
+    finally:
+        if not keep_builder:
+            cleanup_resources(droplet)
+
+def main():
+    parser = argparse.ArgumentParser(description="Provision a droplet once and snapshot it as the golden image for new droplets.")
+    parser.add_argument("--name", default=f"do-manager-golden-{time.strftime('%Y%m%d')}", help="Snapshot name")
+    parser.add_argument("--region", default="nyc1", help="Region of the builder droplet and the snapshot")
+    parser.add_argument("--size", default="s-1vcpu-1gb", help="Size of the builder droplet")
+    parser.add_argument("--base-image", default="ubuntu-20-04-x64", help="Image the builder droplet starts from")
+    parser.add_argument("--keep-builder", action="store_true", help="Do not destroy the builder droplet afterwards")
+    args = parser.parse_args()
+
+    token = os.getenv("DO_TOKEN")
+    if not token:
+        print("DigitalOcean API token not found. Please make sure you've set the DO_TOKEN environment variable.")
+        sys.exit(1)
+
+    previous = load_golden_image()
+    if previous:
+        print(f"Replacing the recorded golden image '{previous['name']}' (snapshot {previous['snapshot_id']}).")
+
+    print(f"Baking golden image '{args.name}' from {args.base_image} in {args.region}. This takes a while...")
+    try:
+        record = bake_golden_image(token, args.name, args.region, args.size, args.base_image, args.keep_builder)
+    except (SetupError, RuntimeError) as e:
+        logging.error(f"Baking the golden image failed: {e}")
+        print(f"Baking the golden image failed: {e}")
+        sys.exit(1)
+
+    print(f"Golden image ready: snapshot {record['snapshot_id']} in {', '.join(record['regions'])}.")
+    print("scripts/initial_setup.py will now offer it as the default image for new droplets in that region.")
+
+if __name__ == "__main__":
+    main()
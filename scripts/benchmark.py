@@ -0,0 +1,269 @@
+# Benchmarks droplet setup, deploy_project and gather_and_output_info without
+# real droplets: every SSH connection goes to a fake droplet (fake_droplet.py)
+# and every API call to the fake DigitalOcean API, both behind a simulated
+# network. Each phase of each scenario reports its wall time, round trips,
+# bytes moved and API requests; results can be saved as a baseline and later
+# runs compared against it.
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import deployment_info_cache
+import registry_cache
+from deploy_web_app import deploy_projects
+from fake_do_api import start_fake_api
+from fake_droplet import FakeDroplet, Meter, NetworkProfile, fake_transport_factory
+from gather_deployment_info import DEPENDENCY_FILES, ENTRY_POINT_FILES, gather_and_output_info
+from initial_setup import (SetupError, create_droplet, setup_do_credentials, setup_droplet, setup_droplet_agent,
+                           setup_project_management)
+from ssh_transport import set_transport_factory
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "benchmarks", "baseline.json")
+SCENARIOS = (1, 10, 100)
+PHASES = ("setup_droplet", "deploy_initial", "gather_cold", "deploy_unchanged", "deploy_changed", "gather_warm")
+PROJECT_TYPES = ("python", "node", "php", "static")
+FILES_PER_PROJECT = 12
+LINES_PER_FILE = 60
+
+# How much worse than the baseline a metric may get before it counts as a
+# regression: baseline * relative + absolute. Counts are deterministic for a
+# given seed; byte counts move a little with timestamps in archives and
+# registry records, and wall time with the machine.
+DEFAULT_THRESHOLDS = {
+    "round_trips": {"relative": 0.0, "absolute": 0},
+    "api_requests": {"relative": 0.0, "absolute": 0},
+    "bytes_sent": {"relative": 0.05, "absolute": 1024},
+    "bytes_received": {"relative": 0.05, "absolute": 1024},
+    "errors": {"relative": 0.0, "absolute": 0},
+    "wall_seconds": {"relative": 0.25, "absolute": 0.5},
+}
+
+
+def make_project(local_dir, name, project_type):
+    """Write a small project of `project_type` with FILES_PER_PROJECT files to `local_dir`."""
+    paths = [".env", "logging.conf", ENTRY_POINT_FILES.get(project_type, "index.html")]
+    if project_type in DEPENDENCY_FILES:
+        paths.append(DEPENDENCY_FILES[project_type])
+    paths += [f"src/module_{index}.txt" for index in range(FILES_PER_PROJECT - len(paths))]
+    for path in paths:
+        os.makedirs(os.path.dirname(os.path.join(local_dir, path)), exist_ok=True)
+        with open(os.path.join(local_dir, path), "w") as f:
+            f.writelines(f"{name} {path} line {line}\n" for line in range(LINES_PER_FILE))
+
+
+@contextlib.contextmanager
+def measure(results, phase, meter, api):
+    """Record the cost of the block as `results[phase]`; the block appends failed items to the yielded list."""
+    errors = []
+    before = meter.snapshot()
+    api_before = (len(api.requests), api.bytes_received + api.bytes_sent, api.failed)
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield errors
+    wall_seconds = time.perf_counter() - started
+    after = meter.snapshot()
+    results[phase] = {
+        "wall_seconds": round(wall_seconds, 3),
+        "network_seconds": round(after["network_seconds"] - before["network_seconds"], 3),
+        "round_trips": after["round_trips"] - before["round_trips"],
+        "bytes_sent": after["bytes_sent"] - before["bytes_sent"],
+        "bytes_received": after["bytes_received"] - before["bytes_received"],
+        "failures": after["failures"] - before["failures"],
+        "api_requests": len(api.requests) - api_before[0],
+        "api_bytes": api.bytes_received + api.bytes_sent - api_before[1],
+        "api_failures": api.failed - api_before[2],
+        "errors": len(errors),
+    }
+
+
+def run_scenario(project_count, host, workdir, droplets, meter, api_options, agent=True):
+    """Set up a fake droplet at `host` and deploy and inspect `project_count` projects on it."""
+    droplets[host] = FakeDroplet(host, os.path.join(workdir, "droplets", host), agent)
+    server, end_point = start_fake_api(droplet_ip=host, boot_seconds=0, action_seconds=0, **api_options)
+    os.environ["DIGITALOCEAN_END_POINT"] = end_point
+    projects = []
+    for index in range(project_count):
+        name = f"bench{index:03d}"
+        project_type = PROJECT_TYPES[index % len(PROJECT_TYPES)]
+        local_dir = os.path.join(workdir, "projects", host, name)
+        make_project(local_dir, name, project_type)
+        projects.append((name, project_type, local_dir))
+
+    def deploy_all(errors):
+        # One Apache batch per pass, as deploy_web_app.py --project ... does
+        results = deploy_projects(host, projects, gather_info=False)
+        errors.extend(name for name, ok in results.items() if not ok)
+
+    def gather_all(errors):
+        for name, project_type, _ in projects:
+            if not gather_and_output_info(name, project_type, host):
+                errors.append(name)
+
+    results = {}
+    api = server.api
+    try:
+        with measure(results, "setup_droplet", meter, api) as errors:
+            try:
+                # A token per scenario, so each gets its own client for this fake API
+                droplet = create_droplet(f"benchmark-{host}", f"bench-{project_count}", "nyc1", "s-1vcpu-1gb",
+                                         "ubuntu-20-04-x64")
+                for stage in (setup_droplet, setup_project_management, setup_do_credentials, setup_droplet_agent):
+                    stage(droplet)
+            except SetupError as e:
+                errors.append(str(e))
+        with measure(results, "deploy_initial", meter, api) as errors:
+            deploy_all(errors)
+        with measure(results, "gather_cold", meter, api) as errors:
+            gather_all(errors)
+        with measure(results, "deploy_unchanged", meter, api) as errors:
+            deploy_all(errors)
+        for name, project_type, local_dir in projects:
+            with open(os.path.join(local_dir, ENTRY_POINT_FILES.get(project_type, "index.html")), "a") as f:
+                f.write(f"{name} changed\n")
+        with measure(results, "deploy_changed", meter, api) as errors:
+            deploy_all(errors)
+        with measure(results, "gather_warm", meter, api) as errors:
+            gather_all(errors)
+    finally:
+        server.shutdown()
+        server.server_close()
+        droplets[host].close()
+    return results
+
+
+def run_benchmark(scenarios, settings, workdir):
+    """Run every scenario in `workdir`; returns the results document."""
+    meter = Meter()
+    profile = NetworkProfile(settings["rtt"], settings["bandwidth"], settings["failure_rate"], settings["seed"])
+    api_options = {"latency": settings["api_latency"], "bandwidth": settings["bandwidth"],
+                   "failure_rate": settings["api_failure_rate"], "seed": settings["seed"]}
+    droplets = {}
+    saved_cwd = os.getcwd()
+    saved_dirs = (registry_cache.REGISTRY_CACHE_DIR, deployment_info_cache.DEPLOYMENT_INFO_CACHE_DIR)
+    saved_env = {name: os.environ.get(name) for name in ("DIGITALOCEAN_END_POINT", "DO_MANAGER_AGENT")}
+    # Local caches and the deployment info files go to the work directory, not the repository
+    registry_cache.REGISTRY_CACHE_DIR = os.path.join(workdir, "cache", "registry")
+    deployment_info_cache.DEPLOYMENT_INFO_CACHE_DIR = os.path.join(workdir, "cache", "deployment_info")
+    os.environ["DO_MANAGER_AGENT"] = "ssh" if settings["agent"] else "off"
+    set_transport_factory(fake_transport_factory(droplets, profile, meter))
+    os.chdir(workdir)
+    try:
+        results = {}
+        for index, project_count in enumerate(scenarios):
+            print(f"Running the {project_count}-project scenario...", flush=True)
+            results[str(project_count)] = run_scenario(project_count, f"192.0.2.{index + 1}", workdir, droplets,
+                                                       meter, api_options, settings["agent"])
+    finally:
+        os.chdir(saved_cwd)
+        set_transport_factory(None)
+        registry_cache.REGISTRY_CACHE_DIR, deployment_info_cache.DEPLOYMENT_INFO_CACHE_DIR = saved_dirs
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    return {"created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "settings": settings,
+            "scenarios": results}
+
+
+def compare(results, baseline):
+    """Regressions of `results` against `baseline`, as messages; only scenarios and phases in both are compared."""
+    thresholds = baseline.get("thresholds", DEFAULT_THRESHOLDS)
+    regressions = []
+    for scenario, phases in results["scenarios"].items():
+        for phase, metrics in phases.items():
+            expected = baseline["scenarios"].get(scenario, {}).get(phase)
+            if expected is None:
+                continue
+            for metric, threshold in thresholds.items():
+                if metric not in metrics or metric not in expected:
+                    continue
+                limit = expected[metric] * (1 + threshold["relative"]) + threshold["absolute"]
+                if metrics[metric] > limit:
+                    regressions.append(f"{scenario} projects, {phase}: {metric} {metrics[metric]} "
+                                       f"> {expected[metric]} (limit {limit:g})")
+    return regressions
+
+
+def print_results(results):
+    columns = ("wall_seconds", "round_trips", "bytes_sent", "bytes_received", "api_requests", "failures",
+               "api_failures", "errors")
+    for scenario, phases in results["scenarios"].items():
+        print(f"\n{scenario} project(s):")
+        print(f"  {'phase':<18}" + "".join(f"{column:>15}" for column in columns))
+        for phase in PHASES:
+            if phase in phases:
+                print(f"  {phase:<18}" + "".join(f"{phases[phase][column]:>15}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the setup, deploy and gather scripts against fake "
+                                                 "droplets and a fake DigitalOcean API.")
+    parser.add_argument("--projects", type=int, nargs="+", default=list(SCENARIOS),
+                        help=f"Scenarios to run, by number of projects (default: {' '.join(map(str, SCENARIOS))})")
+    parser.add_argument("--rtt", type=float, default=0.02, help="SSH round-trip time in seconds (default: 0.02)")
+    parser.add_argument("--bandwidth", type=float, default=12.5e6,
+                        help="Bytes per second over SSH and to the API (default: 12.5e6, 100 Mbit/s)")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Share of SSH round trips that fail like a dropped connection")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Seconds per API request (default: 0.05)")
+    parser.add_argument("--api-failure-rate", type=float, default=0.0,
+                        help="Share of API requests answered with a 500 error")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for failure injection (default: 1)")
+    parser.add_argument("--no-agent", action="store_true", help="Fake droplets without the droplet agent")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help=f"Baseline file (default: {BASELINE_PATH})")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Save the results as the new baseline instead of comparing against it")
+    parser.add_argument("--keep", action="store_true", help="Keep the work directory with the fake droplets")
+    args = parser.parse_args()
+
+    settings = {"rtt": args.rtt, "bandwidth": args.bandwidth, "failure_rate": args.failure_rate,
+                "api_latency": args.api_latency, "api_failure_rate": args.api_failure_rate, "seed": args.seed,
+                "agent": not args.no_agent}
+    workdir = tempfile.mkdtemp(prefix="do-manager-benchmark-")
+    try:
+        results = run_benchmark(args.projects, settings, workdir)
+    finally:
+        if args.keep:
+            print(f"Work directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(dict(results, thresholds=DEFAULT_THRESHOLDS), f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one.")
+        return
+    if baseline.get("settings") != settings:
+        print("\nWarning: The baseline was recorded with different settings; the comparison may not be meaningful.")
+    regressions = compare(results, baseline)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"\nNo regressions against {args.baseline}.")
+
+
+if __name__ == "__main__":
+    main()
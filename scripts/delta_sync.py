@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import shlex
+import stat
+import subprocess
+import tarfile
+import tempfile
+from ssh_transport import get_transport
+
+# Kept outside /opt/projects so the manifest is never served by Apache, and in
+# a subdirectory so the /opt/configs/*.json project registry glob skips it.
+MANIFEST_DIR = "/opt/configs/manifests"
+EXCLUDED_DIRS = {'.git'}
+HASH_CHUNK_SIZE = 1024 * 1024
+# Archives up to this size stay in memory; larger ones spill to a temp file.
+SPOOL_LIMIT = 16 * 1024 * 1024
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_manifest(local_dir):
+    """Map every file below `local_dir` (POSIX relative path) to its content hash and mode."""
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(local_dir):
+        dirnames[:] = sorted(d for d in dirnames if d not in EXCLUDED_DIRS)
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            relative_path = os.path.relpath(path, local_dir).replace(os.sep, '/')
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                digest = hashlib.sha256(b"symlink:" + os.readlink(path).encode('utf-8')).hexdigest()
+            elif stat.S_ISREG(st.st_mode):
+                digest = _hash_file(path)
+            else:
+                continue
+            manifest[relative_path] = {"sha256": digest, "size": st.st_size, "mode": stat.S_IMODE(st.st_mode)}
+    return manifest
+
+
+def manifest_digest(manifest):
+    """One hash for a whole tree: equal manifests give equal digests."""
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def manifest_path(project_name):
+    return f"{MANIFEST_DIR}/{project_name}.json"
+
+
+def fetch_remote_manifest(droplet_ip, project_name):
+    try:
+        return json.loads(get_transport(droplet_ip).read_file(manifest_path(project_name)))
+    except (subprocess.CalledProcessError, ValueError):
+        # No usable cached manifest: everything is treated as new
+        return {}
+
+
+def diff_manifests(local_manifest, remote_manifest):
+    changed = [path for path, entry in local_manifest.items() if remote_manifest.get(path) != entry]
+    removed = [path for path in remote_manifest if path not in local_manifest]
+    return sorted(changed), sorted(removed)
+
+
+def build_archive(local_dir, paths):
+    archive = tempfile.SpooledTemporaryFile(max_size=SPOOL_LIMIT)
+    with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+        for relative_path in paths:
+            tar.add(os.path.join(local_dir, *relative_path.split('/')), arcname=relative_path, recursive=False)
+    size = archive.tell()
+    archive.seek(0)
+    return archive, size
+
+
+def sync_tree(droplet_ip, project_name, local_dir, remote_dir=None, local_manifest=None):
+    """Bring `remote_dir` in line with `local_dir`, moving only what changed.
+
+    Changed and new files travel as one gzip'd tar stream, files that vanished
+    locally are deleted, and the new manifest is cached on the droplet for the
+    next run. Pass a prebuilt `local_manifest` when pushing the same tree to
+    several droplets. Returns a dict of transfer statistics.
+    """
+    remote_dir = remote_dir or f"/opt/projects/{project_name}"
+    transport = get_transport(droplet_ip)
+
+    if local_manifest is None:
+        local_manifest = build_manifest(local_dir)
+    remote_manifest = fetch_remote_manifest(droplet_ip, project_name)
+    changed, removed = diff_manifests(local_manifest, remote_manifest)
+
+    bytes_sent = 0
+    quoted_dir = shlex.quote(remote_dir)
+    if changed:
+        archive, bytes_sent = build_archive(local_dir, changed)
+        with archive:
+            transport.run(f"mkdir -p {quoted_dir} && tar -xzf - --no-same-owner -C {quoted_dir}",
+                          input=archive, capture_output=True, check=True)
+    if removed:
+        transport.run(f"cd {quoted_dir} && xargs -0 rm -f --", input="\0".join(removed),
+                      capture_output=True, check=True)
+
+    if changed or removed or not remote_manifest:
+        transport.run(f"mkdir -p {MANIFEST_DIR}", capture_output=True, check=True)
+        transport.write_file(manifest_path(project_name), json.dumps(local_manifest, sort_keys=True))
+
+    return {
+        "changed": len(changed),
+        "removed": len(removed),
+        "unchanged": len(local_manifest) - len(changed),
+        "bytes_sent": bytes_sent,
+        "changed_paths": changed,
+        "removed_paths": removed,
+    }
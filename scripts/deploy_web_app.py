@@ -1,76 +1,319 @@
+import argparse
 import os
+import hashlib
+import shlex
 import subprocess
 import sys
 import json
-from gather_deployment_info import gather_and_output_info
+from agent_client import AgentError
+from apache_config import ACCESS_LOG_FORMAT, ApacheConfigBatch
+from delta_sync import build_manifest, manifest_digest, sync_tree
+from deployment_info_cache import invalidate_deployment_info
+from gather_deployment_info import fields_for_changed_files, gather_and_output_info
+from registry_cache import get_registry
+from ssh_transport import get_transport
 
 def check_project_exists(droplet_ip, project_name):
     print(f"Checking if project '{project_name}' exists...")
     try:
-        result = subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", f"/usr/local/bin/manage_project.sh list | grep {project_name}"], capture_output=True, text=True)
-        return project_name in result.stdout
+        # Answered from the local copy of the registry when it is fresh
+        answered, project = get_registry(droplet_ip).get(project_name)
+        if answered:
+            return project is not None
+    except AgentError as e:
+        print(f"Error checking project: {e}")
+        return False
+    try:
+        result = get_transport(droplet_ip).run("/usr/local/bin/manage_project.sh list", capture_output=True, check=True)
+        return any(line.startswith(f"- {project_name} (") for line in result.stdout.splitlines())
     except subprocess.CalledProcessError:
         return False
 
 def create_project(droplet_ip, project_name, project_type):
     print(f"Creating project '{project_name}' of type '{project_type}'...")
     try:
-        subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", f"/usr/local/bin/manage_project.sh create {project_name} {project_type}"], check=True)
+        answered, _ = get_registry(droplet_ip).create(project_name, project_type)
+        if answered:
+            print(f"Project '{project_name}' created successfully.")
+            return True
+    except AgentError as e:
+        print(f"Error creating project: {e}")
+        return False
+    try:
+        get_transport(droplet_ip).run(f"/usr/local/bin/manage_project.sh create {project_name} {project_type}", check=True)
         print(f"Project '{project_name}' created successfully.")
         return True
     except subprocess.CalledProcessError as e:
         print(f"Error creating project: {e}")
         return False
 
-def deploy_project_files(droplet_ip, project_name, local_dir):
+def record_deployment(droplet_ip, project_name, runtime, ports, deploy_hash):
+    """Store how the project was deployed in the droplet's registry (droplets without the agent have none)."""
+    try:
+        get_registry(droplet_ip).update(project_name, runtime=runtime, ports=ports, deploy_hash=deploy_hash)
+    except AgentError as e:
+        print(f"Warning: Unable to record the deployment in the project registry: {e}")
+
+def deploy_project_files(droplet_ip, project_name, local_dir, local_manifest=None):
     print(f"Deploying project files for '{project_name}' to the droplet...")
     try:
-        # Create project directory on the droplet
-        subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", f"mkdir -p /opt/projects/{project_name}"], check=True)
-        
-        # Copy project files to the droplet
-        subprocess.run(["scp", "-r", f"{local_dir}/*", f"root@{droplet_ip}:/opt/projects/{project_name}/"], check=True)
-        print(f"Project files for '{project_name}' copied to the droplet successfully.")
-    except subprocess.CalledProcessError as e:
+        # Only changed and new files are sent; files removed locally are deleted
+        stats = sync_tree(droplet_ip, project_name, local_dir, local_manifest=local_manifest)
+        print(f"Project files for '{project_name}' synced to the droplet successfully "
+              f"({stats['changed']} changed, {stats['removed']} removed, {stats['unchanged']} unchanged, "
+              f"{stats['bytes_sent']} bytes sent).")
+    except (subprocess.CalledProcessError, OSError) as e:
         print(f"Error deploying project files: {e}")
-        return False
-    return True
+        return None
+    return stats
+
+# Runs on the droplet with PROJECT and TYPE prepended. Each project's installed
+# dependencies are stamped with a hash of the lockfile and runtime version, so
+# the install is skipped when neither changed. Downloads and built wheels live
+# in droplet-wide caches under /opt/cache and are shared across projects.
+DEPENDENCY_INSTALL_SCRIPT = r"""
+set -e
+cd "/opt/projects/$PROJECT"
+CACHE_ROOT=/opt/cache
+mkdir -p "$CACHE_ROOT/pip" "$CACHE_ROOT/wheelhouse" "$CACHE_ROOT/npm" "$CACHE_ROOT/composer"
+
+case "$TYPE" in
+    python)
+        # manage_project.sh create already made the venv; only create it if missing
+        [ -x "/opt/venvs/$PROJECT/bin/python" ] || python3 -m venv "/opt/venvs/$PROJECT"
+        lockfile=requirements.txt
+        runtime=$("/opt/venvs/$PROJECT/bin/python" --version 2>&1)
+        stamp="/opt/venvs/$PROJECT/.deps-hash"
+        ;;
+    node)
+        lockfile=package-lock.json
+        [ -f "$lockfile" ] || lockfile=package.json
+        runtime=$(node --version)
+        stamp=node_modules/.deps-hash
+        ;;
+    php)
+        lockfile=composer.lock
+        [ -f "$lockfile" ] || lockfile=composer.json
+        runtime=$(php -r 'echo PHP_VERSION;')
+        stamp=vendor/.deps-hash
+        ;;
+    *)
+        exit 0
+        ;;
+esac
+
+key=$( (sha256sum "$lockfile"; echo "$runtime") | sha256sum | cut -c1-64)
+if [ -f "$stamp" ] && [ "$(cut -d' ' -f1 "$stamp")" = "$key" ]; then
+    saved=$(cut -d' ' -f2 "$stamp")
+    echo "Dependency cache hit for '$PROJECT' ($lockfile unchanged): skipped install, saved ~${saved}s."
+    exit 0
+fi
+
+echo "Dependency cache miss for '$PROJECT' ($lockfile changed or first install): installing..."
+start=$(date +%s%N)
+case "$TYPE" in
+    python)
+        pip="/opt/venvs/$PROJECT/bin/pip"
+        export PIP_CACHE_DIR="$CACHE_ROOT/pip"
+        # Build every requirement into the shared wheelhouse once, then install offline from it
+        if "$pip" wheel -q -r requirements.txt -w "$CACHE_ROOT/wheelhouse" --find-links "$CACHE_ROOT/wheelhouse"; then
+            "$pip" install --no-index --find-links "$CACHE_ROOT/wheelhouse" -r requirements.txt
+        else
+            "$pip" install -r requirements.txt
+        fi
+        ;;
+    node)
+        if [ "$lockfile" = package-lock.json ]; then
+            npm ci --cache "$CACHE_ROOT/npm" --prefer-offline
+        else
+            npm install --cache "$CACHE_ROOT/npm" --prefer-offline
+        fi
+        ;;
+    php)
+        COMPOSER_CACHE_DIR="$CACHE_ROOT/composer" composer install --no-interaction
+        ;;
+esac
+elapsed=$(( ($(date +%s%N) - start) / 1000000 ))
+seconds=$(printf '%d.%01d' $((elapsed / 1000)) $((elapsed % 1000 / 100)))
+mkdir -p "$(dirname "$stamp")"
+echo "$key $seconds" > "$stamp"
+echo "Dependencies for '$PROJECT' installed in ${seconds}s; later deploys with the same $lockfile will skip this step."
+"""
 
 def setup_virtual_environment(droplet_ip, project_name, project_type):
     print(f"Setting up virtual environment for '{project_name}'...")
+    transport = get_transport(droplet_ip)
     try:
-        if project_type == "python":
-            subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", 
-                            f"python3 -m venv /opt/venvs/{project_name} && source /opt/venvs/{project_name}/bin/activate && pip install -r /opt/projects/{project_name}/requirements.txt"], check=True)
-        elif project_type == "node":
-            subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", 
-                            f"cd /opt/projects/{project_name} && npm install"], check=True)
-        elif project_type == "php":
-            # For PHP, we assume dependencies are managed by Composer
-            subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", 
-                            f"cd /opt/projects/{project_name} && composer install"], check=True)
+        script = f"PROJECT={shlex.quote(project_name)}\nTYPE={shlex.quote(project_type)}\n" + DEPENDENCY_INSTALL_SCRIPT
+        transport.run("bash -s", input=script, check=True)
         print(f"Virtual environment for '{project_name}' set up successfully.")
     except subprocess.CalledProcessError as e:
         print(f"Error setting up virtual environment: {e}")
         return False
     return True
 
-def setup_docker_environment(droplet_ip, project_name, project_type):
+DOCKER_DIGEST_LABEL = "do-manager.context-digest"
+BLUE_GREEN_STATE_DIR = "/opt/configs/blue_green"
+APACHE_UPSTREAM_DIR = "/etc/apache2/do-manager-upstreams"
+READY_TIMEOUT = 60
+DRAIN_SECONDS = 10
+
+# Runs on the droplet with PROJECT, PORT, TEMPLATE_HASH and DIGEST_LABEL prepended
+# and leaves the image ID to deploy in $image. The image is labelled with a
+# digest of the build context plus the Dockerfile template, so an unchanged
+# project reuses its image instead of rebuilding it.
+DOCKER_BUILD_SCRIPT = r"""
+set -e
+cd "/opt/projects/$PROJECT"
+context_hash=$(find . -path ./.git -prune -o -type f ! -name Dockerfile -print0 \
+    | LC_ALL=C sort -z | xargs -0 -r sha256sum | sha256sum | cut -c1-64)
+digest=$(printf '%s %s' "$TEMPLATE_HASH" "$context_hash" | sha256sum | cut -c1-64)
+
+image=$(docker images -q --no-trunc --filter "label=$DIGEST_LABEL=$digest" "$PROJECT:latest")
+if [ -n "$image" ]; then
+    echo "Build context unchanged (digest ${digest:0:12}), reusing existing image."
+else
+    DOCKER_BUILDKIT=1 docker build --label "$DIGEST_LABEL=$digest" -t "$PROJECT" .
+    image=$(docker images -q --no-trunc "$PROJECT:latest")
+fi
+
+is_running_image() {
+    [ "$(docker inspect -f '{{.Image}}' "$1" 2>/dev/null)" = "$image" ] \
+        && [ "$(docker inspect -f '{{.State.Running}}' "$1" 2>/dev/null)" = "true" ]
+}
+"""
+
+# Stop-then-start replacement of the single '$PROJECT' container.
+DOCKER_REPLACE_SCRIPT = r"""
+if is_running_image "$PROJECT"; then
+    echo "Container '$PROJECT' is already running the current image, leaving it in place."
+    exit 0
+fi
+
+# Stop and remove existing container if it exists
+docker stop "$PROJECT" >/dev/null 2>&1 || true
+docker rm "$PROJECT" >/dev/null 2>&1 || true
+
+# Run new container
+docker run -d --name "$PROJECT" -p "$PORT:$PORT" "$PROJECT"
+"""
+
+# Zero-downtime swap between '$PROJECT-blue' and '$PROJECT-green'. Also needs
+# STATE_DIR, UPSTREAM_DIR, READY_PATH and READY_TIMEOUT. The new container gets
+# a spare loopback port, must pass the readiness probe, and only then is
+# Apache's upstream include atomically renamed into place and gracefully
+# reloaded. The old container keeps running until DOCKER_DRAIN_SCRIPT.
+DOCKER_BLUE_GREEN_SCRIPT = r"""
+mkdir -p "$STATE_DIR" "$UPSTREAM_DIR"
+active_color=$(cut -d' ' -f1 "$STATE_DIR/$PROJECT" 2>/dev/null || true)
+if [ -n "$active_color" ] && is_running_image "$PROJECT-$active_color"; then
+    echo "Container '$PROJECT-$active_color' is already serving the current image, leaving it in place."
+    exit 0
+fi
+if [ "$active_color" = "blue" ]; then next_color=green; else next_color=blue; fi
+new_container="$PROJECT-$next_color"
+
+docker rm -f "$new_container" >/dev/null 2>&1 || true
+docker run -d --name "$new_container" -p "127.0.0.1::$PORT" "$PROJECT" >/dev/null
+new_port=$(docker port "$new_container" "$PORT/tcp" | head -n1 | sed 's/.*://')
+echo "Started '$new_container' on 127.0.0.1:$new_port, waiting for it to become ready..."
+
+ready=""
+for attempt in $(seq 1 "$READY_TIMEOUT"); do
+    if curl -fsS -o /dev/null --max-time 2 "http://127.0.0.1:$new_port$READY_PATH"; then
+        ready=1
+        break
+    fi
+    [ "$(docker inspect -f '{{.State.Running}}' "$new_container")" = "true" ] || break
+    sleep 1
+done
+if [ -z "$ready" ]; then
+    echo "'$new_container' did not pass the readiness probe on $READY_PATH; keeping the current deployment." >&2
+    docker logs --tail 50 "$new_container" >&2 || true
+    docker rm -f "$new_container" >/dev/null 2>&1 || true
+    exit 1
+fi
+
+# Switch the upstream: the rename is atomic and the graceful reload lets
+# in-flight requests finish on the old container
+a2enmod -q proxy proxy_http >/dev/null
+upstream="$UPSTREAM_DIR/$PROJECT.conf"
+[ -f "$upstream" ] && cp "$upstream" "$upstream.previous"
+printf 'ProxyPass / http://127.0.0.1:%s/\nProxyPassReverse / http://127.0.0.1:%s/\n' "$new_port" "$new_port" > "$upstream.new"
+mv "$upstream.new" "$upstream"
+if ! apachectl configtest; then
+    echo "Apache rejected the new upstream; rolling back." >&2
+    if [ -f "$upstream.previous" ]; then mv "$upstream.previous" "$upstream"; else rm -f "$upstream"; fi
+    docker rm -f "$new_container" >/dev/null 2>&1 || true
+    exit 1
+fi
+apachectl graceful
+echo "$next_color $new_port" > "$STATE_DIR/$PROJECT"
+echo "Upstream for '$PROJECT' now points at '$new_container'."
+"""
+
+# Runs once the proxy vhost is live, with PROJECT, STATE_DIR and DRAIN_SECONDS
+# prepended: drains and removes the inactive colour's container and a
+# pre-blue/green '$PROJECT' one, if any.
+DOCKER_DRAIN_SCRIPT = r"""
+active_color=$(cut -d' ' -f1 "$STATE_DIR/$PROJECT" 2>/dev/null || true)
+[ -n "$active_color" ] || exit 0
+if [ "$active_color" = "blue" ]; then old_color=green; else old_color=blue; fi
+old_containers=""
+for container in "$PROJECT-$old_color" "$PROJECT"; do
+    if docker inspect "$container" >/dev/null 2>&1; then old_containers="$old_containers $container"; fi
+done
+[ -n "$old_containers" ] || exit 0
+sleep "$DRAIN_SECONDS"
+for old_container in $old_containers; do
+    docker stop -t 30 "$old_container" >/dev/null || true
+    docker rm "$old_container" >/dev/null || true
+    echo "Removed previous container '$old_container'."
+done
+"""
+
+def get_proxy_vhost_config(project_name):
+    return f"""<VirtualHost *:80>
+    ServerName {project_name}.yourdomain.com
+
+    ProxyPreserveHost On
+    # Points at the live blue/green container; replaced on every switch
+    IncludeOptional {APACHE_UPSTREAM_DIR}/{project_name}.conf
+
+    ErrorLog ${{APACHE_LOG_DIR}}/{project_name}_error.log
+    CustomLog ${{APACHE_LOG_DIR}}/{project_name}_access.log {ACCESS_LOG_FORMAT}
+</VirtualHost>"""
+
+def setup_docker_environment(droplet_ip, project_name, project_type, blue_green=False, ready_path="/"):
     print(f"Setting up Docker environment for '{project_name}'...")
+    transport = get_transport(droplet_ip)
     try:
         # Create Dockerfile
         dockerfile_content = get_dockerfile_content(project_type)
-        subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", f"echo '{dockerfile_content}' > /opt/projects/{project_name}/Dockerfile"], check=True)
-        
-        # Build Docker image
-        subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", f"cd /opt/projects/{project_name} && docker build -t {project_name} ."], check=True)
-        
-        # Stop and remove existing container if it exists
-        subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", f"docker stop {project_name} || true && docker rm {project_name} || true"], check=True)
+        transport.write_file(f"/opt/projects/{project_name}/Dockerfile", dockerfile_content)
         
-        # Run new container
-        port = "80" if project_type == "static" else "8080"
-        subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", f"docker run -d --name {project_name} -p {port}:{port} {project_name}"], check=True)
+        # Build the image only if the context or template changed, then (re)start the container
+        port = container_port(project_type)
+        template_hash = hashlib.sha256(dockerfile_content.encode('utf-8')).hexdigest()
+        script = (f"PROJECT={shlex.quote(project_name)}\nPORT={port}\n"
+                  f"TEMPLATE_HASH={template_hash}\nDIGEST_LABEL={DOCKER_DIGEST_LABEL}\n") + DOCKER_BUILD_SCRIPT
+        if blue_green:
+            script += (f"STATE_DIR={BLUE_GREEN_STATE_DIR}\nUPSTREAM_DIR={APACHE_UPSTREAM_DIR}\n"
+                       f"READY_PATH={shlex.quote(ready_path)}\nREADY_TIMEOUT={READY_TIMEOUT}\n") + DOCKER_BLUE_GREEN_SCRIPT
+        else:
+            script += DOCKER_REPLACE_SCRIPT
+        transport.run("bash -s", input=script, check=True)
+
+        if blue_green:
+            # The site is switched to the proxy vhost only after the new
+            # container passed its probe and owns the upstream. If Apache
+            # rejects the vhost it is restored and the old container, not
+            # yet drained, keeps serving.
+            batch = ApacheConfigBatch(droplet_ip)
+            batch.add_site(project_name, get_proxy_vhost_config(project_name))
+            batch.apply()
+            transport.run("bash -s", input=(f"PROJECT={shlex.quote(project_name)}\nSTATE_DIR={BLUE_GREEN_STATE_DIR}\n"
+                                            f"DRAIN_SECONDS={DRAIN_SECONDS}\n") + DOCKER_DRAIN_SCRIPT, check=True)
         
         print(f"Docker environment for '{project_name}' set up successfully.")
     except subprocess.CalledProcessError as e:
@@ -78,37 +321,43 @@ def setup_docker_environment(droplet_ip, project_name, project_type):
         return False
     return True
 
+def container_port(project_type):
+    return 80 if project_type == "static" else 8080
+
 def get_dockerfile_content(project_type):
+    # Dependency manifests are copied and installed before the source tree so
+    # that code-only changes reuse the cached dependency layer, and BuildKit
+    # cache mounts keep pip/npm downloads across builds.
     if project_type == "python":
-        return """
+        return """# syntax=docker/dockerfile:1
 FROM python:3.9
 WORKDIR /app
 COPY requirements.txt .
-RUN pip install -r requirements.txt
+RUN --mount=type=cache,target=/root/.cache/pip pip install -r requirements.txt
 COPY . .
 CMD ["python", "app.py"]
 """
     elif project_type == "node":
-        return """
+        return """# syntax=docker/dockerfile:1
 FROM node:14
 WORKDIR /app
-COPY package.json package-lock.json ./
-RUN npm install
+COPY package.json package-lock.json* ./
+RUN --mount=type=cache,target=/root/.npm if [ -f package-lock.json ]; then npm ci; else npm install; fi
 COPY . .
 CMD ["node", "app.js"]
 """
     elif project_type == "php":
-        return """
+        return """# syntax=docker/dockerfile:1
 FROM php:7.4-apache
 COPY . /var/www/html/
 """
     else:  # static
-        return """
+        return """# syntax=docker/dockerfile:1
 FROM nginx:alpine
 COPY . /usr/share/nginx/html
 """
 
-def configure_apache(droplet_ip, project_name, project_type):
+def configure_apache(droplet_ip, project_name, project_type, apache_batch=None, on_applied=None):
     print(f"Configuring Apache for '{project_name}'...")
     config = f"""<VirtualHost *:80>
     ServerName {project_name}.yourdomain.com
@@ -120,29 +369,55 @@ def configure_apache(droplet_ip, project_name, project_type):
         Require all granted
     </Directory>
     
-    {"" if project_type == "static" else f"WSGIDaemonProcess {project_name} python-home=/opt/venvs/{project_name} python-path=/opt/projects/{project_name}"}
+    {"" if project_type == "static" else f"WSGIDaemonProcess {project_name} display-name=%{{GROUP}} python-home=/opt/venvs/{project_name} python-path=/opt/projects/{project_name}"}
     {"" if project_type == "static" else f"WSGIProcessGroup {project_name}"}
     {"" if project_type == "static" else f"WSGIScriptAlias / /opt/projects/{project_name}/app.wsgi"}
 
     ErrorLog ${{APACHE_LOG_DIR}}/{project_name}_error.log
-    CustomLog ${{APACHE_LOG_DIR}}/{project_name}_access.log combined
+    CustomLog ${{APACHE_LOG_DIR}}/{project_name}_access.log {ACCESS_LOG_FORMAT}
 </VirtualHost>"""
     
+    # With a batch the vhost is only staged; the batch writes every changed
+    # vhost, reloads Apache once and then calls `on_applied` for this project
+    if apache_batch is not None:
+        apache_batch.add_site(project_name, config, on_applied)
+        print(f"Apache configuration for '{project_name}' staged.")
+        return True
+
     try:
-        # Write the configuration to a file on the droplet
-        subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", f"echo '{config}' > /etc/apache2/sites-available/{project_name}.conf"], check=True)
-        
-        # Enable the site and reload Apache
-        subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", f"a2ensite {project_name}.conf"], check=True)
-        subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet_ip}", "systemctl reload apache2"], check=True)
-        
-        print(f"Apache configured for '{project_name}'.")
+        # Write the configuration only if it changed, enable the site and reload Apache once
+        batch = ApacheConfigBatch(droplet_ip)
+        batch.add_site(project_name, config)
+        if batch.apply():
+            print(f"Apache configured for '{project_name}'.")
+        else:
+            print(f"Apache configuration for '{project_name}' is unchanged; no reload needed.")
     except subprocess.CalledProcessError as e:
         print(f"Error configuring Apache: {e}")
         return False
     return True
 
-def deploy_project(project_name, project_type, droplet_ip, local_dir, use_docker):
+def finish_deployment(project_name, project_type, droplet_ip, runtime, ports, deploy_hash, gather_info=True):
+    record_deployment(droplet_ip, project_name, runtime, ports, deploy_hash)
+    print(f"\nProject '{project_name}' deployed successfully to the droplet")
+
+    # Gather and output deployment information
+    if gather_info:
+        output_file = gather_and_output_info(project_name, project_type, droplet_ip)
+        print(f"Deployment information saved to {output_file}")
+
+    print(f"\nYour project '{project_name}' should now be accessible at: http://{droplet_ip}")
+    print("Note: For production use, you should set up a domain name and configure SSL/TLS.")
+    return True
+
+def deploy_project(project_name, project_type, droplet_ip, local_dir, use_docker, interactive=True, gather_info=True, local_manifest=None, blue_green=False, apache_batch=None):
+    """Deploy one project; returns True on success.
+
+    With an `apache_batch` (an ApacheConfigBatch) the vhost is only staged
+    and True means the project is ready for it: recording the deployment and
+    gathering its info happen when the batch is committed, and the result
+    of commit() says whether the project went live.
+    """
     print(f"\nStarting deployment of {project_type} project '{project_name}' to droplet at {droplet_ip}...")
     
     if not os.path.exists(local_dir):
@@ -151,43 +426,102 @@ def deploy_project(project_name, project_type, droplet_ip, local_dir, use_docker
 
     if check_project_exists(droplet_ip, project_name):
         print(f"Project '{project_name}' already exists on the droplet.")
-        overwrite = input("Do you want to overwrite it? (y/n): ")
-        if overwrite.lower() != 'y':
-            print("Deployment cancelled.")
-            return False
+        if interactive:
+            overwrite = input("Do you want to overwrite it? (y/n): ")
+            if overwrite.lower() != 'y':
+                print("Deployment cancelled.")
+                return False
     else:
         if not create_project(droplet_ip, project_name, project_type):
             return False
 
     try:
-        if not deploy_project_files(droplet_ip, project_name, local_dir):
+        if local_manifest is None:
+            local_manifest = build_manifest(local_dir)
+        stats = deploy_project_files(droplet_ip, project_name, local_dir, local_manifest)
+        if not stats:
             return False
+
+        # Drop the cached deployment info this deploy changes before touching
+        # anything else, so even a failed deploy leaves no stale fields. The
+        # Docker path writes the Dockerfile (and with blue/green, the vhost);
+        # the venv path installs into the venv and renders the vhost.
+        touched = fields_for_changed_files(project_type, stats["changed_paths"] + stats["removed_paths"])
+        if not use_docker or blue_green:
+            touched |= {"project_info", "custom_domain_info"}
+        if use_docker:
+            touched.add("project_structure")
+        invalidate_deployment_info(droplet_ip, project_name, touched)
         
+        deploy_hash = manifest_digest(local_manifest)
         if use_docker:
-            if not setup_docker_environment(droplet_ip, project_name, project_type):
+            if not setup_docker_environment(droplet_ip, project_name, project_type, blue_green):
                 return False
+            # Blue/green containers sit on a spare loopback port behind Apache
+            runtime, ports = ("blue-green", [80]) if blue_green else ("docker", [container_port(project_type)])
         else:
             if not setup_virtual_environment(droplet_ip, project_name, project_type):
                 return False
+            if apache_batch is not None:
+                def finish():
+                    try:
+                        return finish_deployment(project_name, project_type, droplet_ip, "venv", [80], deploy_hash,
+                                                 gather_info)
+                    except Exception as e:
+                        print(f"Unexpected error during deployment: {e}")
+                        return False
+                return configure_apache(droplet_ip, project_name, project_type, apache_batch, finish)
             if not configure_apache(droplet_ip, project_name, project_type):
                 return False
+            runtime, ports = "venv", [80]
 
-        print(f"\nProject '{project_name}' deployed successfully to the droplet")
-
-        # Gather and output deployment information
-        output_file = gather_and_output_info(project_name, project_type, droplet_ip)
-        print(f"Deployment information saved to {output_file}")
-
-        print(f"\nYour project '{project_name}' should now be accessible at: http://{droplet_ip}")
-        print("Note: For production use, you should set up a domain name and configure SSL/TLS.")
-
-        return True
+        return finish_deployment(project_name, project_type, droplet_ip, runtime, ports, deploy_hash, gather_info)
 
     except Exception as e:
         print(f"Unexpected error during deployment: {e}")
         return False
 
+def deploy_projects(droplet_ip, projects, use_docker=False, gather_info=True):
+    """Deploy [(name, type, local_dir), ...] to one droplet with a single Apache configtest and reload.
+
+    Returns {project name: True/False}; a project whose vhost Apache
+    rejected is reported as failed without holding back the others.
+    """
+    batch = ApacheConfigBatch(droplet_ip)
+    results = {}
+    for project_name, project_type, local_dir in projects:
+        results[project_name] = deploy_project(project_name, project_type, droplet_ip, local_dir, use_docker,
+                                               interactive=False, gather_info=gather_info, apache_batch=batch)
+    if batch.sites:
+        print(f"\nApplying the Apache configuration of {len(batch.sites)} project(s) with one reload...")
+        results.update(batch.commit())
+    return results
+
 def main():
+    parser = argparse.ArgumentParser(description="Deploy projects to a DigitalOcean droplet. Without --project "
+                                                 "the script asks for one project interactively.")
+    parser.add_argument("--droplet", help="Droplet IP address")
+    parser.add_argument("--project", nargs=3, action="append", metavar=("NAME", "TYPE", "LOCAL_DIR"),
+                        help="Project to deploy; repeat to deploy several with one Apache reload")
+    parser.add_argument("--docker", action="store_true", help="Use Docker instead of a virtual environment")
+    parser.add_argument("--no-gather", action="store_true", help="Skip gathering deployment information")
+    args = parser.parse_args()
+
+    if args.project:
+        if not args.droplet:
+            parser.error("--droplet is required with --project")
+        for _, project_type, _ in args.project:
+            if project_type not in ("python", "node", "php", "static"):
+                parser.error(f"invalid project type: {project_type}")
+        results = deploy_projects(args.droplet, [tuple(project) for project in args.project], args.docker,
+                                  not args.no_gather)
+        print("\nDeployment report:")
+        for project_name, ok in results.items():
+            print(f"  {project_name:<30} {'ok' if ok else 'failed'}")
+        if not all(results.values()):
+            sys.exit(1)
+        return
+
     print("Welcome to the Project Deployment Script!")
     print("This script will help you deploy your project to your DigitalOcean droplet.")
     
@@ -212,6 +546,7 @@ def main():
     local_dir = input("Enter the local directory path of your project: ")
     
     use_docker = input("Do you want to use Docker for deployment? (y/n): ").lower() == 'y'
+    blue_green = use_docker and input("Do you want a zero-downtime blue/green container swap? (y/n): ").lower() == 'y'
     
     print(f"\nPreparing to deploy {project_type} project '{project_name}' to droplet at {droplet_ip}")
     print(f"Using {'Docker' if use_docker else 'virtual environment'} for isolation")
@@ -221,7 +556,7 @@ def main():
         print("Deployment cancelled.")
         sys.exit(0)
 
-    if deploy_project(project_name, project_type, droplet_ip, local_dir, use_docker):
+    if deploy_project(project_name, project_type, droplet_ip, local_dir, use_docker, blue_green=blue_green):
         print("\nDeployment completed successfully!")
     else:
         print("\nDeployment failed. Please check the error messages above and try again.")
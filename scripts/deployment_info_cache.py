@@ -0,0 +1,67 @@
+import json
+import os
+import time
+
+DEPLOYMENT_INFO_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                         "config", "cache", "deployment_info")
+
+
+class DeploymentInfoCache:
+    """Cached deployment info fields of one project on one droplet.
+
+    Each field is stored with the fingerprint (size and mtime of its source
+    files on the droplet) it had when it was fetched. A field is stale when
+    the fingerprint changed, its TTL ran out, or a deploy invalidated it.
+    Kept in config/cache/deployment_info/<droplet>/<project>.json.
+    """
+
+    def __init__(self, droplet_ip, project_name, cache_dir=None):
+        self.path = os.path.join(cache_dir or DEPLOYMENT_INFO_CACHE_DIR, droplet_ip, f"{project_name}.json")
+        self.project_type = None
+        self.fields = {}
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+            self.project_type, self.fields = cached["project_type"], cached["fields"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def stale_fields(self, project_type, fingerprints, ttls, now=None):
+        """The fields of `fingerprints` ({field: fingerprint}) that must be fetched again."""
+        if project_type != self.project_type:
+            return set(fingerprints)
+        now = time.time() if now is None else now
+        stale = set()
+        for field, fingerprint in fingerprints.items():
+            cached = self.fields.get(field)
+            if cached is None or cached["fingerprint"] != fingerprint or now - cached["fetched_at"] > ttls[field]:
+                stale.add(field)
+        return stale
+
+    def value(self, field):
+        return self.fields[field]["value"]
+
+    def store(self, project_type, field, value, fingerprint, fetched_at=None):
+        if project_type != self.project_type:
+            self.project_type, self.fields = project_type, {}
+        self.fields[field] = {"value": value, "fingerprint": fingerprint,
+                              "fetched_at": time.time() if fetched_at is None else fetched_at}
+
+    def invalidate(self, fields):
+        for field in fields:
+            self.fields.pop(field, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump({"project_type": self.project_type, "fields": self.fields}, f)
+        os.replace(tmp_path, self.path)
+
+
+def invalidate_deployment_info(droplet_ip, project_name, fields):
+    """Drop `fields` from the project's cached deployment info so the next collection fetches them."""
+    cache = DeploymentInfoCache(droplet_ip, project_name)
+    if fields and cache.fields:
+        cache.invalidate(fields)
+        cache.save()
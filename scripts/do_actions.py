@@ -0,0 +1,82 @@
+import logging
+import time
+from digitalocean import Action
+from ssh_transport import SSH_CONNECTION_FAILED, get_transport
+
+INITIAL_POLL_SECONDS = 2
+MAX_POLL_SECONDS = 15
+BACKOFF_FACTOR = 1.5
+DROPLET_READY_TIMEOUT = 600
+
+def backoff_delays(initial=INITIAL_POLL_SECONDS, maximum=MAX_POLL_SECONDS, factor=BACKOFF_FACTOR):
+    """Poll intervals that start short, since most actions finish quickly, and grow to `maximum`."""
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * factor, maximum)
+
+def _sleep_until_next_poll(delays, deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return False
+    time.sleep(min(next(delays), remaining))
+    return True
+
+def wait_for_action(action, timeout, initial=INITIAL_POLL_SECONDS, maximum=MAX_POLL_SECONDS):
+    """Poll a DigitalOcean action until it leaves 'in-progress'; returns True if it completed."""
+    deadline = time.monotonic() + timeout
+    delays = backoff_delays(initial, maximum)
+    while action.status == "in-progress" and _sleep_until_next_poll(delays, deadline):
+        action.load()
+    return action.status == "completed"
+
+def wait_until_reachable(ip_address, timeout, initial=INITIAL_POLL_SECONDS, maximum=MAX_POLL_SECONDS):
+    """Wait until a command can be run on the droplet; returns True once it can.
+
+    A droplet is 'active' in the API well before sshd accepts logins. The
+    probe goes through the pooled transport, so the connection it opens is the
+    one provisioning then uses.
+    """
+    deadline = time.monotonic() + timeout
+    delays = backoff_delays(initial, maximum)
+    while True:
+        result = get_transport(ip_address).run("true", capture_output=True)
+        if result.returncode != SSH_CONNECTION_FAILED:
+            return True
+        logging.info(f"{ip_address} is not reachable over SSH yet: {result.stderr.strip()}")
+        if not _sleep_until_next_poll(delays, deadline):
+            return False
+
+def create_action_for(droplet):
+    """Return the create action of a droplet that was just created."""
+    action_ids = getattr(droplet, "action_ids", None)
+    if action_ids:
+        action = Action(token=droplet.token, id=action_ids[0], droplet_id=droplet.id)
+    else:
+        # Not every create response lists one action per droplet; look the
+        # droplet's own one up
+        action = next((action for action in droplet.get_actions() if action.type == "create"), None)
+        if action is None:
+            raise RuntimeError(f"No create action found for droplet '{droplet.name}'")
+    # Poll on the droplet's session so a throttled client throttles these too
+    action._session = droplet._session
+    return action
+
+def wait_for_droplet(droplet, timeout=DROPLET_READY_TIMEOUT):
+    """Block until a newly created droplet is active and reachable over SSH.
+
+    Raises RuntimeError if the create action fails or the droplet is not ready
+    within `timeout` seconds.
+    """
+    started = time.monotonic()
+    action = create_action_for(droplet)
+    action.load()
+    if not wait_for_action(action, timeout):
+        raise RuntimeError(f"Droplet '{droplet.name}' was not created: action {action.id} is {action.status}")
+
+    droplet.load()
+    remaining = timeout - (time.monotonic() - started)
+    if not droplet.ip_address or not wait_until_reachable(droplet.ip_address, remaining):
+        raise RuntimeError(f"Droplet '{droplet.name}' did not become reachable over SSH within {timeout}s")
+    logging.info(f"Droplet '{droplet.name}' ({droplet.ip_address}) ready after {time.monotonic() - started:.1f}s")
+    return droplet
@@ -0,0 +1,271 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin
+
+import requests
+from digitalocean import Action, DataReadError, Droplet, NotFoundError, SSHKey
+
+# The API allows 250 requests per minute on top of the hourly budget reported
+# in the RateLimit headers; requests are paced to stay under both.
+MAX_REQUESTS_PER_SECOND = 250 / 60
+BURST = 10
+# Requests kept back from the hourly budget for interactive use
+RESERVED_REQUESTS = 50
+MAX_RETRIES = 5
+PER_PAGE = 200
+# Least recently used responses are dropped beyond this, so long-running
+# monitors querying ever-changing time ranges do not grow without bound
+MAX_CACHE_ENTRIES = 1024
+
+SSH_KEYS_TTL = 3600
+DROPLETS_TTL = 15
+
+
+class TokenBucket:
+    """Client-side request pacing, re-fitted to every RateLimit header seen."""
+
+    def __init__(self, rate=MAX_REQUESTS_PER_SECOND, capacity=BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def observe(self, remaining, reset_at):
+        """Spread the remaining hourly budget evenly until it resets."""
+        seconds_left = max(reset_at - time.time(), 1.0)
+        usable = remaining - RESERVED_REQUESTS
+        if usable <= 0:
+            logging.warning(f"DigitalOcean rate limit nearly exhausted; pausing {seconds_left:.0f}s until it resets")
+            self.pause(seconds_left)
+            return
+        with self.lock:
+            self.rate = min(self.max_rate, usable / seconds_left)
+            self.tokens = min(self.tokens, usable)
+
+
+class ThrottledSession(requests.Session):
+    """requests.Session that waits for the token bucket and retries 429 responses."""
+
+    def __init__(self, bucket):
+        super().__init__()
+        self.bucket = bucket
+        self.requests_sent = 0
+
+    def request(self, method, url, *args, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            self.bucket.acquire()
+            response = super().request(method, url, *args, **kwargs)
+            self.requests_sent += 1
+            remaining = response.headers.get("Ratelimit-Remaining")
+            reset_at = response.headers.get("Ratelimit-Reset")
+            if remaining is not None and reset_at is not None:
+                self.bucket.observe(int(remaining), float(reset_at))
+            if response.status_code != 429 or attempt == MAX_RETRIES:
+                return response
+            retry_after = float(response.headers.get("Retry-After") or 2 ** attempt)
+            logging.warning(f"DigitalOcean API rate limited {method} {url}; retrying in {retry_after:.0f}s")
+            self.bucket.pause(retry_after)
+        return response
+
+
+class _Call:
+    """One in-flight GET that concurrent callers for the same URL wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.data
+
+
+class DOClient:
+    """Shared front end for the DigitalOcean API: cached and ETag-revalidated GETs,
+    streamed pages and one rate-limited session for every request."""
+
+    def __init__(self, token, end_point=None):
+        self.token = token
+        self.end_point = end_point or os.getenv("DIGITALOCEAN_END_POINT", "https://api.digitalocean.com/v2/")
+        if not self.end_point.endswith("/"):
+            self.end_point += "/"
+        self.session = ThrottledSession(TokenBucket())
+        self.session.headers.update({"Authorization": f"Bearer {token}", "Content-Type": "application/json"})
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def requests_sent(self):
+        return self.session.requests_sent
+
+    @staticmethod
+    def _check(response):
+        if response.status_code == 404:
+            raise NotFoundError()
+        if not response.ok:
+            try:
+                message = response.json().get("message", response.reason)
+            except ValueError:
+                message = response.reason
+            raise DataReadError(message)
+
+    def get(self, path, params=None, ttl=0):
+        key = (path, tuple(sorted((params or {}).items())))
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                return entry[2]
+            call = self._in_flight.get(key)
+            owner = call is None
+            if owner:
+                call = self._in_flight[key] = _Call()
+        if not owner:
+            return call.result()
+
+        try:
+            headers = {"If-None-Match": entry[1]} if entry and entry[1] else {}
+            response = self.session.get(urljoin(self.end_point, path), params=params, headers=headers)
+            if response.status_code == 304 and entry:
+                data = entry[2]
+            else:
+                self._check(response)
+                data = response.json()
+            etag = response.headers.get("ETag") or (entry[1] if entry else None)
+            if ttl or etag:
+                with self._lock:
+                    self._cache[key] = (time.monotonic() + ttl, etag, data)
+                    self._cache.move_to_end(key)
+                    if len(self._cache) > MAX_CACHE_ENTRIES:
+                        self._cache.popitem(last=False)
+            call.data = data
+            return data
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    def paginate(self, path, key, params=None, ttl=0):
+        """Yield the items of a list endpoint, fetching the next page only when needed."""
+        params = dict(params or {}, per_page=PER_PAGE)
+        page = 1
+        while True:
+            data = self.get(path, dict(params, page=page), ttl)
+            yield from data.get(key, [])
+            if not data.get("links", {}).get("pages", {}).get("next"):
+                return
+            page += 1
+
+    def send(self, method, path, body=None):
+        """Send a non-GET request; cached responses under the same collection are dropped."""
+        response = self.session.request(method, urljoin(self.end_point, path),
+                                        data=json.dumps(body) if body is not None else None)
+        self._check(response)
+        self.invalidate(path.split("/")[0])
+        return response.json() if response.status_code != 204 else None
+
+    def invalidate(self, prefix=""):
+        with self._lock:
+            for key in [key for key in self._cache if key[0].startswith(prefix)]:
+                del self._cache[key]
+
+    # python-digitalocean objects built from cached JSON; their own load() and
+    # get_actions() calls use this client's throttled session.
+    def adopt(self, obj):
+        obj._session = self.session
+        return obj
+
+    def _droplet(self, droplet_json):
+        droplet = self.adopt(Droplet(token=self.token, **droplet_json))
+        for net in droplet.networks["v4"]:
+            if net["type"] == "private":
+                droplet.private_ip_address = net["ip_address"]
+            if net["type"] == "public":
+                droplet.ip_address = net["ip_address"]
+        if droplet.networks["v6"]:
+            droplet.ip_v6_address = droplet.networks["v6"][0]["ip_address"]
+        for feature in ("backups", "ipv6", "private_networking"):
+            setattr(droplet, feature, feature in droplet.features)
+        return droplet
+
+    def _action(self, action_json, droplet_id=None):
+        return self.adopt(Action(token=self.token, droplet_id=droplet_id, **action_json))
+
+    def get_all_sshkeys(self):
+        return [self.adopt(SSHKey(token=self.token, **key))
+                for key in self.paginate("account/keys", "ssh_keys", ttl=SSH_KEYS_TTL)]
+
+    def iter_droplets(self, tag_name=None, ttl=DROPLETS_TTL):
+        params = {"tag_name": tag_name} if tag_name else None
+        for droplet_json in self.paginate("droplets", "droplets", params, ttl):
+            yield self._droplet(droplet_json)
+
+    def get_all_droplets(self, tag_name=None):
+        return list(self.iter_droplets(tag_name))
+
+    def get_droplet(self, droplet_id):
+        return self._droplet(self.get(f"droplets/{droplet_id}")["droplet"])
+
+    def create_droplets(self, names, ssh_keys=(), **attributes):
+        """Create droplets in one request; each gets its own create action in `action_ids`."""
+        body = dict(attributes, ssh_keys=[key.id for key in ssh_keys])
+        if len(names) == 1:
+            body["name"] = names[0]
+        else:
+            body["names"] = list(names)
+        data = self.send("POST", "droplets", body)
+        droplets = [self._droplet(droplet_json) for droplet_json in data.get("droplets") or [data["droplet"]]]
+        action_ids = [action["id"] for action in data.get("links", {}).get("actions", [])]
+        for i, droplet in enumerate(droplets):
+            # Without one action per droplet, wait_for_droplet looks each one up
+            droplet.action_ids = [action_ids[i]] if len(action_ids) == len(droplets) else []
+        return droplets
+
+    def perform_action(self, droplet, action_type, **params):
+        data = self.send("POST", f"droplets/{droplet.id}/actions", dict(params, type=action_type))
+        return self._action(data["action"], droplet.id)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(token):
+    """Return the shared client for `token`, so every caller shares its cache and rate budget."""
+    with _clients_lock:
+        client = _clients.get(token)
+        if client is None:
+            client = _clients[token] = DOClient(token)
+        return client
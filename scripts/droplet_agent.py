@@ -0,0 +1,360 @@
+# Resident agent installed on every droplet by initial_setup.py. It answers
+# newline-delimited JSON-RPC 2.0 on the droplet's loopback interface; the
+# local scripts reach it through their SSH connection, so one connection
+# carries any number of calls without starting a remote process per call.
+# Standard library only: it runs on the droplet's system Python, installed
+# next to project_registry.py.
+import argparse
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import shutil
+import socketserver
+import sqlite3
+import subprocess
+import tempfile
+import threading
+from stat import S_ISDIR
+from project_registry import CREDENTIALS_SUFFIX, ProjectRegistry
+
+AGENT_PORT = 7391
+TOKEN_FILE = "/etc/do-manager/agent.token"
+INSTALL_PATH = "/usr/local/lib/do-manager/droplet_agent.py"
+PROJECT_TYPES = ("python", "node", "php", "static")
+PROJECT_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+MAX_READ_BYTES = 16 * 2**20
+
+# JSON-RPC 2.0 error codes; -32000 and below are this agent's own
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+CALL_FAILED = -32000
+UNAUTHORIZED = -32001
+
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class AgentState:
+    """Projects in the registry database and credentials in /opt/configs.
+
+    Credential files stay in the format manage_do_credentials.sh uses. Each
+    cached file is revalidated with a stat() on access, so edits made with
+    the shell script are still seen, at the cost of a stat instead of a bash
+    and jq process per call. Paths given to the file.* methods are taken
+    relative to `base_dir`. Without `create_venvs` new projects get no venv
+    (for fake droplets, where it would only cost time).
+    """
+
+    def __init__(self, base_dir="/", create_venvs=True):
+        self.base_dir = base_dir
+        self.create_venvs = create_venvs
+        self.projects_dir = os.path.join(base_dir, "opt", "projects")
+        self.venvs_dir = os.path.join(base_dir, "opt", "venvs")
+        self.configs_dir = os.path.join(base_dir, "opt", "configs")
+        self.lock = threading.RLock()
+        self.files = {}
+        self.registry = ProjectRegistry(os.path.join(self.configs_dir, "registry.db"))
+
+    def _load(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self.files.pop(path, None)
+            return None
+        cached = self.files.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        self.files[path] = (mtime, data)
+        return data
+
+    def _store(self, path, data, mode=0o644):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode), "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        self.files[path] = (os.stat(path).st_mtime_ns, data)
+
+    def _remove(self, path):
+        self.files.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _check_name(name):
+        if not isinstance(name, str) or not PROJECT_NAME.match(name):
+            raise RPCError(INVALID_PARAMS, f"Invalid project name: {name!r}")
+
+    def _credentials_path(self, name):
+        return os.path.join(self.configs_dir, f"{name}{CREDENTIALS_SUFFIX}")
+
+    def ping(self):
+        return "pong"
+
+    def project_get(self, name):
+        """The project's registry record, or None; matched exactly."""
+        self._check_name(name)
+        return self.registry.get(name)
+
+    def project_list(self):
+        return self.registry.list()
+
+    def project_snapshot(self, since=None, registry_id=None):
+        """Every project with the registry's id and generation; only the latter two if both are unchanged."""
+        return self.registry.snapshot(since, registry_id)
+
+    def project_create(self, name, type):
+        """Create the project's directory, venv and registry entry, like `manage_project.sh create`.
+
+        Returns {"id", "generation", "previous_generation", "project", "created"}.
+        """
+        self._check_name(name)
+        if type not in PROJECT_TYPES:
+            raise RPCError(INVALID_PARAMS, f"Invalid project type: {type!r}")
+        with self.lock:
+            existing = self.registry.get(name)
+            if existing and existing["type"] == type:
+                state = self.registry.state()
+                return dict(state, previous_generation=state["generation"], project=existing, created=False)
+            os.makedirs(os.path.join(self.projects_dir, name), exist_ok=True)
+            if self.create_venvs:
+                subprocess.run(["python3", "-m", "venv", os.path.join(self.venvs_dir, name)],
+                               check=True, capture_output=True)
+            result = self.registry.put(name, type)
+        logging.info(f"Created project {name} ({type})")
+        return dict(result, created=True)
+
+    def project_update(self, name, runtime=None, ports=None, deploy_hash=None):
+        """Record how the project was last deployed.
+
+        Returns {"id", "generation", "previous_generation", "project"}.
+        """
+        self._check_name(name)
+        fields = {field: value for field, value in
+                  (("runtime", runtime), ("ports", ports), ("deploy_hash", deploy_hash)) if value is not None}
+        try:
+            return self.registry.put(name, **fields)
+        except ValueError as e:
+            raise RPCError(INVALID_PARAMS, str(e))
+
+    def project_delete(self, name):
+        """Remove the project's files and registry entry.
+
+        Returns {"id", "generation", "previous_generation", "deleted"}.
+        """
+        self._check_name(name)
+        with self.lock:
+            shutil.rmtree(os.path.join(self.projects_dir, name), ignore_errors=True)
+            shutil.rmtree(os.path.join(self.venvs_dir, name), ignore_errors=True)
+            self._remove(os.path.join(self.configs_dir, "manifests", f"{name}.json"))
+            result = self.registry.delete(name)
+        logging.info(f"Deleted project {name}")
+        return result
+
+    def credentials_get(self, name):
+        """The project's DigitalOcean token, or None."""
+        self._check_name(name)
+        with self.lock:
+            credentials = self._load(self._credentials_path(name))
+        return credentials.get("do_token") if isinstance(credentials, dict) else None
+
+    def credentials_set(self, name, token):
+        self._check_name(name)
+        with self.lock:
+            self._store(self._credentials_path(name), {"do_token": token}, mode=0o600)
+        return True
+
+    def credentials_delete(self, name):
+        self._check_name(name)
+        with self.lock:
+            self._remove(self._credentials_path(name))
+        return True
+
+    def _resolve(self, path):
+        return os.path.join(self.base_dir, path.lstrip("/"))
+
+    def file_stat(self, paths):
+        """{path: {"size", "mtime", "mode", "is_dir"} or None} for every path."""
+        results = {}
+        for path in paths:
+            try:
+                stat = os.stat(self._resolve(path))
+            except OSError:
+                results[path] = None
+                continue
+            results[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "mode": stat.st_mode & 0o7777,
+                             "is_dir": S_ISDIR(stat.st_mode)}
+        return results
+
+    def file_read(self, path, max_bytes=MAX_READ_BYTES):
+        """The file's text (undecodable bytes replaced), or None if it does not exist."""
+        try:
+            with open(self._resolve(path), "rb") as f:
+                data = f.read(max_bytes + 1)
+        except FileNotFoundError:
+            return None
+        return {"content": data[:max_bytes].decode("utf-8", errors="replace"), "truncated": len(data) > max_bytes}
+
+
+METHODS = {
+    "ping": AgentState.ping,
+    "project.get": AgentState.project_get,
+    "project.list": AgentState.project_list,
+    "project.snapshot": AgentState.project_snapshot,
+    "project.create": AgentState.project_create,
+    "project.update": AgentState.project_update,
+    "project.delete": AgentState.project_delete,
+    "credentials.get": AgentState.credentials_get,
+    "credentials.set": AgentState.credentials_set,
+    "credentials.delete": AgentState.credentials_delete,
+    "file.stat": AgentState.file_stat,
+    "file.read": AgentState.file_read,
+}
+
+
+def _response(request_id, result=None, error=None):
+    response = {"jsonrpc": "2.0", "id": request_id}
+    if error is not None:
+        response["error"] = {"code": error.code, "message": str(error)}
+    else:
+        response["result"] = result
+    return response
+
+
+class AgentHandler(socketserver.StreamRequestHandler):
+    """One client connection: an "auth" call first, then any number of calls or batches."""
+
+    def _send(self, message):
+        self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+    def _authenticate(self, request):
+        if not isinstance(request, dict) or request.get("method") != "auth":
+            return False
+        params = request.get("params")
+        token = params.get("token") if isinstance(params, dict) else None
+        return isinstance(token, str) and hmac.compare_digest(token.encode("utf-8"), self.server.token.encode("utf-8"))
+
+    def handle(self):
+        authenticated = False
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self._send(_response(None, error=RPCError(PARSE_ERROR, "Invalid JSON")))
+                continue
+
+            if not authenticated:
+                if not self._authenticate(request):
+                    self._send(_response(request.get("id") if isinstance(request, dict) else None,
+                                         error=RPCError(UNAUTHORIZED, "Authentication required")))
+                    return
+                authenticated = True
+                self._send(_response(request.get("id"), True))
+                continue
+
+            if isinstance(request, list):
+                self._send([self.server.dispatch(item) for item in request])
+            else:
+                self._send(self.server.dispatch(request))
+
+
+class AgentServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, token, state):
+        super().__init__(address, AgentHandler)
+        self.token = token
+        self.state = state
+
+    def dispatch(self, request):
+        request_id = request.get("id") if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+                raise RPCError(INVALID_REQUEST, "Invalid request")
+            method = METHODS.get(request["method"])
+            if method is None:
+                raise RPCError(METHOD_NOT_FOUND, f"Unknown method: {request['method']}")
+            params = request.get("params") or {}
+            if not isinstance(params, dict):
+                raise RPCError(INVALID_PARAMS, "Parameters must be an object")
+            try:
+                return _response(request_id, method(self.state, **params))
+            except TypeError as e:
+                raise RPCError(INVALID_PARAMS, str(e))
+        except RPCError as e:
+            return _response(request_id, error=e)
+        except (OSError, subprocess.CalledProcessError, sqlite3.Error) as e:
+            logging.error(f"{request.get('method')} failed: {e}")
+            return _response(request_id, error=RPCError(CALL_FAILED, str(e)))
+        except Exception as e:
+            # A bug in one method must not drop the connection without an answer
+            logging.exception(f"{request.get('method')} failed unexpectedly")
+            return _response(request_id, error=RPCError(CALL_FAILED, f"Internal error: {e}"))
+
+
+def load_or_create_token(path):
+    """The shared secret in `path`, generated (readable by root only) on first start."""
+    try:
+        with open(path) as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    token = secrets.token_hex(32)
+    with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        f.write(token + "\n")
+    return token
+
+
+def start_agent(token, base_dir="/", address="127.0.0.1", port=AGENT_PORT, create_venvs=True):
+    """Serve the agent on a background thread; returns the server (port 0 picks a free one)."""
+    server = AgentServer((address, port), token, AgentState(base_dir, create_venvs))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="do-manager droplet agent")
+    parser.add_argument("--address", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=AGENT_PORT, help="Port to listen on")
+    parser.add_argument("--token-file", default=TOKEN_FILE, help="File holding the shared secret (created if missing)")
+    parser.add_argument("--base-dir", default="/", help="Root under which /opt/projects etc. live")
+    parser.add_argument("--loopback", action="store_true",
+                        help="Test mode: free port, fresh token and a temporary base directory, "
+                             "printed as one JSON line")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    if args.loopback:
+        token = secrets.token_hex(32)
+        server = AgentServer(("127.0.0.1", 0), token, AgentState(tempfile.mkdtemp(prefix="do-manager-agent-")))
+        print(json.dumps({"port": server.server_address[1], "token": token,
+                          "base_dir": server.state.base_dir}), flush=True)
+    else:
+        server = AgentServer((args.address, args.port), load_or_create_token(args.token_file),
+                             AgentState(args.base_dir))
+    logging.info(f"Listening on {server.server_address[0]}:{server.server_address[1]}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
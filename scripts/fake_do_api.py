@@ -0,0 +1,326 @@
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeDigitalOcean:
+    """In-memory stand-in for the parts of the DigitalOcean API the scripts use.
+
+    Droplets boot and actions complete after a configurable delay, so polling
+    code sees the same 'new' -> 'active' and 'in-progress' -> 'completed'
+    transitions it would against the real API. Point python-digitalocean at it
+    with DIGITALOCEAN_END_POINT=http://127.0.0.1:<port>/v2/.
+
+    For benchmarks, every response can be delayed by `latency` seconds plus
+    its size over `bandwidth` (bytes per second), and a `failure_rate`
+    share of requests answered with a 500 error.
+    """
+
+    def __init__(self, boot_seconds=2.0, action_seconds=1.0, droplet_ip=None, rate_limit=None, rate_window=60.0,
+                 latency=0.0, bandwidth=None, failure_rate=0.0, seed=None):
+        self.boot_seconds = boot_seconds
+        self.action_seconds = action_seconds
+        self.droplet_ip = droplet_ip
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1000)
+        self.droplets = {}
+        self.actions = {}
+        self.images = {}
+        self.ssh_keys = [{"id": 1, "name": "fake-key", "fingerprint": "00:11:22:33:44:55:66:77:88:99:aa:bb:cc:dd:ee:ff",
+                          "public_key": "ssh-ed25519 AAAA fake"}]
+        self.requests = []
+        # Optional rate limit of `rate_limit` requests per `rate_window` seconds,
+        # reported in RateLimit headers and enforced with 429 responses
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.window_started = time.time()
+        self.window_requests = 0
+        self.throttled = 0
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.failed = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    # State transitions happen lazily whenever the state is read
+    def _advance(self):
+        now = time.monotonic()
+        for droplet in self.droplets.values():
+            if droplet["status"] == "new" and now >= droplet["_ready_at"]:
+                droplet["status"] = "active"
+                droplet["networks"]["v4"] = [{"ip_address": self.droplet_ip or droplet["_ip"], "type": "public",
+                                              "netmask": "255.255.240.0", "gateway": "203.0.113.1"}]
+        for action in self.actions.values():
+            if action["status"] == "in-progress" and now >= action["_done_at"]:
+                self._complete(action)
+
+    def _complete(self, action):
+        action["status"] = "completed"
+        action["completed_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        droplet = self.droplets.get(action["resource_id"])
+        if droplet is None:
+            return
+        if action["type"] == "power_off":
+            droplet["status"] = "off"
+        elif action["type"] == "power_on":
+            droplet["status"] = "active"
+        elif action["type"] == "snapshot":
+            image_id = next(self.ids)
+            self.images[image_id] = {
+                "id": image_id, "name": action["_params"].get("name"), "type": "snapshot",
+                "distribution": "Ubuntu", "slug": None, "public": False, "regions": [droplet["region"]["slug"]],
+                "min_disk_size": 25, "size_gigabytes": 2.5, "created_at": action["completed_at"],
+                "resource_id": droplet["id"], "resource_type": "droplet", "tags": [],
+            }
+            droplet["snapshot_ids"].append(image_id)
+
+    def _new_action(self, action_type, droplet_id, params=None, delay=None):
+        action_id = next(self.ids)
+        action = {
+            "id": action_id, "status": "in-progress", "type": action_type,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "completed_at": None,
+            "resource_id": droplet_id, "resource_type": "droplet", "region_slug": None,
+            "_done_at": time.monotonic() + (self.action_seconds if delay is None else delay),
+            "_params": params or {},
+        }
+        self.actions[action_id] = action
+        return action
+
+    def _new_droplet(self, name, params):
+        droplet_id = next(self.ids)
+        droplet = {
+            "id": droplet_id, "name": name, "status": "new", "memory": 1024, "vcpus": 1, "disk": 25,
+            "locked": False, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "size_slug": params.get("size"), "image": {"id": params.get("image"), "slug": params.get("image")},
+            "region": {"slug": params.get("region"), "name": params.get("region")},
+            "networks": {"v4": [], "v6": []}, "features": ["monitoring"] if params.get("monitoring") else [],
+            "tags": list(params.get("tags") or []), "snapshot_ids": [], "backup_ids": [], "volume_ids": [],
+            "_ready_at": time.monotonic() + self.boot_seconds,
+            "_ip": f"203.0.113.{droplet_id % 250 + 2}",
+        }
+        self.droplets[droplet_id] = droplet
+        return droplet
+
+    @staticmethod
+    def public(obj):
+        return {key: value for key, value in obj.items() if not key.startswith("_")}
+
+    def _rate_limit_headers(self):
+        now = time.time()
+        if now - self.window_started >= self.rate_window:
+            self.window_started, self.window_requests = now, 0
+        self.window_requests += 1
+        reset_at = self.window_started + self.rate_window
+        headers = {"Ratelimit-Limit": str(self.rate_limit),
+                   "Ratelimit-Remaining": str(max(self.rate_limit - self.window_requests, 0)),
+                   "Ratelimit-Reset": str(int(reset_at))}
+        if self.window_requests > self.rate_limit:
+            headers["Retry-After"] = str(max(int(reset_at - now), 1))
+        return headers
+
+    def handle(self, method, path, query, body, if_none_match=None):
+        """Return (status, payload, headers) for one API request."""
+        with self.lock:
+            self.requests.append((method, path))
+            headers = self._rate_limit_headers() if self.rate_limit else {}
+            if "Retry-After" in headers:
+                self.throttled += 1
+                return 429, {"id": "too_many_requests", "message": "API Rate limit exceeded."}, headers
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                self.failed += 1
+                return 500, {"id": "server_error", "message": "Injected failure."}, headers
+            self._advance()
+            status, payload = self._route(method, path.rstrip("/"), query, body)
+            if method == "GET" and status == 200:
+                etag = '"' + hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:32] + '"'
+                headers["ETag"] = etag
+                if if_none_match == etag:
+                    return 304, None, headers
+            return status, payload, headers
+
+    def transfer(self, received, sent):
+        """Count one request's bytes and wait as long as the simulated network would take."""
+        with self.lock:
+            self.bytes_received += received
+            self.bytes_sent += sent
+        delay = self.latency + ((received + sent) / self.bandwidth if self.bandwidth else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    @staticmethod
+    def _page(path, key, items, query):
+        per_page = int(query.get("per_page", ["20"])[0])
+        page = int(query.get("page", ["1"])[0])
+        links = {"pages": {"next": f"{path}?page={page + 1}&per_page={per_page}"}} if page * per_page < len(items) else {}
+        return 200, {key: items[(page - 1) * per_page:page * per_page], "links": links, "meta": {"total": len(items)}}
+
+    def _route(self, method, path, query, body):
+        if method == "GET" and path == "/v2/account/keys":
+            return self._page(path, "ssh_keys", self.ssh_keys, query)
+
+        if path == "/v2/droplets":
+            if method == "POST" and "names" in body:
+                droplets = [self._new_droplet(name, body) for name in body["names"]]
+                actions = [self._new_action("create", d["id"], delay=self.boot_seconds) for d in droplets]
+                return 202, {"droplets": [self.public(d) for d in droplets],
+                             "links": {"actions": [{"id": a["id"], "rel": "multiple_create"} for a in actions]}}
+            if method == "POST":
+                droplet = self._new_droplet(body["name"], body)
+                action = self._new_action("create", droplet["id"], delay=self.boot_seconds)
+                return 202, {"droplet": self.public(droplet), "links": {"actions": [{"id": action["id"], "rel": "create"}]}}
+            droplets = list(self.droplets.values())
+            if "tag_name" in query:
+                droplets = [d for d in droplets if query["tag_name"][0] in d["tags"]]
+            return self._page(path, "droplets", [self.public(d) for d in droplets], query)
+
+        match = re.fullmatch(r"/v2/droplets/(\d+)(/actions(?:/(\d+))?)?", path)
+        if match:
+            droplet = self.droplets.get(int(match.group(1)))
+            if droplet is None:
+                return 404, {"id": "not_found", "message": "The resource you were accessing could not be found."}
+            if match.group(2) is None:
+                if method == "DELETE":
+                    del self.droplets[droplet["id"]]
+                    return 204, None
+                return 200, {"droplet": self.public(droplet)}
+            if method == "POST":
+                action = self._new_action(body["type"], droplet["id"], body)
+                return 201, {"action": self.public(action)}
+            if match.group(3):
+                action = self.actions.get(int(match.group(3)))
+                return (200, {"action": self.public(action)}) if action else (404, {"id": "not_found", "message": "not found"})
+            actions = [self.public(a) for a in self.actions.values() if a["resource_id"] == droplet["id"]]
+            return self._page(path, "actions", actions, query)
+
+        match = re.fullmatch(r"/v2/actions/(\d+)", path)
+        if match:
+            action = self.actions.get(int(match.group(1)))
+            if action is None:
+                return 404, {"id": "not_found", "message": "The resource you were accessing could not be found."}
+            return 200, {"action": self.public(action)}
+
+        if method == "GET" and path == "/v2/snapshots":
+            snapshots = [dict(image, id=str(image["id"])) for image in self.images.values()]
+            return self._page(path, "snapshots", snapshots, query)
+
+        match = re.fullmatch(r"/v2/(?:images|snapshots)/(\d+)", path)
+        if match:
+            image = self.images.get(int(match.group(1)))
+            if image is None:
+                return 404, {"id": "not_found", "message": "The resource you were accessing could not be found."}
+            if method == "DELETE":
+                del self.images[image["id"]]
+                return 204, None
+            return 200, {"image": image}
+
+        match = re.fullmatch(r"/v2/monitoring/metrics/droplet/(\w+)", path)
+        if match and method == "GET":
+            return self._metrics(match.group(1), query)
+
+        return 404, {"id": "not_found", "message": f"Fake API has no route for {method} {path}"}
+
+    def _metrics(self, metric, query):
+        """Synthetic monitoring series, one point per minute, stable per droplet."""
+        host_id = int(query["host_id"][0])
+        start, end = int(query["start"][0]), int(query["end"][0])
+        timestamps = range(start - start % 60, end + 1, 60)
+        busy = 0.1 + (host_id % 7) / 10
+        labels = {"host_id": str(host_id)}
+        if metric == "cpu":
+            shares = {"idle": 1 - busy, "user": busy * 0.8, "system": busy * 0.2}
+            series = [(dict(labels, mode=mode), [ts * share for ts in timestamps]) for mode, share in shares.items()]
+        elif metric in ("memory_total", "memory_available"):
+            total = 2 ** 30
+            value = total if metric == "memory_total" else total * (0.6 - (host_id % 5) / 20)
+            series = [(labels, [value for _ in timestamps])]
+        elif metric in ("filesystem_size", "filesystem_free"):
+            size = 25 * 2 ** 30
+            value = size if metric == "filesystem_size" else size * (0.8 - (host_id % 3) / 10)
+            series = [(dict(labels, device="/dev/vda1", mountpoint="/"), [value for _ in timestamps])]
+        elif metric in ("load_1", "load_5", "load_15"):
+            series = [(labels, [(host_id % 4) * 0.25 for _ in timestamps])]
+        else:
+            return 404, {"id": "not_found", "message": f"Unknown metric {metric}"}
+        return 200, {"status": "success", "data": {"resultType": "matrix", "result": [
+            {"metric": metric_labels, "values": [[ts, str(value)] for ts, value in zip(timestamps, values)]}
+            for metric_labels, values in series]}}
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = {}
+        status, payload, headers = self.server.api.handle(method, url.path, parse_qs(url.query), body,
+                                                          self.headers.get("If-None-Match"))
+        data = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        self.server.api.transfer(len(raw), len(data))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_api(port=0, **kwargs):
+    """Serve a FakeDigitalOcean on a background thread; returns (server, end_point URL)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeAPIHandler)
+    server.api = FakeDigitalOcean(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v2/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake of the DigitalOcean API for testing.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--boot-seconds", type=float, default=2.0, help="Time before a new droplet becomes active")
+    parser.add_argument("--action-seconds", type=float, default=1.0, help="Time before an action completes")
+    parser.add_argument("--droplet-ip", help="Report this IP for every droplet (e.g. 127.0.0.1 with DO_MANAGER_TRANSPORT=local)")
+    parser.add_argument("--rate-limit", type=int, help="Requests allowed per --rate-window seconds before answering 429")
+    parser.add_argument("--rate-window", type=float, default=60.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--bandwidth", type=float, help="Bytes per second; larger responses take longer")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with a 500 error")
+    args = parser.parse_args()
+
+    server, end_point = start_fake_api(args.port, boot_seconds=args.boot_seconds,
+                                       action_seconds=args.action_seconds, droplet_ip=args.droplet_ip,
+                                       rate_limit=args.rate_limit, rate_window=args.rate_window,
+                                       latency=args.latency, bandwidth=args.bandwidth,
+                                       failure_rate=args.failure_rate)
+    print(f"Fake DigitalOcean API listening. Use: export DIGITALOCEAN_END_POINT={end_point}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+# Fake droplet for benchmarks: a transport backend that answers the commands
+# the scripts send over SSH from a sandbox directory instead of a real machine,
+# behind a simulated network. Only the effects later commands read back are
+# emulated (files, Apache sites, the project registry, the droplet agent);
+# package installs and other provisioning steps succeed without doing
+# anything, so what is measured is the scripts' own cost: round trips, bytes
+# and the time spent waiting on the network.
+import hashlib
+import io
+import json
+import os
+import random
+import secrets
+import shlex
+import socket
+import subprocess
+import tarfile
+import threading
+import time
+from apache_config import SITES_AVAILABLE, STATUS_SCRIPT
+from droplet_agent import TOKEN_FILE, start_agent
+from gather_deployment_info import BUNDLE_MARKER, STAT_SCRIPT
+from project_registry import CREDENTIALS_SUFFIX, REGISTRY_PATH, ProjectRegistry
+from ssh_transport import CHUNK_SIZE, SSH_CONNECTION_FAILED, _as_bytes, _completed
+
+SITES_ENABLED = "/etc/apache2/sites-enabled"
+STAT_COMMAND = f"bash -c {shlex.quote(STAT_SCRIPT)}"
+OS_RELEASE = 'NAME="Ubuntu"\nVERSION="20.04.6 LTS (Focal Fossa)"\nID=ubuntu\nVERSION_ID="20.04"\n'
+
+
+class NetworkProfile:
+    """Latency, bandwidth and failure injection for one simulated link.
+
+    Every exchange costs `rtt` seconds plus its size over `bandwidth` (bytes
+    per second, unlimited if None). A `failure_rate` share of exchanges
+    fail as a dropped connection would. Failures are drawn from a random
+    generator seeded with `seed`, so a run can be repeated exactly.
+    """
+
+    def __init__(self, rtt=0.0, bandwidth=None, failure_rate=0.0, seed=None):
+        self.rtt = rtt
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def transfer_time(self, size):
+        return size / self.bandwidth if self.bandwidth else 0
+
+    def delay(self, size):
+        return self.rtt + self.transfer_time(size)
+
+    def fails(self):
+        with self.lock:
+            return bool(self.failure_rate) and self.random.random() < self.failure_rate
+
+
+class Meter:
+    """Counters shared by every fake connection; read them before and after a phase to get its cost."""
+
+    COUNTERS = ("round_trips", "bytes_sent", "bytes_received", "failures", "network_seconds")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class FakeDroplet:
+    """The state of one fake droplet, kept in `root` (absolute droplet paths map below it).
+
+    With `agent` the droplet runs a real droplet agent rooted in the same
+    directory, reachable through FakeTransport.open_tunnel; new projects get
+    no venv there.
+    """
+
+    def __init__(self, host, root, agent=True):
+        self.host = host
+        self.root = root
+        self.lock = threading.RLock()
+        self.agent_token = None
+        self.agent_server = None
+        self.registry = None
+        self.write("/etc/os-release", OS_RELEASE)
+        if agent:
+            self.agent_token = secrets.token_hex(32)
+            self.write(TOKEN_FILE, self.agent_token + "\n")
+
+    def path(self, remote_path):
+        return os.path.join(self.root, remote_path.lstrip("/"))
+
+    def read(self, remote_path):
+        with open(self.path(remote_path), "rb") as f:
+            return f.read()
+
+    def write(self, remote_path, content, mode=None):
+        path = self.path(remote_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(_as_bytes(content))
+        if mode is not None:
+            os.chmod(path, mode)
+
+    def agent_address(self):
+        """The agent's address, starting it on first use; None if this droplet has no agent."""
+        with self.lock:
+            if self.agent_token is None:
+                return None
+            if self.agent_server is None:
+                self.agent_server = start_agent(self.agent_token, self.root, port=0, create_venvs=False)
+            return self.agent_server.server_address
+
+    def _registry(self):
+        if self.agent_server is not None:
+            return self.agent_server.state.registry
+        if self.registry is None:
+            self.registry = ProjectRegistry(self.path(REGISTRY_PATH))
+        return self.registry
+
+    def close(self):
+        if self.agent_server is not None:
+            self.agent_server.shutdown()
+            self.agent_server.server_close()
+            self.agent_server = None
+
+    def execute(self, command, stdin=b""):
+        """Run one command; returns (exit status, stdout, stderr) as bytes."""
+        with self.lock:
+            if command == STAT_COMMAND:
+                return self._stat(stdin.decode("utf-8").splitlines())
+            argv = shlex.split(command)
+            if argv[:2] == ["bash", "-s"]:
+                return self._script(argv[3:], stdin.decode("utf-8", errors="replace"))
+            if argv[:2] == ["mkdir", "-p"] and argv[3:5] == ["&&", "tar"]:
+                return self._extract(argv[-1], stdin)
+            if argv[:1] == ["cd"] and argv[2:4] == ["&&", "xargs"]:
+                return self._remove(argv[1], stdin)
+            return self._command(argv)
+
+    def _script(self, args, script):
+        if script == STATUS_SCRIPT:
+            return self._apache_status(args)
+        if BUNDLE_MARKER in script:
+            return self._bundle(script)
+        if script.startswith("CHANGED="):
+            return self._apache_apply(script)
+        # Provisioning, dependency installs and Docker deploys
+        return 0, b"", b""
+
+    def _command(self, argv):
+        if argv == ["true"]:
+            return 0, b"", b""
+        if argv[:2] == ["mkdir", "-p"] and len(argv) == 3:
+            os.makedirs(self.path(argv[2]), exist_ok=True)
+            return 0, b"", b""
+        if argv[:1] == ["cat"] and len(argv) == 2:
+            try:
+                return 0, self.read(argv[1]), b""
+            except OSError:
+                return 1, b"", f"cat: {argv[1]}: No such file or directory\n".encode()
+        if argv[:1] == ["cat"] and argv[2:4] == ["|", "grep"] and len(argv) == 5:
+            try:
+                lines = self.read(argv[1]).decode("utf-8", errors="replace").splitlines()
+            except OSError:
+                return 1, b"", b""
+            matches = [line for line in lines if argv[4] in line]
+            return (0 if matches else 1), "".join(line + "\n" for line in matches).encode(), b""
+        if argv[:1] == ["tree"]:
+            return self._tree(argv[1])
+        if argv[:2] == ["ls", "-l"]:
+            try:
+                names = sorted(os.listdir(self.path(argv[2])))
+            except OSError:
+                return 2, b"", b""
+            return 0, "".join(f"{name}\n" for name in names).encode(), b""
+        if argv[:2] == ["crontab", "-l"]:
+            return 1, b"", b"no crontab for root\n"
+        if argv[:1] == ["/usr/local/bin/manage_do_credentials.sh"] and argv[1:2] == ["get"]:
+            try:
+                token = json.loads(self.read(f"/opt/configs/{argv[2]}{CREDENTIALS_SUFFIX}"))["do_token"]
+            except (OSError, ValueError, KeyError):
+                return 1, b"", b""
+            return 0, f"{token}\n".encode(), b""
+        if argv[:1] == ["/usr/local/bin/manage_project.sh"]:
+            return self._manage_project(argv[1:])
+        return 0, b"", b""
+
+    def _bundle(self, script):
+        output = [(BUNDLE_MARKER + "\n").encode()]
+        for line in script.splitlines():
+            if line.startswith("collect "):
+                _, index, command = shlex.split(line)
+                status, stdout, _ = self._command(shlex.split(command))
+                output.append(f"{index} {status} {len(stdout)}\n".encode() + stdout)
+        return 0, b"".join(output), b""
+
+    def _stat(self, paths):
+        lines = []
+        for path in paths:
+            try:
+                stat = os.stat(self.path(path))
+                lines.append(f"{stat.st_size} {int(stat.st_mtime)}")
+            except OSError:
+                lines.append("-")
+        return 0, "".join(line + "\n" for line in lines).encode(), b""
+
+    def _tree(self, remote_dir):
+        top = self.path(remote_dir)
+        if not os.path.isdir(top):
+            return 2, b"", f"{remote_dir} [error opening dir]\n".encode()
+        lines = [remote_dir]
+        for name in sorted(os.listdir(top)):
+            lines.append(f"|-- {name}")
+            if os.path.isdir(os.path.join(top, name)):
+                lines.extend(f"|   |-- {child}" for child in sorted(os.listdir(os.path.join(top, name))))
+        return 0, "".join(line + "\n" for line in lines).encode(), b""
+
+    def _apache_status(self, sites):
+        lines = []
+        for site in sites:
+            try:
+                digest = hashlib.sha256(self.read(f"{SITES_AVAILABLE}/{site}.conf")).hexdigest()
+            except OSError:
+                digest = "-"
+            enabled = int(os.path.exists(self.path(f"{SITES_ENABLED}/{site}.conf")))
+            lines.append(f"{site} {digest} {enabled}\n")
+        return 0, "".join(lines).encode(), b""
+
+    def _apache_apply(self, script):
+        variables = {}
+        for line in script.splitlines()[:2]:
+            name, _, value = line.partition("=")
+            variables[name] = shlex.split(value)[0].split() if value else []
+        for site in variables.get("CHANGED", []):
+            os.replace(self.path(f"{SITES_AVAILABLE}/{site}.conf.staged"), self.path(f"{SITES_AVAILABLE}/{site}.conf"))
+        for site in variables.get("TO_ENABLE", []):
+            self.write(f"{SITES_ENABLED}/{site}.conf", "")
+        return 0, b"", b""
+
+    def _manage_project(self, args):
+        registry = self._registry()
+        if args[:1] == ["list"]:
+            return 0, "".join(f"- {project['name']} ({project['type']})\n" for project in registry.list()).encode(), b""
+        if args[:1] == ["create"] and len(args) == 3:
+            os.makedirs(self.path(f"/opt/projects/{args[1]}"), exist_ok=True)
+            registry.put(args[1], args[2])
+            return 0, b"", b""
+        return 1, b"", b"Usage: manage_project.sh {create|delete|list} [project_name] [project_type]\n"
+
+    def _extract(self, remote_dir, archive):
+        # mkdir -p DIR && tar -xzf - --no-same-owner -C DIR
+        target = self.path(remote_dir)
+        os.makedirs(target, exist_ok=True)
+        try:
+            with tarfile.open(fileobj=io.BytesIO(archive), mode="r:gz") as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(target, filter="data")
+                else:
+                    tar.extractall(target)
+        except (tarfile.TarError, OSError) as e:
+            return 2, b"", f"tar: {e}\n".encode()
+        return 0, b"", b""
+
+    def _remove(self, remote_dir, names):
+        # cd DIR && xargs -0 rm -f --
+        for name in names.split(b"\0"):
+            if name:
+                try:
+                    os.remove(os.path.join(self.path(remote_dir), name.decode("utf-8")))
+                except OSError:
+                    pass
+        return 0, b"", b""
+
+
+class _MeteredReader:
+    def __init__(self, reader, transport):
+        self.reader = reader
+        self.transport = transport
+
+    def readline(self):
+        line = self.reader.readline()
+        self.transport._exchange(0, len(line), round_trip=False)
+        return line
+
+    def close(self):
+        self.reader.close()
+
+
+class _MeteredStream:
+    """A socket to the fake droplet's agent; every request line is one metered round trip."""
+
+    def __init__(self, sock, transport):
+        self.sock = sock
+        self.transport = transport
+
+    def sendall(self, data):
+        try:
+            self.transport._exchange(len(data), 0, command="agent request")
+        except subprocess.CalledProcessError as e:
+            # What a dropped SSH channel raises
+            raise ConnectionResetError(e.stderr)
+        self.sock.sendall(data)
+
+    def makefile(self, mode):
+        return _MeteredReader(self.sock.makefile(mode), self.transport)
+
+    def close(self):
+        self.sock.close()
+
+
+class FakeTransport:
+    """Transport backend for a FakeDroplet, with the interface of SSHTransport.
+
+    Every run, write_file and read_file is one round trip through `profile`
+    and counted in `meter`; a simulated connection failure raises the same
+    CalledProcessError (exit status 255) a dropped SSH connection does.
+    """
+
+    def __init__(self, droplet, profile=None, meter=None):
+        self.droplet = droplet
+        self.profile = profile or NetworkProfile()
+        self.meter = meter or Meter()
+        self.commands_run = 0
+
+    def _exchange(self, sent, received, round_trip=True, command="exchange"):
+        if round_trip and self.profile.fails():
+            self.meter.add(round_trips=1, failures=1)
+            raise subprocess.CalledProcessError(SSH_CONNECTION_FAILED, command,
+                                                stderr="Simulated connection failure")
+        delay = self.profile.transfer_time(sent + received) + (self.profile.rtt if round_trip else 0)
+        self.meter.add(round_trips=int(round_trip), bytes_sent=sent, bytes_received=received,
+                       network_seconds=delay)
+        if delay > 0:
+            time.sleep(delay)
+
+    def run(self, command, check=False, capture_output=False, text=True, input=None, timeout=None):
+        self.commands_run += 1
+        if hasattr(input, "read"):
+            chunks = []
+            while True:
+                chunk = input.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(_as_bytes(chunk))
+            stdin = b"".join(chunks)
+        else:
+            stdin = _as_bytes(input) or b""
+        self._exchange(len(command) + len(stdin), 0, command=command)
+        returncode, stdout, stderr = self.droplet.execute(command, stdin)
+        self._exchange(0, len(stdout) + len(stderr), round_trip=False)
+        if not capture_output:
+            stdout = stderr = None
+        return _completed(command, returncode, stdout, stderr, text, check)
+
+    def write_file(self, remote_path, content, mode=None):
+        content = _as_bytes(content)
+        self._exchange(len(remote_path) + len(content), 0, command=f"write {remote_path}")
+        try:
+            self.droplet.write(remote_path, content, mode)
+        except OSError as e:
+            raise subprocess.CalledProcessError(1, f"write {remote_path}", stderr=str(e))
+
+    def read_file(self, remote_path):
+        self._exchange(len(remote_path), 0, command=f"read {remote_path}")
+        try:
+            data = self.droplet.read(remote_path)
+        except OSError as e:
+            raise subprocess.CalledProcessError(1, f"read {remote_path}", stderr=str(e))
+        self._exchange(0, len(data), round_trip=False)
+        return data
+
+    def put_tree(self, local_dir, remote_dir):
+        for dirpath, dirnames, filenames in os.walk(local_dir):
+            target_dir = os.path.normpath(os.path.join(remote_dir, os.path.relpath(dirpath, local_dir)))
+            for filename in filenames:
+                with open(os.path.join(dirpath, filename), "rb") as f:
+                    self.write_file(os.path.join(target_dir, filename), f.read())
+
+    def open_tunnel(self, port):
+        address = self.droplet.agent_address()
+        if address is None:
+            raise subprocess.CalledProcessError(SSH_CONNECTION_FAILED, f"tunnel to port {port}",
+                                                stderr="Connection refused")
+        self._exchange(0, 0, command=f"tunnel to port {port}")
+        return _MeteredStream(socket.create_connection(address), self)
+
+    def close(self):
+        pass
+
+
+def fake_transport_factory(droplets, profile=None, meter=None):
+    """A factory for ssh_transport.set_transport_factory serving the FakeDroplets in `droplets` ({host: droplet})."""
+    def factory(host):
+        if host not in droplets:
+            raise subprocess.CalledProcessError(SSH_CONNECTION_FAILED, f"connect to {host}",
+                                                stderr="No route to host")
+        return FakeTransport(droplets[host], profile, meter)
+    return factory
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from agent_client import AgentError
+from do_client import get_client
+from gather_deployment_info import collect_deployment_info
+from registry_cache import get_registry
+from ssh_transport import get_transport
+
+DEFAULT_WORKERS = 16
+# Every concurrent collection is one channel on the droplet's shared SSH
+# connection; stay well below sshd's default MaxSessions of 10.
+DEFAULT_PER_HOST = 4
+DEFAULT_OUTPUT = "fleet_inventory.json"
+
+# Reads the project registry in one round trip on droplets whose agent does
+# not answer: the registry database if there is one, else the loose
+# /opt/configs/<name>.json files of older droplets. A json file next to the
+# database is imported the next time the registry opens, so it is not read
+# here too. Credential files share that directory, so only entries that
+# describe a project are kept.
+REGISTRY_SCRIPT = """
+import glob, json, os, sqlite3
+projects = []
+if os.path.exists('/opt/configs/registry.db'):
+    db = sqlite3.connect('file:/opt/configs/registry.db?mode=ro', uri=True)
+    projects = [{'name': name, 'type': type} for name, type in db.execute('SELECT name, type FROM projects ORDER BY name')]
+else:
+    for path in sorted(glob.glob('/opt/configs/*.json')):
+        try:
+            with open(path) as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if isinstance(config, dict) and 'name' in config and 'type' in config:
+            projects.append({'name': config['name'], 'type': config['type']})
+print(json.dumps(projects))
+"""
+
+def get_tagged_droplet_ips(token, tag):
+    return [droplet.ip_address for droplet in get_client(token).iter_droplets(tag_name=tag) if droplet.ip_address]
+
+def list_registered_projects(droplet_ip):
+    answered, projects = get_registry(droplet_ip).list()
+    if answered:
+        return projects
+    result = get_transport(droplet_ip).run("python3 -", input=REGISTRY_SCRIPT, capture_output=True, check=True)
+    return json.loads(result.stdout)
+
+def build_inventory(droplet_ips, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, batched=True, use_cache=True):
+    inventory = {"droplets": {ip: {"projects": {}, "errors": []} for ip in droplet_ips}}
+    host_slots = {ip: threading.BoundedSemaphore(per_host) for ip in droplet_ips}
+
+    def discover(droplet_ip):
+        with host_slots[droplet_ip]:
+            return list_registered_projects(droplet_ip)
+
+    def collect(droplet_ip, project):
+        with host_slots[droplet_ip]:
+            started = time.monotonic()
+            info = collect_deployment_info(project["name"], project["type"], droplet_ip, batched, use_cache)
+            return info, time.monotonic() - started
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        discoveries = {executor.submit(discover, ip): ip for ip in droplet_ips}
+        collections = {}
+        for future in as_completed(discoveries):
+            droplet_ip = discoveries[future]
+            try:
+                projects = future.result()
+            except (subprocess.CalledProcessError, ValueError, AgentError) as e:
+                inventory["droplets"][droplet_ip]["errors"].append(f"Unable to read project registry: {e}")
+                continue
+            for project in projects:
+                collections[executor.submit(collect, droplet_ip, project)] = (droplet_ip, project["name"])
+
+        for future in as_completed(collections):
+            droplet_ip, project_name = collections[future]
+            try:
+                info, elapsed = future.result()
+            except Exception as e:
+                inventory["droplets"][droplet_ip]["errors"].append(f"Unable to collect '{project_name}': {e}")
+                continue
+            info["collection_seconds"] = round(elapsed, 3)
+            inventory["droplets"][droplet_ip]["projects"][project_name] = info
+
+    inventory["generated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    inventory["elapsed_seconds"] = round(time.monotonic() - started, 3)
+    return inventory
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect deployment information for every project on every managed droplet.")
+    parser.add_argument("--droplets", help="Comma-separated droplet IP addresses (default: droplets with --tag)")
+    parser.add_argument("--tag", default="managed", help="DigitalOcean tag used to discover droplets (default: managed)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Maximum concurrent collections across the fleet")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST, help="Maximum concurrent collections per droplet")
+    parser.add_argument("--no-batch", action="store_true", help="Use one round trip per field instead of a batched bundle")
+    parser.add_argument("--no-cache", action="store_true", help="Collect every field instead of reusing cached ones")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help=f"Inventory file to write (default: {DEFAULT_OUTPUT})")
+    args = parser.parse_args()
+
+    if args.droplets:
+        droplet_ips = [ip.strip() for ip in args.droplets.split(",") if ip.strip()]
+    else:
+        token = os.getenv("DO_TOKEN")
+        if not token:
+            print("DigitalOcean API token not found. Set DO_TOKEN or pass --droplets.")
+            sys.exit(1)
+        droplet_ips = get_tagged_droplet_ips(token, args.tag)
+
+    if not droplet_ips:
+        print("No droplets to inventory.")
+        sys.exit(1)
+
+    print(f"Building inventory for {len(droplet_ips)} droplet(s)...")
+    inventory = build_inventory(droplet_ips, args.workers, args.per_host, not args.no_batch, not args.no_cache)
+
+    try:
+        with open(args.output, 'w') as f:
+            json.dump(inventory, f, indent=2)
+    except IOError as e:
+        print(f"Error: Unable to write inventory to {args.output}")
+        print(f"Error details: {e}")
+        sys.exit(1)
+
+    project_count = sum(len(droplet["projects"]) for droplet in inventory["droplets"].values())
+    error_count = sum(len(droplet["errors"]) for droplet in inventory["droplets"].values())
+    print(f"\nInventory of {project_count} project(s) on {len(droplet_ips)} droplet(s) saved to {args.output} "
+          f"in {inventory['elapsed_seconds']}s ({error_count} error(s))")
+    print("Keep this file secure, as it contains sensitive information about your deployments.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+import zlib
+
+METRICS_PATH = "monitoring/metrics/droplet"
+DEFAULT_INTERVAL = 300
+DEFAULT_CONCURRENCY = 10
+# Resolution of DigitalOcean's monitoring series; CPU is a counter, so its
+# query reaches one step further back to have a baseline for the first point
+METRICS_STEP = 60
+# Totals only change on resize; they are queried over an hour-aligned window
+# so the client's cache answers them for the rest of the hour
+TOTALS_TTL = 3600
+
+
+def _points(result):
+    return [(float(timestamp), float(value)) for timestamp, value in result["values"]]
+
+
+def _summary(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {"avg": sum(values) / len(values), "max": ordered[-1],
+            "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]}
+
+
+def cpu_usage(results):
+    """Per-step CPU utilisation from the cumulative per-mode CPU seconds series."""
+    by_time = {}
+    for result in results:
+        mode = result["metric"].get("mode")
+        for timestamp, value in _points(result):
+            by_time.setdefault(timestamp, {})[mode] = value
+    usage = []
+    timestamps = sorted(by_time)
+    for previous, current in zip(timestamps, timestamps[1:]):
+        modes = by_time[previous].keys() & by_time[current].keys()
+        total = sum(by_time[current][mode] - by_time[previous][mode] for mode in modes)
+        if total > 0 and "idle" in modes:
+            idle = by_time[current]["idle"] - by_time[previous]["idle"]
+            usage.append(100.0 * (1 - idle / total))
+    return usage
+
+
+def used_percent(free_results, total_results, mountpoint=None):
+    """Per-point used percentage from a free/available series and its total."""
+    def matching(results):
+        return [result for result in results
+                if mountpoint is None or result["metric"].get("mountpoint") == mountpoint]
+
+    totals = [value for result in matching(total_results) for _, value in _points(result)]
+    if not totals or not totals[-1]:
+        return []
+    total = totals[-1]
+    return [100.0 * (1 - value / total) for result in matching(free_results) for _, value in _points(result)]
+
+
+def fetch_droplet_metrics(client, droplet_id, start, end):
+    """avg/max/p95 of a droplet's "cpu", "memory", "disk" and "load_1" between `start` and `end`.
+
+    One range query per metric; a metric is None if the droplet reported no data.
+    """
+    def query(metric, query_start, query_end, ttl=0):
+        params = {"host_id": str(droplet_id), "start": str(int(query_start)), "end": str(int(query_end))}
+        return client.get(f"{METRICS_PATH}/{metric}", params, ttl)["data"]["result"]
+
+    hour = int(end // 3600 * 3600)
+    memory_total = query("memory_total", hour - 300, hour, TOTALS_TTL)
+    filesystem_size = query("filesystem_size", hour - 300, hour, TOTALS_TTL)
+    return {
+        "cpu": _summary(cpu_usage(query("cpu", start - METRICS_STEP, end))),
+        "memory": _summary(used_percent(query("memory_available", start, end), memory_total)),
+        "disk": _summary(used_percent(query("filesystem_free", start, end), filesystem_size, mountpoint="/")),
+        "load_1": _summary([value for result in query("load_1", start, end) for _, value in _points(result)]),
+    }
+
+
+def format_metrics(metrics):
+    parts = []
+    for name, label, unit in (("cpu", "CPU", "%"), ("memory", "memory", "%"), ("disk", "disk", "%"), ("load_1", "load", "")):
+        summary = metrics.get(name)
+        if summary:
+            parts.append(f"{label} avg/max/p95 {summary['avg']:.1f}/{summary['max']:.1f}/{summary['p95']:.1f}{unit}")
+    return ", ".join(parts) or "no monitoring data"
+
+
+def export_fleet_metrics(exporter, results):
+    for name, family, help_text in (("cpu", "fleet_cpu_percent", "Droplet CPU usage over the last interval"),
+                                    ("memory", "fleet_memory_percent", "Droplet memory usage over the last interval"),
+                                    ("disk", "fleet_disk_percent", "Droplet root filesystem usage over the last interval"),
+                                    ("load_1", "fleet_load1", "Droplet 1-minute load average over the last interval")):
+        samples = []
+        for droplet, metrics in results:
+            summary = metrics.get(name)
+            if summary:
+                samples += [({"droplet": droplet.name, "stat": stat}, summary[stat]) for stat in ("avg", "max", "p95")]
+        exporter.update(family, "gauge", help_text, samples)
+
+
+async def _poll_droplet(client, droplet, interval, offset, semaphore):
+    await asyncio.sleep(offset)
+    async with semaphore:
+        end = time.time()
+        try:
+            metrics = await asyncio.to_thread(fetch_droplet_metrics, client, droplet.id, end - interval, end)
+        except Exception as e:
+            logging.error(f"Could not fetch metrics for droplet {droplet.name}: {e}")
+            return droplet, {}
+    logging.info(f"Droplet {droplet.name} ({droplet.ip_address}): {format_metrics(metrics)}")
+    return droplet, metrics
+
+
+async def monitor_fleet(client, tag=None, interval=DEFAULT_INTERVAL, concurrency=DEFAULT_CONCURRENCY,
+                        exporter=None, rounds=None):
+    """Watch every droplet (or every droplet with `tag`) once per `interval`.
+
+    Droplets are polled concurrently, at most `concurrency` at a time, and
+    their start times are spread over half the interval by a stable per-droplet
+    offset so a large fleet does not hit the API in one burst.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    completed = 0
+    droplets = None
+    while rounds is None or completed < rounds:
+        started = time.monotonic()
+        try:
+            droplets = await asyncio.to_thread(client.get_all_droplets, tag)
+        except Exception as e:
+            # Poll the droplets of the previous round, if there was one, rather than stop monitoring
+            logging.error(f"Could not list droplets: {e}")
+        if droplets is not None:
+            logging.info(f"Polling monitoring metrics for {len(droplets)} droplet(s)")
+            spread = interval / 2
+            results = await asyncio.gather(*(
+                _poll_droplet(client, droplet, interval, zlib.crc32(str(droplet.id).encode()) % 1000 / 1000 * spread,
+                              semaphore)
+                for droplet in droplets))
+            if exporter:
+                export_fleet_metrics(exporter, results)
+        completed += 1
+        if rounds is None or completed < rounds:
+            await asyncio.sleep(max(interval - (time.monotonic() - started), 0))
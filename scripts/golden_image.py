@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+from do_actions import wait_for_action
+from do_client import get_client
+from provisioning import run_provisioning
+
+GOLDEN_IMAGE_RECORD = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   "config", "golden_image.json")
+SNAPSHOT_TIMEOUT = 1800
+
+# Run on the builder right before it is powered off. cloud-init forgets the
+# builder's identity so every droplet created from the snapshot gets its own
+# hostname and SSH host keys.
+BAKE_CLEANUP_STEPS = [
+    ("clean-apt-cache", "apt-get clean"),
+    ("clean-cloud-init", "if command -v cloud-init > /dev/null; then cloud-init clean --logs; fi"),
+    # The droplet agent generates a new secret on each droplet's first boot
+    ("forget-agent-token", "rm -f /etc/do-manager/agent.token"),
+]
+
+# What a droplet created from the golden image still needs. The setup_*
+# checkpoints are part of the snapshot, so running the regular setup stages
+# afterwards only re-runs steps that changed since the image was baked. Only
+# security updates are applied here; a full upgrade is what baking saves, and
+# droplets from one image should stay alike, so rebake to pick up upgrades.
+GOLDEN_IMAGE_DELTA_STEPS = [
+    ("security-updates", "apt-get update && if command -v unattended-upgrade > /dev/null; then unattended-upgrade; fi"),
+    ("restart-services", "systemctl restart apache2 mysql docker"),
+]
+
+def load_golden_image():
+    """Return the recorded golden image, or None if none has been baked."""
+    try:
+        with open(GOLDEN_IMAGE_RECORD) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_golden_image(record):
+    os.makedirs(os.path.dirname(GOLDEN_IMAGE_RECORD), exist_ok=True)
+    tmp_path = GOLDEN_IMAGE_RECORD + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp_path, GOLDEN_IMAGE_RECORD)
+
+def snapshot_droplet(droplet, snapshot_name, timeout=SNAPSHOT_TIMEOUT):
+    """Power the droplet off, snapshot it and return the new snapshot's image ID."""
+    client = get_client(droplet.token)
+    known_snapshots = set(droplet.snapshot_ids or [])
+    if droplet.status != "off":
+        logging.info(f"Powering off droplet '{droplet.name}' for a consistent snapshot...")
+        if not wait_for_action(client.perform_action(droplet, "power_off"), timeout):
+            raise RuntimeError(f"Droplet '{droplet.name}' did not power off")
+
+    logging.info(f"Taking snapshot '{snapshot_name}' of droplet '{droplet.name}'...")
+    if not wait_for_action(client.perform_action(droplet, "snapshot", name=snapshot_name), timeout):
+        raise RuntimeError(f"Snapshot '{snapshot_name}' did not complete")
+
+    droplet.load()
+    new_snapshots = [snapshot_id for snapshot_id in droplet.snapshot_ids if snapshot_id not in known_snapshots]
+    if not new_snapshots:
+        raise RuntimeError(f"Snapshot '{snapshot_name}' completed but is not listed on droplet '{droplet.name}'")
+    return new_snapshots[-1]
+
+def provision_from_golden_image(droplet, dry_run=False):
+    """Run the delta provisioning a droplet created from the golden image needs.
+
+    Raises subprocess.CalledProcessError if a step fails.
+    """
+    run_provisioning(droplet.ip_address, "golden_image_delta", GOLDEN_IMAGE_DELTA_STEPS, dry_run)
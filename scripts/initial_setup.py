@@ -1,94 +1,140 @@
 import os
 import subprocess
-import time
 import logging
-from digitalocean import Manager, Droplet, SSHKey, APIError
+from concurrent.futures import ThreadPoolExecutor
+from digitalocean import Error as APIError
+from do_actions import wait_for_droplet
+from droplet_agent import INSTALL_PATH as AGENT_INSTALL_PATH
+from do_client import get_client
+from golden_image import load_golden_image, provision_from_golden_image
+from provisioning import run_provisioning
 
 # Set up logging
 logging.basicConfig(filename='setup.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Upper limit of the API for creating droplets in one request
+MAX_DROPLETS_PER_CREATE = 10
+# Droplets waited on concurrently by create_droplets
+MAX_READY_WAITERS = 16
+
 class SetupError(Exception):
     """Custom exception for setup errors"""
-    pass
+    def __init__(self, message, droplets=()):
+        super().__init__(message)
+        # Droplets that were created before the failure and still need cleaning up
+        self.droplets = list(droplets)
+
+def _droplet_kwargs(client, region, size, image, tags):
+    # Snapshot images are referenced by numeric ID, distribution images by slug
+    if isinstance(image, str) and image.isdigit():
+        image = int(image)
+    return dict(
+        region=region,
+        size=size,
+        image=image,
+        ssh_keys=client.get_all_sshkeys(),
+        monitoring=True,  # Enable DigitalOcean monitoring
+        tags=tags or ["managed"]  # Add tag for management tools
+    )
 
-def create_droplet(token, droplet_name, region, size, image, dry_run=False):
-    manager = Manager(token=token)
+def create_droplet(token, droplet_name, region, size, image, dry_run=False, tags=None):
+    client = get_client(token)
     
     logging.info(f"Creating droplet '{droplet_name}'...")
+    droplet = None
     try:
         if dry_run:
             logging.info(f"Dry run: Would create droplet '{droplet_name}' in region {region} with size {size} and image {image}")
             return None
 
         # Create the Droplet with monitoring enabled
-        droplet = Droplet(
-            token=token,
-            name=droplet_name,
-            region=region,
-            size=size,
-            image=image,
-            ssh_keys=manager.get_all_sshkeys(),
-            monitoring=True,  # Enable DigitalOcean monitoring
-            tags=["managed"]  # Add tag for management tools
-        )
-        
-        droplet.create()
+        droplet, = client.create_droplets([droplet_name], **_droplet_kwargs(client, region, size, image, tags))
         
-        # Wait for the droplet to be ready
+        # Wait for the create action to finish and for SSH to come up
         logging.info("Waiting for the droplet to be ready. This may take a few minutes...")
-        while droplet.status != 'active':
-            time.sleep(30)
-            droplet.load()
+        wait_for_droplet(droplet)
         
         logging.info(f"Droplet '{droplet_name}' created successfully with monitoring enabled.")
         return droplet
     except APIError as e:
         logging.error(f"Error creating droplet: {e}")
-        raise SetupError(f"Failed to create droplet: {e}")
+        raise SetupError(f"Failed to create droplet: {e}", [droplet] if droplet else [])
+    except RuntimeError as e:
+        logging.error(f"Droplet did not become ready: {e}")
+        raise SetupError(f"Failed to create droplet: {e}", [droplet])
+
+def create_droplets(token, droplet_names, region, size, image, dry_run=False, tags=None):
+    """Create several droplets with one API call and wait for all of them at once.
+
+    Returns the droplets in the order of `droplet_names`. If a create request
+    fails or any droplet does not become ready a SetupError is raised; every
+    droplet that was created, ready or not, is in its `droplets`.
+    """
+    if not droplet_names:
+        return []
+    client = get_client(token)
+
+    logging.info(f"Creating {len(droplet_names)} droplets: {', '.join(droplet_names)}...")
+    try:
+        if dry_run:
+            logging.info(f"Dry run: Would create droplets {', '.join(droplet_names)} in region {region} with size {size} and image {image}")
+            return []
+
+        droplets = []
+        droplet_kwargs = _droplet_kwargs(client, region, size, image, tags)
+        for start in range(0, len(droplet_names), MAX_DROPLETS_PER_CREATE):
+            droplets += client.create_droplets(droplet_names[start:start + MAX_DROPLETS_PER_CREATE], **droplet_kwargs)
+    except APIError as e:
+        logging.error(f"Error creating droplets: {e}")
+        raise SetupError(f"Failed to create droplets: {e}", droplets)
+
+    logging.info("Waiting for the droplets to be ready. This may take a few minutes...")
+    failures = []
+    with ThreadPoolExecutor(max_workers=min(len(droplets), MAX_READY_WAITERS)) as executor:
+        futures = {executor.submit(wait_for_droplet, droplet): droplet for droplet in droplets}
+        for future, droplet in futures.items():
+            try:
+                future.result()
+            except (APIError, RuntimeError) as e:
+                logging.error(f"Droplet '{droplet.name}' did not become ready: {e}")
+                failures.append(droplet.name)
+
+    if failures:
+        raise SetupError(f"Droplets not ready: {', '.join(failures)}", droplets)
+    logging.info(f"{len(droplets)} droplets created successfully with monitoring enabled.")
+    return droplets
+
+# Everything apt installs goes into one transaction. The lock timeout lets the
+# DigitalOcean agent installers, which call apt themselves, wait for each other
+# while they run concurrently with the npm and snap installs.
+DROPLET_SETUP_STEPS = [
+    ("apt-lock-timeout", "echo 'DPkg::Lock::Timeout \"600\";' > /etc/apt/apt.conf.d/80do-manager-lock-timeout"),
+    ("apt-upgrade", "apt-get update && apt-get upgrade -y"),
+    ("apt-packages", "apt-get install -y python3-venv python3-pip nodejs npm php php-mysql apache2 mysql-server docker.io git jq curl"),
+    ("enable-services", "systemctl enable apache2 mysql docker && systemctl restart apache2"),
+    [
+        ("node-lts", "npm install -g n && n lts"),
+        ("doctl", "snap install doctl"),
+        ("do-agent", "curl -sSL https://agent.digitalocean.com/install.sh | sh"),
+        ("do-insights", "curl -sSL https://repos.insights.digitalocean.com/install.sh | bash"),
+    ],
+]
 
 def setup_droplet(droplet, dry_run=False):
     logging.info("Setting up the droplet with necessary software...")
-    commands = [
-        "apt update && apt upgrade -y",
-        "apt install -y python3-venv nodejs npm php",
-        "npm install -g n && n lts",
-        "apt install -y apache2",
-        "systemctl enable apache2",
-        "apt install -y mysql-server",
-        "systemctl enable mysql",
-        "apt install -y php-mysql",
-        "systemctl restart apache2",
-        "curl -sSL https://agent.digitalocean.com/install.sh | sh",
-        "snap install doctl",
-        "curl -sSL https://repos.insights.digitalocean.com/install.sh | sudo bash",
-        "apt install -y docker.io",
-        "systemctl enable docker",
-        "apt install -y python3-pip",
-        "apt install -y git",
-    ]
-    
-    for command in commands:
-        try:
-            if dry_run:
-                logging.info(f"Dry run: Would execute command: {command}")
-            else:
-                subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet.ip_address}", command], check=True)
-                logging.info(f"Successfully executed command: {command}")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error executing command '{command}': {e}")
-            raise SetupError(f"Failed to set up droplet: {e}")
+    try:
+        run_provisioning(droplet.ip_address, "setup_droplet", DROPLET_SETUP_STEPS, dry_run)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error provisioning droplet: {e}")
+        raise SetupError(f"Failed to set up droplet: {e}")
     
     logging.info("Droplet setup completed successfully.")
     return True
 
-def setup_project_management(droplet, dry_run=False):
-    logging.info("Setting up project management tools...")
-    commands = [
-        "mkdir -p /opt/projects",
-        "mkdir -p /opt/venvs",
-        "mkdir -p /opt/configs",
-        """cat << EOF > /usr/local/bin/manage_project.sh
+PROJECT_MANAGEMENT_STEPS = [
+    ("project-directories", "mkdir -p /opt/projects /opt/venvs /opt/configs"),
+    ("manage-project-script", """cat << EOF > /usr/local/bin/manage_project.sh
 #!/bin/bash
 
 function create_project() {
@@ -96,7 +142,7 @@ function create_project() {
     project_type=\$2
     mkdir -p /opt/projects/\$project_name
     python3 -m venv /opt/venvs/\$project_name
-    echo "{\\"name\\": \\"\$project_name\\", \\"type\\": \\"\$project_type\\"}" > /opt/configs/\$project_name.json
+    python3 /usr/local/lib/do-manager/project_registry.py create \$project_name \$project_type
     echo "Project \$project_name created successfully."
 }
 
@@ -104,17 +150,14 @@ function delete_project() {
     project_name=\$1
     rm -rf /opt/projects/\$project_name
     rm -rf /opt/venvs/\$project_name
-    rm -f /opt/configs/\$project_name.json
+    python3 /usr/local/lib/do-manager/project_registry.py delete \$project_name
+    rm -f /opt/configs/manifests/\$project_name.json
     echo "Project \$project_name deleted successfully."
 }
 
 function list_projects() {
     echo "Projects:"
-    for config in /opt/configs/*.json; do
-        project_name=\$(basename \$config .json)
-        project_type=\$(jq -r .type \$config)
-        echo "- \$project_name (\$project_type)"
-    done
+    python3 /usr/local/lib/do-manager/project_registry.py list
 }
 
 case \$1 in
@@ -131,28 +174,28 @@ case \$1 in
         echo "Usage: \$0 {create|delete|list} [project_name] [project_type]"
         exit 1
 esac
-EOF""",
-        "chmod +x /usr/local/bin/manage_project.sh"
-    ]
-    
-    for command in commands:
-        try:
-            if dry_run:
-                logging.info(f"Dry run: Would execute command: {command}")
-            else:
-                subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet.ip_address}", command], check=True)
-                logging.info(f"Successfully executed command: {command}")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error executing command: {e}")
-            raise SetupError(f"Failed to set up project management: {e}")
+EOF"""),
+    ("manage-project-script-executable", "chmod +x /usr/local/bin/manage_project.sh"),
+]
+
+def get_project_management_steps():
+    # manage_project.sh keeps its projects in the registry, so it needs
+    # project_registry.py whether or not the agent is installed
+    return PROJECT_MANAGEMENT_STEPS + [("project-registry-install", _install_modules(["project_registry.py"]))]
+
+def setup_project_management(droplet, dry_run=False):
+    logging.info("Setting up project management tools...")
+    try:
+        run_provisioning(droplet.ip_address, "setup_project_management", get_project_management_steps(), dry_run)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error executing command: {e}")
+        raise SetupError(f"Failed to set up project management: {e}")
     
     logging.info("Project management setup completed successfully.")
     return True
 
-def setup_do_credentials(droplet, dry_run=False):
-    logging.info("Setting up DigitalOcean credentials management...")
-    commands = [
-        """cat << EOF > /usr/local/bin/manage_do_credentials.sh
+DO_CREDENTIALS_STEPS = [
+    ("manage-do-credentials-script", """cat << EOF > /usr/local/bin/manage_do_credentials.sh
 #!/bin/bash
 
 function set_credentials() {
@@ -191,20 +234,62 @@ case \$1 in
         echo "Usage: \$0 {set|get|delete} [project_name] [do_token]"
         exit 1
 esac
-EOF""",
-        "chmod +x /usr/local/bin/manage_do_credentials.sh"
+EOF"""),
+    ("manage-do-credentials-script-executable", "chmod +x /usr/local/bin/manage_do_credentials.sh"),
+]
+
+# Installed side by side in the agent's directory
+AGENT_MODULES = ("droplet_agent.py", "project_registry.py")
+AGENT_SERVICE = "do-manager-agent"
+
+AGENT_UNIT = f"""[Unit]
+Description=do-manager droplet agent
+After=network.target
+
+[Service]
+ExecStart=/usr/bin/python3 {AGENT_INSTALL_PATH}
+Restart=on-failure
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+def _install_modules(modules):
+    """Shell that copies `modules` from this directory into the agent's directory on the droplet."""
+    install_dir = os.path.dirname(AGENT_INSTALL_PATH)
+    install = f"mkdir -p {install_dir}\n"
+    for module in modules:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module)) as f:
+            install += f"cat << 'DO_MANAGER_AGENT_EOF' > {install_dir}/{module}\n{f.read()}DO_MANAGER_AGENT_EOF\n"
+    return install
+
+def get_agent_steps():
+    # The install step's hash covers the modules' source, so a changed agent is
+    # reinstalled and restarted on the next run
+    return [
+        ("agent-install", _install_modules(AGENT_MODULES) + f"systemctl try-restart {AGENT_SERVICE}"),
+        ("agent-service", f"cat << 'EOF' > /etc/systemd/system/{AGENT_SERVICE}.service\n{AGENT_UNIT}EOF\n"
+                          f"systemctl daemon-reload && systemctl enable --now {AGENT_SERVICE}"),
     ]
-    
-    for command in commands:
-        try:
-            if dry_run:
-                logging.info(f"Dry run: Would execute command: {command}")
-            else:
-                subprocess.run(["ssh", "-o", "StrictHostKeyChecking=no", f"root@{droplet.ip_address}", command], check=True)
-                logging.info(f"Successfully executed command: {command}")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error executing command: {e}")
-            raise SetupError(f"Failed to set up DigitalOcean credentials management: {e}")
+
+def setup_droplet_agent(droplet, dry_run=False):
+    logging.info("Installing the droplet agent...")
+    try:
+        run_provisioning(droplet.ip_address, "setup_droplet_agent", get_agent_steps(), dry_run)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error executing command: {e}")
+        raise SetupError(f"Failed to install the droplet agent: {e}")
+
+    logging.info("Droplet agent installed successfully.")
+    return True
+
+def setup_do_credentials(droplet, dry_run=False):
+    logging.info("Setting up DigitalOcean credentials management...")
+    try:
+        run_provisioning(droplet.ip_address, "setup_do_credentials", DO_CREDENTIALS_STEPS, dry_run)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error executing command: {e}")
+        raise SetupError(f"Failed to set up DigitalOcean credentials management: {e}")
     
     logging.info("DigitalOcean credentials management setup completed successfully.")
     return True
@@ -253,16 +338,36 @@ def main():
     print("s-2vcpu-4gb - 2 vCPU, 4 GB RAM, 80 GB SSD")
     size = input("Enter the size for the droplet (e.g., s-1vcpu-1gb): ")
     
+    golden_image = load_golden_image()
+    if golden_image and region not in golden_image["regions"]:
+        print(f"\nThe golden image '{golden_image['name']}' is only available in {', '.join(golden_image['regions'])}.")
+        golden_image = None
+
     print("\nRecommended image:")
+    if golden_image:
+        default_image = str(golden_image["snapshot_id"])
+        print(f"{default_image} - Golden image '{golden_image['name']}' (pre-provisioned, created {golden_image['created_at']})")
+    else:
+        default_image = "ubuntu-20-04-x64"
     print("ubuntu-20-04-x64 - Ubuntu 20.04 LTS x64")
-    image = input("Enter the image for the droplet (press Enter for ubuntu-20-04-x64): ") or "ubuntu-20-04-x64"
+    image = input(f"Enter the image for the droplet (press Enter for {default_image}): ") or default_image
+    from_golden_image = golden_image is not None and image == str(golden_image["snapshot_id"])
     
+    droplet = None
     try:
         droplet = create_droplet(token, droplet_name, region, size, image, dry_run)
         if not dry_run and droplet:
             if input("Droplet created. Continue with setup? (yes/no): ").lower() != 'yes':
                 raise SetupError("Setup cancelled by user")
 
+            if from_golden_image:
+                # Everything else is already on the image; the setup stages
+                # below only re-run steps that changed since it was baked.
+                try:
+                    provision_from_golden_image(droplet, dry_run)
+                except subprocess.CalledProcessError as e:
+                    raise SetupError(f"Failed to provision droplet from the golden image: {e}")
+
             if setup_droplet(droplet, dry_run):
                 if input("Droplet setup complete. Set up project management? (yes/no): ").lower() != 'yes':
                     raise SetupError("Setup cancelled by user")
@@ -271,7 +376,7 @@ def main():
                     if input("Project management setup complete. Set up DigitalOcean credentials management? (yes/no): ").lower() != 'yes':
                         raise SetupError("Setup cancelled by user")
 
-                    if setup_do_credentials(droplet, dry_run):
+                    if setup_do_credentials(droplet, dry_run) and setup_droplet_agent(droplet, dry_run):
                         logging.info("Initial setup complete")
                         print("\nInitial setup complete!")
                         print(f"Your droplet is ready to use at IP: {droplet.ip_address}")
@@ -279,12 +384,15 @@ def main():
                         print(f"ssh root@{droplet.ip_address} '/usr/local/bin/manage_project.sh [create|delete|list] [project_name] [project_type]'")
                         print("\nTo manage DigitalOcean credentials for projects, use the following command:")
                         print(f"ssh root@{droplet.ip_address} '/usr/local/bin/manage_do_credentials.sh [set|get|delete] [project_name] [do_token]'")
+                        print("\nThe deployment scripts use the droplet agent (do-manager-agent service) for these operations when it is running.")
                         print("\nDigitalOcean monitoring and management tools have been enabled for your droplet.")
                         print("You can view monitoring data and manage your droplet in the DigitalOcean dashboard.")
                         print("\nPlease refer to the README.md and droplet_monitoring.md files for more information on how to use, monitor, and manage your new multi-project droplet.")
     except SetupError as e:
         logging.error(f"Setup failed: {e}")
         print(f"Setup failed: {e}")
+        # A droplet that never became ready is only known to the error
+        droplet = droplet or next(iter(e.droplets), None)
         if not dry_run and droplet:
             if input("Do you want to clean up created resources? (yes/no): ").lower() == 'yes':
                 cleanup_resources(droplet)
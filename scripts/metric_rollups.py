@@ -0,0 +1,121 @@
+import math
+from array import array
+from collections import deque
+
+# Rollup windows reported for every metric, in seconds
+ROLLUP_WINDOWS = {"1m": 60, "5m": 300, "1h": 3600}
+# Percentile estimates use a fixed histogram over [0, HISTOGRAM_MAX]; values
+# above it land in the last bucket. Percent metrics fit exactly.
+HISTOGRAM_MAX = 100.0
+HISTOGRAM_BUCKETS = 1000
+
+
+class RingBuffer:
+    """The newest `capacity` (timestamp, value) samples, addressed by an ever-increasing sequence number."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.next_seq = 0
+
+    def append(self, timestamp, value):
+        slot = self.next_seq % self.capacity
+        self.timestamps[slot] = timestamp
+        self.values[slot] = value
+        self.next_seq += 1
+        return self.next_seq - 1
+
+    def timestamp(self, seq):
+        return self.timestamps[seq % self.capacity]
+
+    def value(self, seq):
+        return self.values[seq % self.capacity]
+
+
+class RollingWindow:
+    """min/avg/max/p95 over the samples of the last `seconds`, updated in amortised O(1) per sample."""
+
+    def __init__(self, seconds, buffer):
+        self.seconds = seconds
+        self.buffer = buffer
+        self.tail = 0
+        self.count = 0
+        self.total = 0.0
+        self.histogram = array('I', bytes(4 * HISTOGRAM_BUCKETS))
+        self.minimums = deque()
+        self.maximums = deque()
+
+    @staticmethod
+    def _bucket(value):
+        return min(max(int(value / HISTOGRAM_MAX * HISTOGRAM_BUCKETS), 0), HISTOGRAM_BUCKETS - 1)
+
+    def add(self, seq, value):
+        self.count += 1
+        self.total += value
+        self.histogram[self._bucket(value)] += 1
+        while self.minimums and self.minimums[-1][1] >= value:
+            self.minimums.pop()
+        self.minimums.append((seq, value))
+        while self.maximums and self.maximums[-1][1] <= value:
+            self.maximums.pop()
+        self.maximums.append((seq, value))
+
+    def _evict_oldest(self):
+        value = self.buffer.value(self.tail)
+        self.count -= 1
+        self.total -= value
+        self.histogram[self._bucket(value)] -= 1
+        if self.minimums and self.minimums[0][0] == self.tail:
+            self.minimums.popleft()
+        if self.maximums and self.maximums[0][0] == self.tail:
+            self.maximums.popleft()
+        self.tail += 1
+
+    def expire(self, now):
+        """Drop samples older than the window and any the next append would overwrite; call before that append."""
+        cutoff = now - self.seconds
+        overwritten = self.buffer.next_seq - self.buffer.capacity
+        while self.count and (self.tail <= overwritten or self.buffer.timestamp(self.tail) < cutoff):
+            self._evict_oldest()
+        if not self.count:
+            self.tail = self.buffer.next_seq
+
+    def percentile(self, fraction):
+        rank = math.ceil(fraction * self.count)
+        seen = 0
+        for bucket, bucket_count in enumerate(self.histogram):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                # Upper edge of the bucket, clamped to the exact maximum
+                return min((bucket + 1) * HISTOGRAM_MAX / HISTOGRAM_BUCKETS, self.maximums[0][1])
+        return self.maximums[0][1]
+
+    def rollup(self):
+        if not self.count:
+            return None
+        return {"min": self.minimums[0][1], "avg": self.total / self.count,
+                "max": self.maximums[0][1], "p95": self.percentile(0.95), "samples": self.count}
+
+
+class MetricSeries:
+    """One sampled metric with its rolling rollups over ROLLUP_WINDOWS."""
+
+    def __init__(self, name, sample_interval, windows=ROLLUP_WINDOWS):
+        self.name = name
+        # Room for the longest window at the configured rate, plus slack for jitter
+        capacity = int(max(windows.values()) / sample_interval * 1.1) + 16
+        self.buffer = RingBuffer(capacity)
+        self.windows = {label: RollingWindow(seconds, self.buffer) for label, seconds in windows.items()}
+        self.last = None
+
+    def add(self, timestamp, value):
+        for window in self.windows.values():
+            window.expire(timestamp)
+        seq = self.buffer.append(timestamp, value)
+        for window in self.windows.values():
+            window.add(seq, value)
+        self.last = value
+
+    def rollups(self):
+        return {label: window.rollup() for label, window in self.windows.items()}
@@ -0,0 +1,335 @@
+import bisect
+import contextlib
+import logging
+import math
+import mmap
+import os
+import re
+import shutil
+import time
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+
+DEFAULT_HISTORY_DIR = "metrics_history"
+DAY = 86400
+# Raw samples are kept this many days, then downsampled to one row per minute
+RAW_RETENTION_DAYS = 7
+# Downsampled rows are kept this many days, then deleted
+ROLLUP_RETENTION_DAYS = 90
+DOWNSAMPLE_SECONDS = 60
+# Seconds between writes of buffered samples to disk
+FLUSH_INTERVAL = 10
+
+# Every stored series is a percentage, kept as hundredths of a percent
+SCALE = 100
+MAX_STORED = 0xFFFF
+# One file per column, fixed width per record. Timestamps are milliseconds
+# since the UTC midnight the segment is named after, which fits 32 bits; they
+# are not delta-encoded, so queries can bisect the mapped column directly.
+RAW_COLUMNS = {"ts": "I", "value": "H"}
+# Each downsampled minute keeps a sparse histogram of its samples in
+# HISTOGRAM_BIN wide bins (0.1 points); "hist_end" is the end of the minute's
+# bins in the histogram columns
+ROLLUP_COLUMNS = {"ts": "I", "count": "H", "min": "H", "avg": "H", "max": "H", "hist_end": "I"}
+HISTOGRAM_COLUMNS = {"bin": "H", "count": "H"}
+HISTOGRAM_BIN = 10
+ROLLUP_SUFFIX = ".1m"
+HISTOGRAM_SUFFIX = ".hist"
+
+DURATION = re.compile(r"^(\d+(?:\.\d+)?)([smhd]?)$")
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": DAY}
+
+
+def parse_duration(text):
+    """Seconds from '90', '30s', '5m', '1h' or '7d'."""
+    match = DURATION.match(text.strip())
+    if not match:
+        raise ValueError(f"Invalid duration: {text}")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def parse_time(text, now=None):
+    """Epoch seconds from 'now', a duration ago ('24h') or an ISO date/time (local unless it has an offset)."""
+    now = time.time() if now is None else now
+    if text == "now":
+        return now
+    try:
+        return now - parse_duration(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time: {text}") from None
+
+
+def _day_name(day):
+    return datetime.fromtimestamp(day * DAY, timezone.utc).date().isoformat()
+
+
+def _day_index(name):
+    try:
+        return int(datetime.fromisoformat(name).replace(tzinfo=timezone.utc).timestamp() // DAY)
+    except ValueError:
+        return None
+
+
+def _file_name(series):
+    return re.sub(r"[^\w.-]", "_", series)
+
+
+class _Segment:
+    """The memory-mapped columns of one series for one day, as typed memoryviews."""
+
+    def __init__(self, prefix, columns):
+        self.maps = []
+        self.columns = {}
+        self.length = None
+        for column, typecode in columns.items():
+            view = self._map(f"{prefix}.{column}", typecode)
+            self.columns[column] = view
+            self.length = len(view) if self.length is None else min(self.length, len(view))
+        # A crash between column writes can leave one column a record ahead
+        self.columns = {column: view[:self.length] for column, view in self.columns.items()}
+
+    def _map(self, path, typecode):
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                # Ignore a trailing partial record
+                size -= size % array(typecode).itemsize
+                if not size:
+                    return memoryview(array(typecode))
+                mapping = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return memoryview(array(typecode))
+        self.maps.append(mapping)
+        return memoryview(mapping).cast(typecode)
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def span(self, start_ms, end_ms):
+        """Index range of the records with start_ms <= timestamp < end_ms."""
+        timestamps = self.columns["ts"]
+        return bisect.bisect_left(timestamps, start_ms), bisect.bisect_left(timestamps, end_ms)
+
+    def close(self):
+        for view in self.columns.values():
+            view.release()
+        for mapping in self.maps:
+            mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _percentile(ordered, fraction):
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def _histogram_percentile(bins, fraction, low, high):
+    """Percentile of a {bin: count} histogram, as the middle of its bin clamped to [low, high]."""
+    rank = max(math.ceil(fraction * sum(bins.values())) - 1, 0)
+    for index in sorted(bins):
+        rank -= bins[index]
+        if rank < 0:
+            return min(max(index * HISTOGRAM_BIN + HISTOGRAM_BIN // 2, low), high)
+    return high
+
+
+def _aggregate(segment, histogram, lo, hi, percentiles):
+    """count, sum, min, max, raw values and merged {bin: count} of records lo:hi, in stored units."""
+    if histogram is not None:
+        counts, averages = segment["count"][lo:hi], segment["avg"][lo:hi]
+        total = sum(count * average for count, average in zip(counts, averages))
+        bins = Counter()
+        if percentiles:
+            ends = segment["hist_end"]
+            first, last = ends[lo - 1] if lo else 0, ends[hi - 1]
+            for index, count in zip(histogram["bin"][first:last], histogram["count"][first:last]):
+                bins[index] += count
+        return sum(counts), total, min(segment["min"][lo:hi]), max(segment["max"][lo:hi]), [], bins
+    values = segment["value"][lo:hi]
+    return hi - lo, sum(values), min(values), max(values), values.tolist() if percentiles else [], Counter()
+
+
+class MetricStore:
+    """Append-only, day-segmented columnar history of percentage series.
+
+    Raw days are downsampled to per-minute rows after RAW_RETENTION_DAYS and
+    deleted after ROLLUP_RETENTION_DAYS.
+    """
+
+    def __init__(self, root=DEFAULT_HISTORY_DIR):
+        self.root = root
+        self.pending = {}
+        self.last_ms = {}
+        self.retention_day = None
+
+    def append(self, series, timestamp, value):
+        day = int(timestamp // DAY)
+        offset = int((timestamp - day * DAY) * 1000)
+        # Timestamps must increase within a segment for queries to bisect them
+        if self.last_ms.get(series, (day, -1)) >= (day, offset):
+            return
+        self.last_ms[series] = (day, offset)
+        timestamps, values = self.pending.setdefault((day, series), (array("I"), array("H")))
+        timestamps.append(offset)
+        values.append(min(max(int(round(value * SCALE)), 0), MAX_STORED))
+
+    def flush(self):
+        for (day, series), (timestamps, values) in self.pending.items():
+            directory = os.path.join(self.root, _day_name(day))
+            os.makedirs(directory, exist_ok=True)
+            prefix = os.path.join(directory, _file_name(series))
+            # Values first: a reader trims to the shorter column
+            with open(f"{prefix}.value", "ab") as f:
+                values.tofile(f)
+            with open(f"{prefix}.ts", "ab") as f:
+                timestamps.tofile(f)
+        self.pending.clear()
+
+        today = int(time.time() // DAY)
+        if self.retention_day != today:
+            self.retention_day = today
+            self.enforce_retention()
+
+    def enforce_retention(self, now=None):
+        """Downsample raw days past RAW_RETENTION_DAYS and delete days past ROLLUP_RETENTION_DAYS."""
+        today = int((time.time() if now is None else now) // DAY)
+        for name in self._days():
+            age = today - _day_index(name)
+            directory = os.path.join(self.root, name)
+            if age > ROLLUP_RETENTION_DAYS:
+                shutil.rmtree(directory)
+                logging.info(f"Deleted metrics history for {name}")
+            elif age > RAW_RETENTION_DAYS:
+                raw = [file[:-len(".ts")] for file in os.listdir(directory)
+                       if file.endswith(".ts") and not file.endswith(f"{ROLLUP_SUFFIX}.ts")]
+                for series_file in raw:
+                    self._downsample(os.path.join(directory, series_file))
+                if raw:
+                    logging.info(f"Downsampled metrics history for {name} to one-minute rows")
+
+    def _downsample(self, prefix):
+        rollup_prefix = prefix + ROLLUP_SUFFIX
+        # A previous run may have written the rollup but not removed the raw files
+        if not os.path.exists(f"{rollup_prefix}.ts"):
+            rows = {column: array(typecode) for column, typecode in ROLLUP_COLUMNS.items()}
+            histogram = {column: array(typecode) for column, typecode in HISTOGRAM_COLUMNS.items()}
+            step = DOWNSAMPLE_SECONDS * 1000
+            with _Segment(prefix, RAW_COLUMNS) as segment:
+                values = segment["value"]
+                for minute in range(0, DAY * 1000, step):
+                    lo, hi = segment.span(minute, minute + step)
+                    if lo == hi:
+                        continue
+                    chunk = values[lo:hi]
+                    ordered = sorted(chunk)
+                    chunk.release()
+                    rows["ts"].append(minute)
+                    rows["count"].append(min(hi - lo, MAX_STORED))
+                    rows["min"].append(ordered[0])
+                    rows["avg"].append(round(sum(ordered) / len(ordered)))
+                    rows["max"].append(ordered[-1])
+                    for index, count in sorted(Counter(value // HISTOGRAM_BIN for value in ordered).items()):
+                        histogram["bin"].append(index)
+                        histogram["count"].append(min(count, MAX_STORED))
+                    rows["hist_end"].append(len(histogram["bin"]))
+            files = {f"{rollup_prefix}.{column}": data for column, data in rows.items()}
+            files.update((f"{rollup_prefix}{HISTOGRAM_SUFFIX}.{column}", data) for column, data in histogram.items())
+            for path, data in files.items():
+                with open(f"{path}.tmp", "wb") as f:
+                    data.tofile(f)
+            # The timestamp column goes last, so its presence marks a complete rollup
+            for path in sorted(files, key=lambda path: path == f"{rollup_prefix}.ts"):
+                os.replace(f"{path}.tmp", path)
+        for column in RAW_COLUMNS:
+            try:
+                os.remove(f"{prefix}.{column}")
+            except FileNotFoundError:
+                pass
+
+    def _days(self):
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if _day_index(name) is not None)
+
+    def series(self):
+        """Names of every stored series."""
+        names = set()
+        for day in self._days():
+            for file in os.listdir(os.path.join(self.root, day)):
+                if file.endswith(f"{ROLLUP_SUFFIX}.ts"):
+                    names.add(file[:-len(f"{ROLLUP_SUFFIX}.ts")])
+                elif file.endswith(".ts"):
+                    names.add(file[:-len(".ts")])
+        return sorted(names)
+
+    def query(self, series, start, end, window, percentiles=(95,)):
+        """Aggregate `series` over [start, end) in consecutive windows of `window` seconds.
+
+        Returns one dict per window with data: "start", "samples", "min", "avg",
+        "max", "p<N>" and "approximate", set when downsampled minutes limit the
+        percentiles to HISTOGRAM_BIN precision.
+        """
+        buckets = {}
+        first_day, last_day = int(start // DAY), int((end - 0.001) // DAY)
+        for day in range(first_day, last_day + 1):
+            prefix = os.path.join(self.root, _day_name(day), _file_name(series))
+            if os.path.exists(f"{prefix}.ts"):
+                self._scan(_Segment(prefix, RAW_COLUMNS), None, day, start, end, window, percentiles, buckets)
+            elif os.path.exists(f"{prefix}{ROLLUP_SUFFIX}.ts"):
+                self._scan(_Segment(prefix + ROLLUP_SUFFIX, ROLLUP_COLUMNS),
+                           _Segment(prefix + ROLLUP_SUFFIX + HISTOGRAM_SUFFIX, HISTOGRAM_COLUMNS),
+                           day, start, end, window, percentiles, buckets)
+
+        results = []
+        for index in sorted(buckets):
+            count, total, low, high, values, bins = buckets[index]
+            result = {"start": start + index * window, "samples": count, "min": low / SCALE,
+                      "avg": total / count / SCALE, "max": high / SCALE, "approximate": bool(bins)}
+            if bins:
+                bins.update(value // HISTOGRAM_BIN for value in values)
+            else:
+                values.sort()
+            for percentile in percentiles:
+                if bins:
+                    value = _histogram_percentile(bins, percentile / 100, low, high)
+                else:
+                    value = _percentile(values, percentile / 100)
+                result[f"p{percentile:g}"] = value / SCALE
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _scan(segment, histogram, day, start, end, window, percentiles, buckets):
+        day_start = day * DAY
+        with segment, histogram or contextlib.nullcontext():
+            if not segment.length:
+                return
+            first = int((max(start, day_start) - start) // window)
+            last = int((min(end, day_start + DAY) - start - 0.001) // window)
+            for index in range(first, last + 1):
+                window_start = max(start + index * window, day_start)
+                window_end = min(start + (index + 1) * window, end, day_start + DAY)
+                lo, hi = segment.span(int((window_start - day_start) * 1000), int((window_end - day_start) * 1000))
+                if lo == hi:
+                    continue
+                count, total, low, high, values, bins = _aggregate(segment, histogram, lo, hi, percentiles)
+                bucket = buckets.get(index)
+                if bucket is None:
+                    bucket = buckets[index] = [0, 0, low, high, [], Counter()]
+                bucket[0] += count
+                bucket[1] += total
+                bucket[2] = min(bucket[2], low)
+                bucket[3] = max(bucket[3], high)
+                bucket[4] += values
+                bucket[5].update(bins)
@@ -0,0 +1,68 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PREFIX = "do_manager_"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render_family(name, metric_type, help_text, samples):
+    """Render one metric family of (labels dict, value) samples as OpenMetrics text."""
+    name = PREFIX + name
+    lines = [f"# TYPE {name} {metric_type}", f"# HELP {name} {_escape(help_text)}"]
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Serves the latest metrics snapshot on /metrics; scrapes never wait on sampling."""
+
+    def __init__(self, port, address="127.0.0.1"):
+        self.families = {}
+        self.snapshot = b"# EOF\n"
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((address, port), _MetricsHandler)
+        self.server.exporter = self
+        self.server.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def update(self, name, metric_type, help_text, samples):
+        """Re-render one family and publish a new snapshot."""
+        text = render_family(name, metric_type, help_text, samples)
+        with self.lock:
+            self.families[name] = text
+            # Swapping the reference is atomic; scrapes read whichever snapshot is current
+            self.snapshot = ("".join(self.families.values()) + "# EOF\n").encode("utf-8")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send headers and body as one segment; otherwise Nagle's algorithm and
+    # delayed ACKs add ~40ms to every keep-alive scrape
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.exporter.snapshot
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
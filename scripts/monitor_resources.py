@@ -1,8 +1,27 @@
+import argparse
+import asyncio
 import psutil
+import sys
+import threading
 import time
 import logging
-from digitalocean import Droplet, Manager
 import os
+import requests
+from do_client import get_client
+from fleet_monitor import DEFAULT_CONCURRENCY, export_fleet_metrics, fetch_droplet_metrics, format_metrics, monitor_fleet
+from metric_rollups import MetricSeries
+from metric_store import DEFAULT_HISTORY_DIR, FLUSH_INTERVAL, MetricStore, parse_duration, parse_time
+from metrics_exporter import MetricsExporter
+from project_attribution import ProjectAttributor
+from thresholds import AdaptiveInterval, ThresholdAlert
+
+HOST_METRICS = {"cpu": "CPU", "memory": "Memory", "disk": "Disk"}
+# Only these drive the adaptive sampling interval; disk usage barely moves, so
+# it is sampled every DISK_INTERVAL seconds instead
+VOLATILE_METRICS = ("cpu", "memory")
+DISK_INTERVAL = 30
+# Answers with the droplet's own ID when queried from a droplet
+METADATA_ID_URL = "http://169.254.169.254/metadata/v1/id"
 
 # Set up logging
 logging.basicConfig(filename='resource_monitoring.log', level=logging.INFO,
@@ -14,49 +33,305 @@ def get_droplet_info():
         logging.error("DigitalOcean API token not found")
         return None
 
-    manager = Manager(token=token)
-    droplets = manager.get_all_droplets()
+    client = get_client(token)
+    try:
+        droplet_id = requests.get(METADATA_ID_URL, timeout=1).text.strip()
+        return client.get_droplet(int(droplet_id))
+    except (requests.RequestException, ValueError):
+        logging.info("Not running on a droplet (metadata service unavailable); using the first droplet")
+
+    droplets = client.get_all_droplets()
     if not droplets:
         logging.error("No droplets found")
         return None
 
-    return droplets[0]  # Assuming we're monitoring the first droplet
+    return droplets[0]
+
+def sample_host_metrics(include_disk=True):
+    """Host-wide usage percentages; cheap enough to call several times a second."""
+    values = {
+        "cpu": psutil.cpu_percent(interval=None),
+        "memory": psutil.virtual_memory().percent,
+    }
+    if include_disk:
+        values["disk"] = psutil.disk_usage('/').percent
+    return values
+
+def format_rollups(metric):
+    parts = []
+    for label, rollup in metric.rollups().items():
+        if rollup:
+            parts.append(f"{label} min/avg/max/p95 {rollup['min']:.1f}/{rollup['avg']:.1f}/"
+                         f"{rollup['max']:.1f}/{rollup['p95']:.1f}% ({rollup['samples']} samples)")
+    return " | ".join(parts)
+
+def log_rollups(series):
+    for name, metric in series.items():
+        logging.info(f"{HOST_METRICS[name]} usage: {format_rollups(metric)}")
+
+def log_project_usage(project_series, project_usage):
+    for project in sorted(project_usage):
+        usage = project_usage[project]
+        logging.info(f"Project {project}: CPU {format_rollups(project_series[project])}; "
+                     f"RSS {usage['rss'] / 2**20:.1f} MB, I/O {usage['read_bytes_per_sec'] / 1024:.1f}/"
+                     f"{usage['write_bytes_per_sec'] / 1024:.1f} KB/s read/write, "
+                     f"{usage['connections']} connections, {usage['processes']} processes")
+
+def top_project(project_usage):
+    if not project_usage:
+        return ""
+    project = max(project_usage, key=lambda name: project_usage[name]["cpu"])
+    return f" (top project: {project} at {project_usage[project]['cpu']:.1f}% CPU)"
+
+def export_host_metrics(exporter, series):
+    exporter.update("host_usage_percent", "gauge", "Latest host usage sample",
+                    [({"resource": name}, metric.last) for name, metric in series.items()])
+    samples = []
+    for name, metric in series.items():
+        for window, rollup in metric.rollups().items():
+            if rollup:
+                samples += [({"resource": name, "window": window, "stat": stat}, rollup[stat])
+                            for stat in ("min", "avg", "max", "p95")]
+    exporter.update("host_usage_rollup_percent", "gauge", "Rolling host usage statistics", samples)
+
+PROJECT_FAMILIES = [
+    ("cpu", "project_cpu_percent", "Share of the droplet's CPU used by the project's processes"),
+    ("rss", "project_resident_memory_bytes", "Resident memory of the project's processes"),
+    ("read_bytes_per_sec", "project_read_bytes_per_second", "Disk read rate of the project's processes"),
+    ("write_bytes_per_sec", "project_write_bytes_per_second", "Disk write rate of the project's processes"),
+    ("connections", "project_connections", "Open inet connections of the project's processes"),
+    ("processes", "project_processes", "Number of processes attributed to the project"),
+]
+
+def export_project_metrics(exporter, project_usage):
+    for key, family, help_text in PROJECT_FAMILIES:
+        exporter.update(family, "gauge", help_text,
+                        [({"project": project}, usage[key]) for project, usage in sorted(project_usage.items())])
+
+def export_droplet_metrics(exporter, droplet):
+    labels = {"id": droplet.id, "name": droplet.name, "region": droplet.region["slug"], "status": droplet.status}
+    exporter.update("droplet_info", "gauge", "DigitalOcean droplet being monitored", [(labels, 1)])
+    exporter.update("droplet_memory_bytes", "gauge", "Memory size of the droplet", [({}, droplet.memory * 2**20)])
+    exporter.update("droplet_vcpus", "gauge", "vCPUs of the droplet", [({}, droplet.vcpus)])
+    exporter.update("droplet_disk_bytes", "gauge", "Disk size of the droplet", [({}, droplet.disk * 2**30)])
+
+def report_droplet_metrics(droplet, exporter, interval):
+    """Refresh the droplet and its DigitalOcean monitoring metrics for the last interval."""
+    try:
+        droplet.load()
+        end = time.time()
+        metrics = fetch_droplet_metrics(get_client(droplet.token), droplet.id, end - interval, end)
+    except Exception as e:
+        logging.error(f"Could not fetch DigitalOcean metrics: {e}")
+        return
+    logging.info(f"DigitalOcean metrics: {format_metrics(metrics)}")
+    if exporter:
+        export_droplet_metrics(exporter, droplet)
+        export_fleet_metrics(exporter, [(droplet, metrics)])
+
+def print_history(store, series, start, end, window, percentiles):
+    results = store.query(series, start, end, window, percentiles)
+    if not results:
+        print(f"No samples for {series} in that range")
+        return
+    stats = ["min", "avg", "max"] + [f"p{percentile:g}" for percentile in percentiles]
+    print(f"{'window start':<19} {'samples':>8} " + " ".join(f"{stat:>7}" for stat in stats))
+    time_format = "%Y-%m-%d %H:%M" if window >= 60 else "%Y-%m-%d %H:%M:%S"
+    for result in results:
+        start_text = time.strftime(time_format, time.localtime(result["start"]))
+        marker = " ~" if result["approximate"] else ""
+        print(f"{start_text:<19} {result['samples']:>8} " + " ".join(f"{result[stat]:>7.2f}" for stat in stats) + marker)
+    if percentiles and any(result["approximate"] for result in results):
+        print("~ includes downsampled minutes: percentiles are exact to 0.1 points")
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+def check_alerts(alerts, now, values, project_usage):
+    for name, value in values.items():
+        alert = alerts[name]
+        event = alert.update(now, value)
+        if event == "fire":
+            culprit = top_project(project_usage) if name == "cpu" else ""
+            logging.warning(f"High {HOST_METRICS[name]} usage: {value}% for {format_duration(now - alert.started)}"
+                            f" (peak {alert.peak}%){culprit}")
+        elif event == "clear":
+            logging.info(f"{HOST_METRICS[name]} usage back below {alert.clear_below:g}% after "
+                         f"{format_duration(now - alert.started)} (peak {alert.peak}%): {value}%")
 
-def monitor_resources(warning_threshold=80, check_interval=60):
+def monitor_resources(warning_threshold=80, check_interval=60, sample_interval=0.5, project_interval=5,
+                      exporter=None, export_interval=1, store=None, idle_interval=5, alert_after=30,
+                      clear_after=60, hysteresis=5, disk_interval=DISK_INTERVAL):
+    """Sample host usage until interrupted.
+
+    Samples are taken every `sample_interval` seconds while CPU or memory is
+    near `warning_threshold` or alerting, backing off to `idle_interval` when
+    the droplet is idle; disk usage is sampled every `disk_interval` seconds
+    whatever the load. CPU usage is averaged over whatever interval elapsed,
+    so slower sampling does not hide bursts. An alert fires once a metric has
+    been above the threshold for `alert_after` seconds and clears after
+    `clear_after` seconds at least `hysteresis` points below it.
+    """
     droplet = get_droplet_info()
     if not droplet:
         logging.error("Failed to get droplet information")
         return
 
     logging.info(f"Starting resource monitoring for droplet: {droplet.name}")
-    
+
+    # Samples are kept in fixed-size ring buffers; only rollups (every
+    # check_interval) and threshold crossings are logged.
+    series = {name: MetricSeries(name, disk_interval if name == "disk" else sample_interval)
+              for name in HOST_METRICS}
+    alerts = {name: ThresholdAlert(warning_threshold, alert_after, clear_after, hysteresis) for name in HOST_METRICS}
+    scheduler = AdaptiveInterval(sample_interval, idle_interval)
+    psutil.cpu_percent(interval=None)  # The first call only sets the baseline
+    next_sample = time.monotonic() + sample_interval
+    next_report = time.monotonic() + check_interval
+
+    # Walking the process table is costlier than the host counters, so
+    # projects are attributed on their own, slower tick
+    attributor = ProjectAttributor() if project_interval else None
+    project_series, project_usage = {}, {}
+    next_attribution = time.monotonic()
+    next_export = time.monotonic()
+    next_flush = time.monotonic() + FLUSH_INTERVAL
+    next_disk_sample = time.monotonic()
+    if exporter:
+        export_droplet_metrics(exporter, droplet)
+
     while True:
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory_percent = psutil.virtual_memory().percent
-        disk_percent = psutil.disk_usage('/').percent
-
-        logging.info(f"CPU usage: {cpu_percent}%")
-        logging.info(f"Memory usage: {memory_percent}%")
-        logging.info(f"Disk usage: {disk_percent}%")
-
-        if cpu_percent > warning_threshold:
-            logging.warning(f"High CPU usage detected: {cpu_percent}%")
-        if memory_percent > warning_threshold:
-            logging.warning(f"High memory usage detected: {memory_percent}%")
-        if disk_percent > warning_threshold:
-            logging.warning(f"High disk usage detected: {disk_percent}%")
-
-        # Get DigitalOcean specific metrics
-        droplet.load()
-        do_cpu_usage = droplet.cpu()
-        do_memory_usage = droplet.memory()
-        do_disk_usage = droplet.disk_usage()
+        time.sleep(max(next_sample - time.monotonic(), 0))
+        now = time.time()
+        if attributor and time.monotonic() >= next_attribution:
+            next_attribution += project_interval
+            project_usage = attributor.sample()
+            for project, usage in project_usage.items():
+                if project not in project_series:
+                    project_series[project] = MetricSeries(project, project_interval)
+                project_series[project].add(now, usage["cpu"])
+                if store:
+                    store.append(f"project.{project}.cpu", now, usage["cpu"])
+            if exporter:
+                export_project_metrics(exporter, project_usage)
+
+        include_disk = time.monotonic() >= next_disk_sample
+        if include_disk:
+            next_disk_sample += disk_interval
+        values = sample_host_metrics(include_disk)
+        for name, value in values.items():
+            series[name].add(now, value)
+            if store:
+                store.append(name, now, value)
+        check_alerts(alerts, now, values, project_usage)
+
+        interval = scheduler.update(max(values[name] for name in VOLATILE_METRICS) / warning_threshold,
+                                    any(alerts[name].firing or alerts[name].pending for name in VOLATILE_METRICS))
+        # Skip ticks rather than bursting if sampling ever fell behind
+        next_sample = max(next_sample + interval, time.monotonic())
+
+        if exporter and time.monotonic() >= next_export:
+            next_export = time.monotonic() + export_interval
+            export_host_metrics(exporter, series)
+
+        if store and time.monotonic() >= next_flush:
+            next_flush += FLUSH_INTERVAL
+            store.flush()
+
+        if time.monotonic() < next_report:
+            continue
+        next_report += check_interval
+        log_rollups(series)
+        log_project_usage(project_series, project_usage)
+
+        # DigitalOcean's own metrics for the same interval, as one range
+        # query per metric, fetched off the sampling thread
+        threading.Thread(target=report_droplet_metrics, args=(droplet, exporter, check_interval), daemon=True).start()
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--metrics-port", type=int, help="Serve OpenMetrics on this port at /metrics")
+    common.add_argument("--metrics-address", default="127.0.0.1",
+                        help="Address the metrics endpoint listens on (0.0.0.0 to allow remote scrapes)")
+    parser = argparse.ArgumentParser(description="Monitor CPU, memory and disk usage of the droplet or the whole fleet.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    host = subparsers.add_parser("host", parents=[common], help="Sample this droplet (the default)")
+    host.add_argument("--threshold", type=float, default=80, help="Warn when usage exceeds this percentage")
+    host.add_argument("--alert-after", type=float, default=30,
+                      help="Seconds usage must stay above the threshold before warning")
+    host.add_argument("--clear-after", type=float, default=60,
+                      help="Seconds usage must stay below the threshold before the warning clears")
+    host.add_argument("--hysteresis", type=float, default=5,
+                      help="Points below the threshold usage must drop to count as cleared")
+    host.add_argument("--interval", type=float, default=60, help="Seconds between logged rollups")
+    host.add_argument("--sample-interval", type=float, default=0.5,
+                      help="Seconds between samples when usage is near the threshold")
+    host.add_argument("--idle-interval", type=float, default=5, help="Seconds between samples when the droplet is idle")
+    host.add_argument("--disk-interval", type=float, default=DISK_INTERVAL, help="Seconds between disk usage samples")
+    host.add_argument("--project-interval", type=float, default=5,
+                      help="Seconds between per-project attribution passes (0 to disable)")
+    host.add_argument("--history-dir", default=DEFAULT_HISTORY_DIR, help="Directory samples are stored in")
+    host.add_argument("--no-history", action="store_true", help="Do not store samples on disk")
+
+    fleet = subparsers.add_parser("fleet", parents=[common], help="Poll DigitalOcean monitoring metrics for every droplet")
+    fleet.add_argument("--tag", help="Only droplets with this tag")
+    fleet.add_argument("--interval", type=float, default=300, help="Seconds between polls of each droplet")
+    fleet.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Droplets queried at the same time")
+
+    query = subparsers.add_parser("query", help="Aggregate stored samples (run without a series to list them)")
+    query.add_argument("series", nargs="?", help="cpu, memory, disk or project.<name>.cpu")
+    query.add_argument("--start", default="24h",
+                       help="ISO date/time or a duration ago such as 90m, 24h or 7d (default: 24h)")
+    query.add_argument("--end", default="now", help="ISO date/time, a duration ago or 'now' (default: now)")
+    query.add_argument("--window", default="1h", help="Aggregation window such as 5m, 1h or 1d (default: 1h)")
+    query.add_argument("--percentile", type=float, action="append",
+                       help="Percentile to report; repeat for several (default: 95)")
+    query.add_argument("--history-dir", default=DEFAULT_HISTORY_DIR, help="Directory samples are stored in")
+
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in subparsers.choices and argv[0] not in ("-h", "--help"):
+        argv.insert(0, "host")
+    args = parser.parse_args(argv)
+
+    if args.command == "query":
+        store = MetricStore(args.history_dir)
+        if not args.series:
+            print("\n".join(store.series()) or f"No stored samples in {args.history_dir}")
+            return
+        try:
+            start, end = parse_time(args.start), parse_time(args.end)
+            window = parse_duration(args.window)
+            if window <= 0:
+                raise ValueError("The window must be longer than zero")
+        except ValueError as e:
+            parser.error(str(e))
+        print_history(store, args.series, start, end, window, args.percentile or [95])
+        return
 
-        logging.info(f"DigitalOcean CPU usage: {do_cpu_usage}")
-        logging.info(f"DigitalOcean Memory usage: {do_memory_usage}")
-        logging.info(f"DigitalOcean Disk usage: {do_disk_usage}")
+    exporter = None
+    if args.metrics_port:
+        exporter = MetricsExporter(args.metrics_port, args.metrics_address)
+        exporter.start()
+        logging.info(f"Serving metrics on http://{args.metrics_address}:{args.metrics_port}/metrics")
 
-        time.sleep(check_interval)
+    if args.command == "fleet":
+        token = os.getenv("DO_TOKEN")
+        if not token:
+            print("DigitalOcean API token not found. Please make sure you've set the DO_TOKEN environment variable.")
+            sys.exit(1)
+        asyncio.run(monitor_fleet(get_client(token), args.tag, args.interval, args.concurrency, exporter))
+    else:
+        store = None if args.no_history else MetricStore(args.history_dir)
+        try:
+            monitor_resources(args.threshold, args.interval, args.sample_interval, args.project_interval, exporter,
+                              store=store, idle_interval=args.idle_interval, alert_after=args.alert_after,
+                              clear_after=args.clear_after, hysteresis=args.hysteresis,
+                              disk_interval=args.disk_interval)
+        finally:
+            if store:
+                store.flush()
 
 if __name__ == "__main__":
-    monitor_resources()
\ No newline at end of file
+    main()
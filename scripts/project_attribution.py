@@ -0,0 +1,163 @@
+import logging
+import re
+import subprocess
+import time
+
+import psutil
+
+PROJECTS_ROOT = "/opt/projects"
+VENVS_ROOT = "/opt/venvs"
+
+# mod_wsgi daemons are named "(wsgi:<group>)" via display-name=%{GROUP};
+# the vhosts use the project name as the group.
+WSGI_PROCESS_NAME = re.compile(r"^\(wsgi:([^)]+)\)")
+PROJECT_PATH = re.compile(rf"^(?:{PROJECTS_ROOT}|{VENVS_ROOT})/([^/]+)(?:/|$)")
+# cgroup v1 (/docker/<id>) and v2 with the systemd driver (docker-<id>.scope)
+DOCKER_CGROUP = re.compile(r"(?:/docker/|/docker-)([0-9a-f]{64})")
+# Blue/green deployments run '<project>-blue' and '<project>-green'
+CONTAINER_SUFFIX = re.compile(r"-(?:blue|green)$")
+# Processes without a project are classified again every this many ticks,
+# since a container or readable /proc entry can appear after they start
+RECLASSIFY_TICKS = 10
+
+
+class ProjectAttributor:
+    """Maps droplet processes to projects and sums their resource usage.
+
+    Process handles and their projects are cached by PID, so a tick only
+    classifies new processes (and unattributed ones every RECLASSIFY_TICKS).
+    """
+
+    def __init__(self):
+        self.processes = {}
+        self.last_io = {}
+        self.containers = {}
+        self.last_tick = None
+        self.ticks = 0
+        self.cpu_count = psutil.cpu_count() or 1
+
+    def _container_project(self, container_id):
+        if container_id not in self.containers:
+            try:
+                result = subprocess.run(["docker", "ps", "--no-trunc", "--format", "{{.ID}} {{.Names}}"],
+                                        capture_output=True, text=True, check=True)
+                for line in result.stdout.splitlines():
+                    full_id, name = line.split(" ", 1)
+                    self.containers[full_id] = CONTAINER_SUFFIX.sub("", name)
+            except (OSError, subprocess.CalledProcessError) as e:
+                logging.debug(f"Could not list Docker containers: {e}")
+            # Remember misses too, so an unknown container is not looked up every tick
+            self.containers.setdefault(container_id, None)
+        return self.containers[container_id]
+
+    def _classify(self, process):
+        with process.oneshot():
+            match = WSGI_PROCESS_NAME.match(process.name())
+            if match:
+                return match.group(1)
+
+            try:
+                with open(f"/proc/{process.pid}/cgroup") as f:
+                    match = DOCKER_CGROUP.search(f.read())
+                if match:
+                    return self._container_project(match.group(1))
+            except OSError:
+                pass
+
+            # A venv interpreter or console script shows up in the command
+            # line; psutil's exe() resolves the venv's symlink to /usr/bin.
+            candidates = []
+            for accessor in (process.cwd, process.exe):
+                try:
+                    candidates.append(accessor())
+                except psutil.AccessDenied:
+                    pass
+            candidates += process.cmdline()[:2]
+            for path in candidates:
+                match = PROJECT_PATH.match(path or "")
+                if match:
+                    return match.group(1)
+
+            # Workers spawned elsewhere still belong to their parent's project
+            parent = self.processes.get(process.ppid())
+            return parent[1] if parent else None
+
+    def _refresh(self):
+        pids = set(psutil.pids())
+        for pid in list(self.processes):
+            if pid not in pids:
+                del self.processes[pid]
+                self.last_io.pop(pid, None)
+
+        self.ticks += 1
+        if self.ticks % RECLASSIFY_TICKS == 0:
+            self.containers = {container_id: project for container_id, project in self.containers.items()
+                               if project is not None}
+            for pid, (process, project) in sorted(self.processes.items()):
+                if project is not None:
+                    continue
+                try:
+                    self.processes[pid] = (process, self._classify(process))
+                except psutil.AccessDenied:
+                    pass
+                except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                    del self.processes[pid]
+                    self.last_io.pop(pid, None)
+
+        for pid in sorted(pids - self.processes.keys()):
+            try:
+                process = psutil.Process(pid)
+                try:
+                    project = self._classify(process)
+                except psutil.AccessDenied:
+                    project = None
+                process.cpu_percent(None)
+                self.processes[pid] = (process, project)
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                continue
+
+    def sample(self):
+        """Per-project usage since the previous call; "cpu" is the share of the whole droplet in percent."""
+        now = time.monotonic()
+        elapsed = now - self.last_tick if self.last_tick else None
+        self.last_tick = now
+        self._refresh()
+
+        try:
+            connections = {}
+            for connection in psutil.net_connections(kind="inet"):
+                if connection.pid:
+                    connections[connection.pid] = connections.get(connection.pid, 0) + 1
+        except psutil.AccessDenied:
+            connections = {}
+
+        usage = {}
+        for pid, (process, project) in list(self.processes.items()):
+            if project is None:
+                continue
+            try:
+                with process.oneshot():
+                    if not process.is_running():
+                        raise psutil.NoSuchProcess(pid)
+                    cpu = process.cpu_percent(None)
+                    rss = process.memory_info().rss
+                    io = process.io_counters()
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                del self.processes[pid]
+                self.last_io.pop(pid, None)
+                continue
+            except psutil.AccessDenied:
+                continue
+
+            totals = usage.setdefault(project, {"cpu": 0.0, "rss": 0, "read_bytes_per_sec": 0.0,
+                                                "write_bytes_per_sec": 0.0, "connections": 0, "processes": 0})
+            totals["cpu"] += cpu / self.cpu_count
+            totals["rss"] += rss
+            totals["connections"] += connections.get(pid, 0)
+            totals["processes"] += 1
+            previous = self.last_io.get(pid)
+            self.last_io[pid] = (io.read_bytes, io.write_bytes)
+            if previous and elapsed:
+                totals["read_bytes_per_sec"] += max(io.read_bytes - previous[0], 0) / elapsed
+                totals["write_bytes_per_sec"] += max(io.write_bytes - previous[1], 0) / elapsed
+        return usage
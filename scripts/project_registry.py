@@ -0,0 +1,223 @@
+# Project registry kept on each droplet in /opt/configs/registry.db. It
+# replaces the loose /opt/configs/<name>.json files: one SQLite table keyed by
+# project name, in WAL mode so readers never wait on the writer. Every change
+# bumps a generation counter in the same transaction, which lets clients keep
+# a local copy and revalidate it with one small call. The random registry id
+# tells a recreated database (same IP, new droplet) from the old one. Used by the droplet
+# agent and by manage_project.sh; standard library only.
+import argparse
+import glob
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+REGISTRY_PATH = "/opt/configs/registry.db"
+CREDENTIALS_SUFFIX = "_do_credentials.json"
+# Columns a deploy may set besides the project type
+FIELDS = ("runtime", "ports", "deploy_hash")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    name TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    runtime TEXT,
+    ports TEXT,
+    deploy_hash TEXT,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value NOT NULL
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('id', lower(hex(randomblob(16))));
+"""
+
+
+def _record(row):
+    name, project_type, runtime, ports, deploy_hash, updated_at = row
+    return {"name": name, "type": project_type, "runtime": runtime,
+            "ports": json.loads(ports) if ports else [], "deploy_hash": deploy_hash, "updated_at": updated_at}
+
+
+class ProjectRegistry:
+    """The droplet's projects, looked up by exact name.
+
+    On first use the /opt/configs/<name>.json files written by older
+    versions of manage_project.sh are imported and removed.
+    """
+
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.lock:
+            self.db.executescript(SCHEMA)
+            self._import_configs(os.path.dirname(path))
+
+    def _import_configs(self, configs_dir):
+        paths = [path for path in sorted(glob.glob(os.path.join(configs_dir, "*.json")))
+                 if not path.endswith(CREDENTIALS_SUFFIX)]
+        if not paths:
+            return
+        imported = []
+        added = 0
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for path in paths:
+                try:
+                    with open(path) as f:
+                        config = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if isinstance(config, dict) and "name" in config and "type" in config:
+                    added += self.db.execute("INSERT OR IGNORE INTO projects (name, type, updated_at) VALUES (?, ?, ?)",
+                                             (config["name"], config["type"], os.path.getmtime(path))).rowcount
+                    imported.append(path)
+            # Other json files stay where they are, so they must not count as a change
+            if added:
+                self._bump()
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        for path in imported:
+            os.remove(path)
+        if imported:
+            logging.info(f"Imported {len(imported)} projects from {configs_dir}")
+
+    def _bump(self):
+        self.db.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+
+    def _state(self):
+        return dict(self.db.execute("SELECT key, value FROM meta WHERE key IN ('id', 'generation')").fetchall())
+
+    def _get(self, name):
+        row = self.db.execute("SELECT name, type, runtime, ports, deploy_hash, updated_at FROM projects "
+                              "WHERE name = ?", (name,)).fetchone()
+        return _record(row) if row else None
+
+    def state(self):
+        """{"id", "generation"}: which registry this is and how many changes it has seen."""
+        with self.lock:
+            return self._state()
+
+    def get(self, name):
+        with self.lock:
+            return self._get(name)
+
+    def list(self):
+        with self.lock:
+            rows = self.db.execute("SELECT name, type, runtime, ports, deploy_hash, updated_at FROM projects "
+                                   "ORDER BY name").fetchall()
+        return [_record(row) for row in rows]
+
+    def snapshot(self, since=None, registry_id=None):
+        """{"id", "generation", "projects"}; "projects" is left out if `registry_id` and `since` are still current."""
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                state = self._state()
+                unchanged = since == state["generation"] and registry_id == state["id"]
+                rows = None if unchanged else self.db.execute(
+                    "SELECT name, type, runtime, ports, deploy_hash, updated_at FROM projects ORDER BY name").fetchall()
+            finally:
+                self.db.execute("COMMIT")
+        if rows is None:
+            return state
+        return dict(state, projects=[_record(row) for row in rows])
+
+    def put(self, name, type=None, **fields):
+        """Create or update `name`; only the given fields change.
+
+        Returns {"id", "generation", "previous_generation", "project"}; the
+        generation before this write lets callers tell whether anyone else
+        wrote in between.
+        """
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown project fields: {', '.join(sorted(unknown))}")
+        if "ports" in fields:
+            fields["ports"] = json.dumps(sorted(int(port) for port in fields["ports"] or []))
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                previous = self._state()["generation"]
+                exists = self.db.execute("SELECT 1 FROM projects WHERE name = ?", (name,)).fetchone()
+                if not exists:
+                    if type is None:
+                        raise ValueError(f"Project {name} does not exist and no type was given")
+                    self.db.execute("INSERT INTO projects (name, type, updated_at) VALUES (?, ?, ?)",
+                                    (name, type, time.time()))
+                elif type is not None:
+                    fields["type"] = type
+                if fields:
+                    assignments = ", ".join(f"{column} = ?" for column in fields)
+                    self.db.execute(f"UPDATE projects SET {assignments}, updated_at = ? WHERE name = ?",
+                                    (*fields.values(), time.time(), name))
+                self._bump()
+                result = dict(self._state(), previous_generation=previous, project=self._get(name))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return result
+
+    def delete(self, name):
+        """Remove `name`; returns {"id", "generation", "previous_generation", "deleted"}."""
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                previous = self._state()["generation"]
+                deleted = self.db.execute("DELETE FROM projects WHERE name = ?", (name,)).rowcount > 0
+                if deleted:
+                    self._bump()
+                result = dict(self._state(), previous_generation=previous, deleted=deleted)
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return result
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read and change the droplet's project registry")
+    parser.add_argument("--db", default=REGISTRY_PATH, help="Registry database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    get_parser = subparsers.add_parser("get", help="Print a project as JSON; exits 1 if it does not exist")
+    get_parser.add_argument("name")
+    subparsers.add_parser("list", help="List the projects")
+    create_parser = subparsers.add_parser("create", help="Register a project")
+    create_parser.add_argument("name")
+    create_parser.add_argument("type")
+    delete_parser = subparsers.add_parser("delete", help="Unregister a project")
+    delete_parser.add_argument("name")
+    args = parser.parse_args()
+
+    registry = ProjectRegistry(args.db)
+    if args.command == "get":
+        project = registry.get(args.name)
+        if project is None:
+            sys.exit(1)
+        print(json.dumps(project))
+    elif args.command == "list":
+        for project in registry.list():
+            print(f"- {project['name']} ({project['type']})")
+    elif args.command == "create":
+        registry.put(args.name, args.type)
+    else:
+        registry.delete(args.name)
+
+
+if __name__ == "__main__":
+    main()
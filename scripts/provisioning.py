@@ -0,0 +1,101 @@
+import hashlib
+import logging
+import shlex
+from ssh_transport import get_transport
+
+CHECKPOINT_ROOT = "/var/lib/do-manager/checkpoints"
+
+# Shared prelude of every compiled provisioning script. A step is skipped when
+# its checkpoint file holds the hash of the exact command it would run, so an
+# edited step re-runs while completed ones are never repeated.
+PRELUDE = r"""
+set -o pipefail
+export DEBIAN_FRONTEND=noninteractive
+mkdir -p "$CHECKPOINTS"
+
+step_done() {
+    [ -f "$CHECKPOINTS/$1.done" ] && [ "$(cat "$CHECKPOINTS/$1.done")" = "$2" ]
+}
+
+run_step() {
+    local name=$1 hash=$2 command=$3
+    if step_done "$name" "$hash"; then
+        echo "[skip] $name (already completed)"
+        return 0
+    fi
+    echo "[run] $name"
+    # stdin is the rest of this script; keep steps from consuming it
+    bash -c "$command" < /dev/null
+    local status=$?
+    if [ $status -ne 0 ]; then
+        echo "[failed] $name (exit status $status)" >&2
+        return $status
+    fi
+    echo "$hash" > "$CHECKPOINTS/$name.done"
+    echo "[done] $name"
+}
+
+# Arguments are name/hash/command triples; each runs in the background with
+# its output in $CHECKPOINTS/<name>.log, and all of them are waited for.
+run_parallel() {
+    local pids=() names=() failed=0
+    while [ $# -gt 0 ]; do
+        local name=$1 hash=$2 command=$3
+        shift 3
+        if step_done "$name" "$hash"; then
+            echo "[skip] $name (already completed)"
+            continue
+        fi
+        echo "[run] $name (in parallel)"
+        run_step "$name" "$hash" "$command" > "$CHECKPOINTS/$name.log" 2>&1 &
+        pids+=($!)
+        names+=("$name")
+    done
+    for i in "${!pids[@]}"; do
+        if wait "${pids[$i]}"; then
+            echo "[done] ${names[$i]}"
+        else
+            echo "[failed] ${names[$i]}, last lines of $CHECKPOINTS/${names[$i]}.log:" >&2
+            tail -n 20 "$CHECKPOINTS/${names[$i]}.log" >&2
+            failed=1
+        fi
+    done
+    return $failed
+}
+"""
+
+
+def _step_args(name, command):
+    command_hash = hashlib.sha256(command.encode('utf-8')).hexdigest()
+    return f"{shlex.quote(name)} {command_hash} {shlex.quote(command)}"
+
+
+def compile_script(name, steps):
+    """Compile provisioning steps into one idempotent bash script.
+
+    `steps` is a list whose items are either a `(step_name, command)` tuple,
+    run in order, or a list of such tuples that are independent of each other
+    and run concurrently. Completed steps are recorded under
+    CHECKPOINT_ROOT/<name> on the droplet, so a re-run resumes after the last
+    step that succeeded.
+    """
+    lines = [f"CHECKPOINTS={CHECKPOINT_ROOT}/{name}", PRELUDE]
+    for step in steps:
+        if isinstance(step, list):
+            lines.append("run_parallel " + " ".join(_step_args(*parallel_step) for parallel_step in step) + " || exit 1")
+        else:
+            lines.append(f"run_step {_step_args(*step)} || exit 1")
+    return "\n".join(lines) + "\n"
+
+
+def run_provisioning(droplet_ip, name, steps, dry_run=False):
+    """Run the compiled script for `steps` on the droplet in a single round trip.
+
+    Raises subprocess.CalledProcessError if any step fails.
+    """
+    script = compile_script(name, steps)
+    if dry_run:
+        logging.info(f"Dry run: Would execute provisioning script '{name}':\n{script}")
+        return
+    get_transport(droplet_ip).run("bash -s", input=script, check=True)
+    logging.info(f"Provisioning script '{name}' completed successfully.")
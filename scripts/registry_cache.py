@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+from agent_client import agent_call
+
+REGISTRY_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  "config", "cache", "registry")
+# A copy confirmed against the droplet this recently is used without asking it again
+MAX_AGE = 30
+
+
+class RegistryCache:
+    """Local copy of one droplet's project registry, kept in config/cache/registry/<host>.json.
+
+    The copy is revalidated with one `project.snapshot` call carrying its
+    generation; the droplet only sends the projects back when the registry
+    changed since. Within MAX_AGE of the last check, and after this client's
+    own writes, lookups need no round trip at all.
+    """
+
+    def __init__(self, host, cache_dir=None):
+        self.host = host
+        self.path = os.path.join(cache_dir or REGISTRY_CACHE_DIR, f"{host}.json")
+        self.lock = threading.Lock()
+        self.registry_id = None
+        self.generation = None
+        self.projects = {}
+        self.checked_at = 0
+        self.round_trips = 0
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+            self.registry_id, self.generation = cached["id"], cached["generation"]
+            self.projects, self.checked_at = cached["projects"], cached["checked_at"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump({"id": self.registry_id, "generation": self.generation, "projects": self.projects,
+                       "checked_at": self.checked_at}, f)
+        os.replace(tmp_path, self.path)
+
+    def _call(self, method, **params):
+        self.round_trips += 1
+        return agent_call(self.host, method, **params)
+
+    def refresh(self, force=False):
+        """Bring the copy up to date; returns False if the droplet has no agent."""
+        with self.lock:
+            if not force and time.time() - self.checked_at < MAX_AGE:
+                return True
+            answered, snapshot = self._call("project.snapshot", since=self.generation, registry_id=self.registry_id)
+            if not answered:
+                return False
+            if "projects" in snapshot:
+                self.projects = {project["name"]: project for project in snapshot["projects"]}
+            self.registry_id, self.generation = snapshot["id"], snapshot["generation"]
+            self.checked_at = time.time()
+            self._save()
+            return True
+
+    def _apply(self, result, name, project):
+        # If the registry was at our generation right before our own write,
+        # nothing else changed in between and the copy is current; otherwise
+        # it is fetched in full on the next lookup
+        with self.lock:
+            current = (result["id"] == self.registry_id and self.generation is not None
+                       and result.get("previous_generation") == self.generation)
+            self.registry_id = result["id"]
+            self.generation = result["generation"] if current else None
+            self.checked_at = time.time() if current else 0
+            if project is None:
+                self.projects.pop(name, None)
+            else:
+                self.projects[name] = project
+            self._save()
+
+    def get(self, name):
+        """(answered, the project's record or None); answered is False without an agent."""
+        if not self.refresh():
+            return False, None
+        return True, self.projects.get(name)
+
+    def list(self):
+        """(answered, every project's record sorted by name)."""
+        if not self.refresh():
+            return False, None
+        return True, [self.projects[name] for name in sorted(self.projects)]
+
+    def create(self, name, project_type):
+        answered, result = self._call("project.create", name=name, type=project_type)
+        if answered:
+            self._apply(result, name, result["project"])
+        return answered, result
+
+    def update(self, name, **fields):
+        answered, result = self._call("project.update", name=name, **fields)
+        if answered:
+            self._apply(result, name, result["project"])
+        return answered, result
+
+    def delete(self, name):
+        answered, result = self._call("project.delete", name=name)
+        if answered:
+            self._apply(result, name, None)
+        return answered, result
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(host):
+    """Return the shared RegistryCache for `host`."""
+    with _registries_lock:
+        if host not in _registries:
+            _registries[host] = RegistryCache(host)
+        return _registries[host]
@@ -0,0 +1,148 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from delta_sync import build_manifest
+from deploy_web_app import deploy_project
+from fleet_inventory import get_tagged_droplet_ips
+
+DEFAULT_CONCURRENCY = 5
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def non_negative_int(value):
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative, got {value}")
+    return number
+
+def deploy_to_host(project_name, project_type, droplet_ip, local_dir, use_docker, local_manifest, blue_green):
+    started = time.monotonic()
+    try:
+        ok = deploy_project(project_name, project_type, droplet_ip, local_dir, use_docker,
+                            interactive=False, gather_info=False, local_manifest=local_manifest,
+                            blue_green=blue_green)
+    except Exception as e:
+        print(f"Unexpected error deploying to {droplet_ip}: {e}")
+        ok = False
+    return {"droplet_ip": droplet_ip, "ok": ok, "seconds": time.monotonic() - started}
+
+def rollout(project_name, project_type, droplet_ips, local_dir, use_docker,
+            concurrency=DEFAULT_CONCURRENCY, canary=1, max_failure_percent=0, blue_green=False):
+    """Deploy one artifact to many droplets.
+
+    The first `canary` droplets are deployed one at a time and any failure
+    there aborts the rollout. The rest go out `concurrency` at a time; once
+    failures exceed `max_failure_percent` of all targets no new deployments
+    are started. Returns (results, aborted) where results holds per-host
+    timings in completion order. A droplet listed twice is deployed once.
+    """
+    if concurrency < 1:
+        raise ValueError(f"concurrency must be at least 1, got {concurrency}")
+    droplet_ips = list(dict.fromkeys(droplet_ips))
+    # The tree is hashed once and the same manifest is diffed against every droplet
+    local_manifest = build_manifest(local_dir)
+    results = []
+
+    canaries, remaining = droplet_ips[:canary], list(droplet_ips[canary:])
+    for droplet_ip in canaries:
+        print(f"\n=== Canary deployment to {droplet_ip} ===")
+        result = deploy_to_host(project_name, project_type, droplet_ip, local_dir, use_docker, local_manifest, blue_green)
+        results.append(result)
+        if not result["ok"]:
+            print(f"Canary deployment to {droplet_ip} failed. Aborting rollout.")
+            return results, True
+
+    def failure_budget_exceeded():
+        failed = sum(1 for result in results if not result["ok"])
+        return failed * 100.0 / len(droplet_ips) > max_failure_percent
+
+    aborted = False
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = set()
+        while remaining or in_flight:
+            while remaining and len(in_flight) < concurrency and not aborted:
+                droplet_ip = remaining.pop(0)
+                in_flight.add(executor.submit(deploy_to_host, project_name, project_type,
+                                              droplet_ip, local_dir, use_docker, local_manifest, blue_green))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                results.append(future.result())
+            if not aborted and failure_budget_exceeded():
+                aborted = True
+                print(f"\nFailure rate exceeded {max_failure_percent}%. "
+                      f"Waiting for {len(in_flight)} in-flight deployment(s) and skipping {len(remaining)} droplet(s).")
+
+    return results, aborted
+
+def print_report(results, droplet_ips, aborted, elapsed):
+    print("\nRollout report:")
+    print(f"{'Droplet':<20} {'Status':<8} {'Seconds':>8}")
+    by_ip = {result["droplet_ip"]: result for result in results}
+    for droplet_ip in droplet_ips:
+        result = by_ip.get(droplet_ip)
+        if result is None:
+            print(f"{droplet_ip:<20} {'skipped':<8} {'-':>8}")
+        else:
+            print(f"{droplet_ip:<20} {'ok' if result['ok'] else 'failed':<8} {result['seconds']:>8.1f}")
+    succeeded = sum(1 for result in results if result["ok"])
+    slowest = max((result["seconds"] for result in results), default=0.0)
+    print(f"\n{succeeded}/{len(droplet_ips)} droplet(s) deployed in {elapsed:.1f}s (slowest host {slowest:.1f}s)"
+          f"{' - rollout aborted' if aborted else ''}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Deploy a project to several droplets in parallel.")
+    parser.add_argument("project_name")
+    parser.add_argument("project_type", choices=["python", "node", "php", "static"])
+    parser.add_argument("local_dir")
+    parser.add_argument("--droplets", help="Comma-separated droplet IP addresses")
+    parser.add_argument("--tag", help="Deploy to every droplet with this DigitalOcean tag (combined with --droplets)")
+    parser.add_argument("--docker", action="store_true", help="Use Docker instead of a virtual environment")
+    parser.add_argument("--blue-green", action="store_true", help="Swap Docker containers without downtime (implies --docker)")
+    parser.add_argument("--concurrency", type=positive_int, default=DEFAULT_CONCURRENCY,
+                        help="Droplets deployed at the same time")
+    parser.add_argument("--canary", type=non_negative_int, default=1, help="Droplets deployed first, one at a time (0 to disable)")
+    parser.add_argument("--max-failure-percent", type=float, default=0,
+                        help="Stop starting new deployments once this percentage of droplets has failed")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.local_dir):
+        print(f"Error: The local directory '{args.local_dir}' does not exist.")
+        sys.exit(1)
+
+    if not args.droplets and not args.tag:
+        parser.error("one of --droplets or --tag is required")
+    droplet_ips = [ip.strip() for ip in (args.droplets or "").split(",") if ip.strip()]
+    if args.tag:
+        token = os.getenv("DO_TOKEN")
+        if not token:
+            print("DigitalOcean API token not found. Please make sure you've set the DO_TOKEN environment variable.")
+            sys.exit(1)
+        droplet_ips += get_tagged_droplet_ips(token, args.tag)
+    # A droplet given with --droplets and also carrying the tag is deployed once
+    droplet_ips = list(dict.fromkeys(droplet_ips))
+
+    if not droplet_ips:
+        print("No droplets to deploy to.")
+        sys.exit(1)
+
+    print(f"Rolling out {args.project_type} project '{args.project_name}' to {len(droplet_ips)} droplet(s) "
+          f"({args.canary} canary, {args.concurrency} at a time)")
+    started = time.monotonic()
+    results, aborted = rollout(args.project_name, args.project_type, droplet_ips, args.local_dir,
+                               args.docker or args.blue_green, args.concurrency, args.canary,
+                               args.max_failure_percent, args.blue_green)
+    print_report(results, droplet_ips, aborted, time.monotonic() - started)
+
+    if aborted or not all(result["ok"] for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import atexit
+import os
+import posixpath
+import socket
+import subprocess
+import sys
+import threading
+
+import paramiko
+
+SSH_USER = "root"
+SSH_PORT = 22
+CONNECT_TIMEOUT = 30
+KEEPALIVE_INTERVAL = 30
+CHUNK_SIZE = 32768
+
+# Exit status used by the ssh client itself when the connection fails, kept so
+# callers can tell transport failures apart from remote command failures.
+SSH_CONNECTION_FAILED = 255
+
+
+def _as_bytes(data):
+    if isinstance(data, str):
+        return data.encode('utf-8')
+    return data
+
+
+def _pump_input(source, sink, close):
+    """Write `source` (str, bytes or a binary file object) to `sink` in chunks."""
+    try:
+        if hasattr(source, 'read'):
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sink(_as_bytes(chunk))
+        elif source:
+            data = _as_bytes(source)
+            for offset in range(0, len(data), CHUNK_SIZE):
+                sink(data[offset:offset + CHUNK_SIZE])
+    finally:
+        close()
+
+
+def _completed(command, returncode, stdout, stderr, text, check):
+    if text:
+        stdout = stdout.decode('utf-8', errors='replace') if stdout is not None else None
+        stderr = stderr.decode('utf-8', errors='replace') if stderr is not None else None
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(command, returncode, stdout, stderr)
+
+
+class SSHTransport:
+    """A single multiplexed SSH connection to one droplet.
+
+    Commands run on their own channel of the shared paramiko transport and
+    file writes go through one SFTP session, so the TCP and key-exchange
+    handshake is paid once per droplet instead of once per command.
+
+    `run` mirrors `subprocess.run`: it returns a `CompletedProcess` and raises
+    `CalledProcessError` when `check=True`, including for connection failures
+    (reported with exit status 255, as the `ssh` client does).
+    """
+
+    def __init__(self, host, user=SSH_USER, port=SSH_PORT, key_filename=None):
+        self.host = host
+        self.user = user
+        self.port = port
+        self.key_filename = key_filename
+        self.commands_run = 0
+        self._client = None
+        self._sftp = None
+        self._lock = threading.Lock()
+        self._sftp_lock = threading.Lock()
+
+    def _transport(self):
+        with self._lock:
+            transport = self._client.get_transport() if self._client else None
+            if transport is None or not transport.is_active():
+                client = paramiko.SSHClient()
+                client.load_system_host_keys()
+                # Same trust model as the `-o StrictHostKeyChecking=no` flag used before
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                client.connect(self.host, port=self.port, username=self.user,
+                               key_filename=self.key_filename, timeout=CONNECT_TIMEOUT)
+                transport = client.get_transport()
+                transport.set_keepalive(KEEPALIVE_INTERVAL)
+                self._client = client
+                self._sftp = None
+            return transport
+
+    def run(self, command, check=False, capture_output=False, text=True, input=None, timeout=None):
+        self.commands_run += 1
+        try:
+            channel = self._transport().open_session(timeout=CONNECT_TIMEOUT)
+        except (paramiko.SSHException, OSError) as e:
+            return _completed(command, SSH_CONNECTION_FAILED, b"", str(e).encode('utf-8'), text, check)
+
+        with channel:
+            channel.settimeout(timeout)
+            channel.exec_command(command)
+            writer = threading.Thread(target=_pump_input,
+                                      args=(input, channel.sendall, channel.shutdown_write),
+                                      daemon=True)
+            writer.start()
+
+            stdout, stderr = [], []
+            stderr_reader = threading.Thread(target=self._drain,
+                                             args=(channel.recv_stderr, stderr, capture_output, sys.stderr),
+                                             daemon=True)
+            stderr_reader.start()
+            self._drain(channel.recv, stdout, capture_output, sys.stdout)
+            stderr_reader.join()
+            writer.join()
+            returncode = channel.recv_exit_status()
+
+        if capture_output:
+            return _completed(command, returncode, b"".join(stdout), b"".join(stderr), text, check)
+        return _completed(command, returncode, None, None, text, check)
+
+    @staticmethod
+    def _drain(recv, chunks, capture, stream):
+        while True:
+            chunk = recv(CHUNK_SIZE)
+            if not chunk:
+                break
+            if capture:
+                chunks.append(chunk)
+            else:
+                stream.write(chunk.decode('utf-8', errors='replace'))
+                stream.flush()
+
+    def _sftp_client(self):
+        transport = self._transport()
+        if self._sftp is None:
+            self._sftp = paramiko.SFTPClient.from_transport(transport)
+        return self._sftp
+
+    def write_file(self, remote_path, content, mode=None):
+        """Atomically replace `remote_path` with `content` over SFTP."""
+        tmp_path = f"{remote_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            with self._sftp_lock:
+                sftp = self._sftp_client()
+                with sftp.open(tmp_path, 'wb') as f:
+                    f.set_pipelined(True)
+                    f.write(_as_bytes(content))
+                if mode is not None:
+                    sftp.chmod(tmp_path, mode)
+                sftp.posix_rename(tmp_path, remote_path)
+        except (paramiko.SSHException, OSError) as e:
+            raise subprocess.CalledProcessError(1, f"sftp put {remote_path}", stderr=str(e))
+
+    def read_file(self, remote_path):
+        try:
+            with self._sftp_lock:
+                with self._sftp_client().open(remote_path, 'rb') as f:
+                    f.prefetch()
+                    return f.read()
+        except (paramiko.SSHException, OSError) as e:
+            raise subprocess.CalledProcessError(1, f"sftp get {remote_path}", stderr=str(e))
+
+    def put_tree(self, local_dir, remote_dir):
+        """Upload every file below `local_dir`, dotfiles included, into `remote_dir`."""
+        try:
+            with self._sftp_lock:
+                sftp = self._sftp_client()
+                for dirpath, dirnames, filenames in os.walk(local_dir):
+                    relative_path = os.path.relpath(dirpath, local_dir)
+                    target_dir = remote_dir if relative_path == '.' else posixpath.join(remote_dir, *relative_path.split(os.sep))
+                    try:
+                        sftp.mkdir(target_dir)
+                    except IOError:
+                        pass  # Already exists
+                    for filename in filenames:
+                        sftp.put(os.path.join(dirpath, filename), posixpath.join(target_dir, filename))
+        except (paramiko.SSHException, OSError) as e:
+            raise subprocess.CalledProcessError(1, f"sftp put -r {local_dir} {remote_dir}", stderr=str(e))
+
+    def open_tunnel(self, port):
+        """Open a stream to `port` on the droplet's loopback interface through this connection."""
+        try:
+            return self._transport().open_channel("direct-tcpip", ("127.0.0.1", port), ("127.0.0.1", 0),
+                                                  timeout=CONNECT_TIMEOUT)
+        except (paramiko.SSHException, OSError) as e:
+            raise subprocess.CalledProcessError(SSH_CONNECTION_FAILED, f"tunnel to port {port}", stderr=str(e))
+
+    def close(self):
+        with self._lock:
+            if self._sftp is not None:
+                self._sftp.close()
+                self._sftp = None
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+class LocalTransport:
+    """In-process backend that treats the local machine as the droplet.
+
+    Commands run through the local shell and file operations hit the local
+    filesystem, which makes the scripts exercisable in a container or CI VM
+    without a real droplet. Select it with `DO_MANAGER_TRANSPORT=local`.
+    """
+
+    def __init__(self, host="localhost"):
+        self.host = host
+        self.commands_run = 0
+
+    def run(self, command, check=False, capture_output=False, text=True, input=None, timeout=None):
+        self.commands_run += 1
+        if hasattr(input, 'read'):
+            input = input.read()
+        result = subprocess.run(["bash", "-c", command], capture_output=capture_output,
+                                input=_as_bytes(input), timeout=timeout)
+        return _completed(command, result.returncode, result.stdout, result.stderr, text, check)
+
+    def write_file(self, remote_path, content, mode=None):
+        tmp_path = f"{remote_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(_as_bytes(content))
+            if mode is not None:
+                os.chmod(tmp_path, mode)
+            os.replace(tmp_path, remote_path)
+        except OSError as e:
+            raise subprocess.CalledProcessError(1, f"write {remote_path}", stderr=str(e))
+
+    def read_file(self, remote_path):
+        try:
+            with open(remote_path, 'rb') as f:
+                return f.read()
+        except OSError as e:
+            raise subprocess.CalledProcessError(1, f"read {remote_path}", stderr=str(e))
+
+    def put_tree(self, local_dir, remote_dir):
+        try:
+            for dirpath, dirnames, filenames in os.walk(local_dir):
+                relative_path = os.path.relpath(dirpath, local_dir)
+                target_dir = os.path.normpath(os.path.join(remote_dir, relative_path))
+                os.makedirs(target_dir, exist_ok=True)
+                for filename in filenames:
+                    with open(os.path.join(dirpath, filename), 'rb') as f:
+                        self.write_file(os.path.join(target_dir, filename), f.read())
+        except OSError as e:
+            raise subprocess.CalledProcessError(1, f"copy -r {local_dir} {remote_dir}", stderr=str(e))
+
+    def open_tunnel(self, port):
+        try:
+            return socket.create_connection(("127.0.0.1", port), timeout=CONNECT_TIMEOUT)
+        except OSError as e:
+            raise subprocess.CalledProcessError(SSH_CONNECTION_FAILED, f"connect to port {port}", stderr=str(e))
+
+    def close(self):
+        pass
+
+
+def _default_factory(host):
+    if os.getenv("DO_MANAGER_TRANSPORT", "ssh") == "local":
+        return LocalTransport(host)
+    return SSHTransport(host, key_filename=os.getenv("DO_MANAGER_SSH_KEY") or None)
+
+
+_transport_factory = _default_factory
+_transports = {}
+_pool_lock = threading.Lock()
+
+
+def get_transport(host):
+    """Return the shared transport for `host`, connecting lazily on first use."""
+    with _pool_lock:
+        transport = _transports.get(host)
+        if transport is None:
+            transport = _transport_factory(host)
+            _transports[host] = transport
+        return transport
+
+
+def set_transport_factory(factory):
+    """Swap the backend used for new connections, e.g. `LocalTransport` or a fake."""
+    global _transport_factory
+    close_all()
+    _transport_factory = factory or _default_factory
+
+
+def close_all():
+    with _pool_lock:
+        transports = list(_transports.values())
+        _transports.clear()
+    for transport in transports:
+        transport.close()
+
+
+atexit.register(close_all)
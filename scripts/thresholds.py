@@ -0,0 +1,75 @@
+# Sampling runs at its fastest once a metric reaches this fraction of its
+# threshold and at its slowest below IDLE_FRACTION, scaling linearly between
+APPROACH_FRACTION = 0.75
+IDLE_FRACTION = 0.5
+# Factor by which the interval may grow per sample when load falls; it
+# shrinks to the target at once
+SLOWDOWN_FACTOR = 1.5
+
+
+class AdaptiveInterval:
+    """Sampling interval that tracks how close the metrics are to their thresholds."""
+
+    def __init__(self, fastest, slowest):
+        self.fastest = fastest
+        self.slowest = max(slowest, fastest)
+        self.interval = fastest
+
+    def update(self, ratio, urgent=False):
+        """Next interval for the highest value/threshold `ratio`; `urgent` (an alert pending or active) forces the fastest."""
+        if urgent or ratio >= APPROACH_FRACTION:
+            target = self.fastest
+        elif ratio <= IDLE_FRACTION:
+            target = self.slowest
+        else:
+            position = (APPROACH_FRACTION - ratio) / (APPROACH_FRACTION - IDLE_FRACTION)
+            target = self.fastest + position * (self.slowest - self.fastest)
+        self.interval = target if target < self.interval else min(target, self.interval * SLOWDOWN_FACTOR)
+        return self.interval
+
+
+class ThresholdAlert:
+    """Fires after `fire_after` seconds above `threshold`, clears after `clear_after` seconds at or below
+    `threshold - hysteresis`."""
+
+    def __init__(self, threshold, fire_after=30, clear_after=60, hysteresis=5):
+        self.threshold = threshold
+        self.fire_after = fire_after
+        self.clear_after = clear_after
+        self.clear_below = threshold - hysteresis
+        self.firing = False
+        self.since = None
+        # When the value first went above the threshold, and its highest value since
+        self.started = None
+        self.peak = None
+
+    @property
+    def pending(self):
+        """True while the alert is waiting out `fire_after` or `clear_after`."""
+        return self.since is not None
+
+    def update(self, timestamp, value):
+        """Feed one sample; returns "fire", "clear" or None."""
+        if not self.firing:
+            if value <= self.threshold:
+                self.since = None
+                return None
+            if self.since is None:
+                self.since = self.started = timestamp
+                self.peak = value
+            self.peak = max(self.peak, value)
+            if timestamp - self.since >= self.fire_after:
+                self.firing, self.since = True, None
+                return "fire"
+            return None
+
+        self.peak = max(self.peak, value)
+        if value > self.clear_below:
+            self.since = None
+            return None
+        if self.since is None:
+            self.since = timestamp
+        if timestamp - self.since >= self.clear_after:
+            self.firing, self.since = False, None
+            return "clear"
+        return None
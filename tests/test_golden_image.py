@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+import unittest
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import golden_image
+import ssh_transport
+from bake_golden_image import BUILDER_TAG, bake_golden_image
+from fake_do_api import start_fake_api
+from fake_droplet import FakeDroplet, fake_transport_factory
+from initial_setup import create_droplet
+
+DROPLET_IP = "192.0.2.10"
+
+
+class GoldenImageTest(unittest.TestCase):
+    """Bake, snapshot and create-from-snapshot against the fake API and a fake droplet."""
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.server, end_point = start_fake_api(boot_seconds=0, action_seconds=0, droplet_ip=DROPLET_IP)
+        self.api = self.server.api
+        self.saved_end_point = os.environ.get("DIGITALOCEAN_END_POINT")
+        os.environ["DIGITALOCEAN_END_POINT"] = end_point
+        # Clients are shared per token, so every test gets its own for this server
+        self.token = f"test-{uuid.uuid4().hex}"
+        self.droplet = FakeDroplet(DROPLET_IP, os.path.join(self.workdir.name, "droplet"), agent=False)
+        self.scripts = []
+        execute = self.droplet.execute
+
+        def recording_execute(command, stdin=b""):
+            if command == "bash -s":
+                self.scripts.append(stdin.decode("utf-8"))
+            return execute(command, stdin)
+        self.droplet.execute = recording_execute
+        ssh_transport.set_transport_factory(fake_transport_factory({DROPLET_IP: self.droplet}))
+        self.saved_record = golden_image.GOLDEN_IMAGE_RECORD
+        golden_image.GOLDEN_IMAGE_RECORD = os.path.join(self.workdir.name, "golden_image.json")
+
+    def tearDown(self):
+        golden_image.GOLDEN_IMAGE_RECORD = self.saved_record
+        ssh_transport.set_transport_factory(None)
+        if self.saved_end_point is None:
+            os.environ.pop("DIGITALOCEAN_END_POINT", None)
+        else:
+            os.environ["DIGITALOCEAN_END_POINT"] = self.saved_end_point
+        self.server.shutdown()
+        self.server.server_close()
+        self.workdir.cleanup()
+
+    def test_bake_snapshots_the_builder_and_destroys_it(self):
+        record = bake_golden_image(self.token, "golden", "nyc1", "s-1vcpu-1gb", "ubuntu-20-04-x64")
+
+        self.assertIn(record["snapshot_id"], self.api.images)
+        self.assertEqual(self.api.images[record["snapshot_id"]]["name"], "golden")
+        self.assertEqual(record["regions"], ["nyc1"])
+        self.assertEqual(golden_image.load_golden_image(), record)
+        # The builder was powered off before the snapshot and destroyed afterwards
+        action_types = [action["type"] for action in self.api.actions.values()]
+        self.assertLess(action_types.index("power_off"), action_types.index("snapshot"))
+        self.assertEqual(self.api.droplets, {})
+        self.assertTrue(any("forget-agent-token" in script for script in self.scripts))
+
+    def test_keep_builder_leaves_it_running(self):
+        bake_golden_image(self.token, "golden", "nyc1", "s-1vcpu-1gb", "ubuntu-20-04-x64", keep_builder=True)
+
+        builders = [droplet for droplet in self.api.droplets.values() if BUILDER_TAG in droplet["tags"]]
+        self.assertEqual(len(builders), 1)
+
+    def test_droplet_from_snapshot_runs_only_the_delta(self):
+        record = bake_golden_image(self.token, "golden", "nyc1", "s-1vcpu-1gb", "ubuntu-20-04-x64")
+        self.scripts.clear()
+
+        droplet = create_droplet(self.token, "web-1", "nyc1", "s-1vcpu-1gb", str(record["snapshot_id"]))
+        golden_image.provision_from_golden_image(droplet)
+
+        # The snapshot ID is sent as a number, as the API expects for snapshots
+        self.assertEqual(self.api.droplets[droplet.id]["image"]["id"], record["snapshot_id"])
+        self.assertEqual(len(self.scripts), 1)
+        self.assertIn("unattended-upgrade", self.scripts[0])
+        self.assertNotIn("apt-get upgrade", self.scripts[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
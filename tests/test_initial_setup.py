@@ -0,0 +1,164 @@
+import functools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import uuid
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import do_actions
+import initial_setup
+import ssh_transport
+from do_client import get_client
+from fake_do_api import start_fake_api
+from fake_droplet import FakeDroplet, FakeTransport
+from initial_setup import SetupError, create_droplet, create_droplets
+from ssh_transport import SSH_CONNECTION_FAILED
+
+
+class UnreachableTransport:
+    """A transport whose sshd never accepts the connection."""
+
+    def __init__(self):
+        self.probes = 0
+
+    def run(self, command, check=False, capture_output=False, text=True, input=None, timeout=None):
+        self.probes += 1
+        return subprocess.CompletedProcess(command, SSH_CONNECTION_FAILED, "", "Connection refused")
+
+    def close(self):
+        pass
+
+
+class CreateDropletTest(unittest.TestCase):
+    """Droplet creation and readiness polling against the fake DigitalOcean API."""
+
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        # Hosts, or names of droplets, that never accept SSH connections
+        self.unreachable = set()
+        self.probed = {}
+        self.start_api(boot_seconds=0, action_seconds=0)
+        self.droplet = FakeDroplet("fake", os.path.join(self.workdir.name, "droplet"), agent=False)
+        ssh_transport.set_transport_factory(self.transport)
+
+    def start_api(self, **kwargs):
+        self.server, end_point = start_fake_api(**kwargs)
+        self.api = self.server.api
+        self.saved_end_point = os.environ.get("DIGITALOCEAN_END_POINT")
+        os.environ["DIGITALOCEAN_END_POINT"] = end_point
+        # Clients are shared per token, so every test gets its own for this server
+        self.token = f"test-{uuid.uuid4().hex}"
+
+    def transport(self, host):
+        names = {droplet["name"] for droplet in self.api.droplets.values() if droplet["_ip"] == host}
+        if host in self.unreachable or names & self.unreachable:
+            self.probed[host] = UnreachableTransport()
+            return self.probed[host]
+        return FakeTransport(self.droplet)
+
+    def tearDown(self):
+        ssh_transport.set_transport_factory(None)
+        if self.saved_end_point is None:
+            os.environ.pop("DIGITALOCEAN_END_POINT", None)
+        else:
+            os.environ["DIGITALOCEAN_END_POINT"] = self.saved_end_point
+        self.server.shutdown()
+        self.server.server_close()
+        self.workdir.cleanup()
+
+    def short_ready_timeout(self, seconds=0.5):
+        return mock.patch.object(initial_setup, "wait_for_droplet",
+                                 functools.partial(do_actions.wait_for_droplet, timeout=seconds))
+
+    def requests_to(self, method, path):
+        return [request for request in self.api.requests if request == (method, path)]
+
+    def test_action_polling_backs_off(self):
+        self.api.action_seconds = 1.0
+        droplet = create_droplet(self.token, "web-1", "nyc1", "s-1vcpu-1gb", "ubuntu-20-04-x64")
+        action = get_client(self.token).perform_action(droplet, "power_off")
+
+        started = time.monotonic()
+        self.assertTrue(do_actions.wait_for_action(action, timeout=5, initial=0.05, maximum=0.3))
+        self.assertGreaterEqual(time.monotonic() - started, 1.0)
+        # Polling every 0.05s for a second would take 20 requests
+        polls = self.requests_to("GET", f"/v2/droplets/{droplet.id}/actions/{action.id}")
+        self.assertLess(len(polls), 10)
+
+    def test_action_polling_gives_up_at_the_timeout(self):
+        self.api.action_seconds = 60
+        droplet = create_droplet(self.token, "web-1", "nyc1", "s-1vcpu-1gb", "ubuntu-20-04-x64")
+        action = get_client(self.token).perform_action(droplet, "power_off")
+
+        started = time.monotonic()
+        self.assertFalse(do_actions.wait_for_action(action, timeout=0.3, initial=0.05, maximum=0.1))
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(action.status, "in-progress")
+
+    def test_backoff_delays_grow_to_the_maximum(self):
+        delays = do_actions.backoff_delays(initial=1, maximum=3, factor=2)
+        self.assertEqual([next(delays) for _ in range(4)], [1, 2, 3, 3])
+
+    def test_ssh_probe_times_out(self):
+        self.unreachable.add("192.0.2.20")
+
+        started = time.monotonic()
+        self.assertFalse(do_actions.wait_until_reachable("192.0.2.20", timeout=0.3, initial=0.05, maximum=0.1))
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertGreater(self.probed["192.0.2.20"].probes, 1)
+
+    def test_unreachable_droplet_is_on_the_error(self):
+        self.unreachable.add("web-1")
+
+        with self.short_ready_timeout(), self.assertRaises(SetupError) as raised:
+            create_droplet(self.token, "web-1", "nyc1", "s-1vcpu-1gb", "ubuntu-20-04-x64")
+        self.assertEqual([droplet.name for droplet in raised.exception.droplets], ["web-1"])
+        self.assertIn(raised.exception.droplets[0].id, self.api.droplets)
+
+    def test_no_names_creates_nothing(self):
+        self.assertEqual(create_droplets(self.token, [], "nyc1", "s-1vcpu-1gb", "ubuntu-20-04-x64"), [])
+        self.assertEqual(self.api.requests, [])
+
+    def test_bulk_creation_is_split_into_api_sized_requests(self):
+        names = [f"web-{i}" for i in range(12)]
+        droplets = create_droplets(self.token, names, "nyc1", "s-1vcpu-1gb", "ubuntu-20-04-x64")
+
+        self.assertEqual([droplet.name for droplet in droplets], names)
+        self.assertEqual(len(self.requests_to("POST", "/v2/droplets")), 2)
+        self.assertEqual(sorted(d["name"] for d in self.api.droplets.values()), sorted(names))
+        self.assertTrue(all(droplet.status == "active" for droplet in droplets))
+
+    def test_failed_request_reports_droplets_of_earlier_requests(self):
+        handle = self.api.handle
+        creates = []
+
+        def fail_second_create(method, path, *args, **kwargs):
+            if (method, path) == ("POST", "/v2/droplets"):
+                creates.append(path)
+                if len(creates) == 2:
+                    return 500, {"id": "server_error", "message": "Injected failure."}, {}
+            return handle(method, path, *args, **kwargs)
+        self.api.handle = fail_second_create
+
+        names = [f"web-{i}" for i in range(12)]
+        with self.assertRaises(SetupError) as raised:
+            create_droplets(self.token, names, "nyc1", "s-1vcpu-1gb", "ubuntu-20-04-x64")
+        self.assertEqual([droplet.name for droplet in raised.exception.droplets], names[:10])
+
+    def test_unready_droplets_fail_and_all_are_reported(self):
+        names = [f"web-{i}" for i in range(3)]
+        self.unreachable.add("web-1")
+        with self.short_ready_timeout(), self.assertRaises(SetupError) as raised:
+            create_droplets(self.token, names, "nyc1", "s-1vcpu-1gb", "ubuntu-20-04-x64")
+        self.assertIn("web-1", str(raised.exception))
+        self.assertNotIn("web-0", str(raised.exception))
+        self.assertEqual([droplet.name for droplet in raised.exception.droplets], names)
+
+
+if __name__ == "__main__":
+    unittest.main()